@@ -0,0 +1,7 @@
+"""
+Benchmarks for FlowPy, using synthetic FCS files and FlowJo workspaces
+
+Run with:
+
+    python -m benchmarks.run --output report.json
+"""
@@ -0,0 +1,354 @@
+"""
+Generators of synthetic FCS files and FlowJo workspaces for benchmarking
+"""
+import numpy as np
+from xml.sax.saxutils import quoteattr
+
+# event values of the generated FCS files are in the range [0, DATA_RANGE)
+DATA_RANGE = 262144
+
+# number of event clusters in the generated data
+CLUSTER_COUNT = 4
+
+CLUSTER_STD = 8000.0
+
+_FCS_DTYPES = {
+    'F': ('f4', 32),
+    'D': ('f8', 64),
+    'I': ('u4', 32)
+}
+
+
+def get_channel_labels(channel_count):
+    """
+    Returns the channel labels of a generated FCS file: 2 scatter channels,
+    fluorescence channels and a Time channel
+
+    :param channel_count: total number of channels, at least 4
+    :return: list of channel labels
+    """
+    if channel_count < 4:
+        raise ValueError("Channel count must be at least 4")
+
+    labels = ['FSC-A', 'SSC-A']
+    labels.extend('FL%d-A' % (i + 1) for i in range(channel_count - 3))
+    labels.append('Time')
+
+    return labels
+
+
+def _get_cluster_centers(channel_count, random_seed):
+    rng = np.random.RandomState(random_seed)
+
+    return rng.uniform(0.2 * DATA_RANGE, 0.8 * DATA_RANGE, (CLUSTER_COUNT, channel_count - 1))
+
+
+def generate_events(event_count, channel_count, random_seed=1, chunk_size=1000000):
+    """
+    Generates synthetic events in chunks, as a mixture of normally distributed
+    clusters in all channels except the Time channel (the last channel), which
+    increases linearly
+
+    :param event_count: total number of events
+    :param channel_count: number of channels, see get_channel_labels
+    :param random_seed: seed for the cluster centers & event values
+    :param chunk_size: maximum number of events per chunk
+    :return: generator of float64 NumPy arrays of events
+    """
+    centers = _get_cluster_centers(channel_count, random_seed)
+    rng = np.random.RandomState(random_seed + 1)
+
+    for start in range(0, event_count, chunk_size):
+        count = min(chunk_size, event_count - start)
+
+        clusters = rng.randint(0, CLUSTER_COUNT, count)
+        chunk = np.empty((count, channel_count))
+        chunk[:, :-1] = centers[clusters] + rng.normal(0, CLUSTER_STD, (count, channel_count - 1))
+        chunk[:, -1] = np.arange(start, start + count) * (float(DATA_RANGE) / max(event_count, 1))
+
+        np.clip(chunk, 0, DATA_RANGE - 1, out=chunk)
+
+        yield chunk
+
+
+def write_fcs(file_path, event_chunks, event_count, channel_labels, data_type='F'):
+    """
+    Writes an FCS 3.1 list mode file, one chunk of events at a time so files
+    larger than memory can be written
+
+    :param file_path: path of the FCS file to write
+    :param event_chunks: iterable of NumPy arrays of events, with a column for
+                         each channel
+    :param event_count: total number of events in event_chunks
+    :param channel_labels: list of PnN channel labels
+    :param data_type: FCS data type, 'F' (float32), 'D' (float64) or 'I'
+                      (32 bit unsigned integer)
+    """
+    if data_type not in _FCS_DTYPES:
+        raise ValueError("FCS data type %s is not supported" % data_type)
+
+    dtype_code, bit_count = _FCS_DTYPES[data_type]
+    dtype = np.dtype('<' + dtype_code)
+    channel_count = len(channel_labels)
+    data_length = event_count * channel_count * dtype.itemsize
+
+    keywords = [
+        ('$BYTEORD', '1,2,3,4'),
+        ('$DATATYPE', data_type),
+        ('$MODE', 'L'),
+        ('$NEXTDATA', '0'),
+        ('$PAR', str(channel_count)),
+        ('$TOT', str(event_count))
+    ]
+
+    for i, label in enumerate(channel_labels):
+        keywords.extend([
+            ('$P%dN' % (i + 1), label),
+            ('$P%dB' % (i + 1), str(bit_count)),
+            ('$P%dE' % (i + 1), '0,0'),
+            ('$P%dR' % (i + 1), str(DATA_RANGE))
+        ])
+
+    text_start = 58
+
+    # the DATA offsets are part of the TEXT segment, so iterate until the
+    # TEXT length (and therefore the DATA offsets) no longer changes
+    data_start = 0
+    while True:
+        data_end = data_start + data_length - 1
+        text = '/' + ''.join(
+            '%s/%s/' % kv for kv in keywords +
+            [('$BEGINDATA', str(data_start)), ('$ENDDATA', str(data_end))]
+        )
+        text_end = text_start + len(text) - 1
+
+        if data_start == text_end + 1:
+            break
+
+        data_start = text_end + 1
+
+    # offsets over 8 digits are only given in the TEXT segment
+    if data_end > 99999999:
+        header_data_start, header_data_end = 0, 0
+    else:
+        header_data_start, header_data_end = data_start, data_end
+
+    header = 'FCS3.1    %8d%8d%8d%8d%8d%8d' % (
+        text_start,
+        text_end,
+        header_data_start,
+        header_data_end,
+        0,
+        0
+    )
+
+    with open(file_path, 'wb') as fcs_file:
+        fcs_file.write(header.ljust(text_start).encode('ascii'))
+        fcs_file.write(text.encode('ascii'))
+
+        written = 0
+        for chunk in event_chunks:
+            if data_type == 'I':
+                chunk = np.round(chunk)
+
+            fcs_file.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+            written += chunk.shape[0]
+
+    if written != event_count:
+        raise ValueError("Wrote %d events, expected %d" % (written, event_count))
+
+
+def generate_fcs(
+        file_path,
+        event_count,
+        channel_count=8,
+        data_type='F',
+        random_seed=1,
+        chunk_size=1000000
+):
+    """
+    Generates a synthetic FCS file, see generate_events
+
+    :return: list of the channel labels
+    """
+    channel_labels = get_channel_labels(channel_count)
+
+    write_fcs(
+        file_path,
+        generate_events(event_count, channel_count, random_seed, chunk_size),
+        event_count,
+        channel_labels,
+        data_type
+    )
+
+    return channel_labels
+
+
+def _polygon_gate_xml(name, x_label, y_label, vertices):
+    vertex_xml = ''.join(
+        '<Vertex x="%r" y="%r" />' % (float(x), float(y)) for x, y in vertices
+    )
+
+    return (
+        '<PolygonGate>'
+        '<ParameterNames><StringArray><String>%s</String><String>%s</String></StringArray>'
+        '</ParameterNames>'
+        '<Polygon name=%s xAxisName="%s" yAxisName="%s">%s</Polygon>'
+        '</PolygonGate>'
+    ) % (x_label, y_label, quoteattr(name), x_label, y_label, vertex_xml)
+
+
+def _boolean_gate_xml(specification, gate_paths):
+    path_xml = ''.join('<String>%s</String>' % p for p in gate_paths)
+
+    return (
+        '<BooleanGate specification=%s>'
+        '<GatePaths><StringArray>%s</StringArray></GatePaths>'
+        '</BooleanGate>'
+    ) % (quoteattr(specification), path_xml)
+
+
+def _random_polygon(rng, center, x_index, y_index):
+    # polygon around a jittered cluster center, so gates select a varying but
+    # non-trivial fraction of their parent population
+    x_center = center[x_index] + rng.normal(0, 0.5 * CLUSTER_STD)
+    y_center = center[y_index] + rng.normal(0, 0.5 * CLUSTER_STD)
+
+    vertex_count = rng.randint(4, 9)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, vertex_count))
+    radii = rng.uniform(1.5, 3.0, vertex_count) * CLUSTER_STD
+
+    return list(zip(x_center + radii * np.cos(angles), y_center + radii * np.sin(angles)))
+
+
+def generate_populations_xml(
+        channel_count,
+        depth=3,
+        fan_out=2,
+        boolean_gate_count=0,
+        random_seed=1
+):
+    """
+    Generates the XML of a gating hierarchy of polygon gates on random pairs
+    of channels, with fan_out child populations for each population down to
+    the given depth. Boolean gates combining random pairs of the polygon gate
+    populations are added at the root level.
+
+    :return: tuple of the populations XML string and the list of population
+             paths
+    """
+    channel_labels = get_channel_labels(channel_count)
+    centers = _get_cluster_centers(channel_count, random_seed)
+    rng = np.random.RandomState(random_seed + 2)
+
+    # gated channels, excluding Time
+    gated_count = channel_count - 1
+    population_paths = []
+
+    def generate_level(parent_path, level, cluster):
+        level_xml = []
+
+        for i in range(fan_out):
+            # child gates target the cluster of their parent gate
+            if cluster is None:
+                gate_cluster = rng.randint(0, CLUSTER_COUNT)
+            else:
+                gate_cluster = cluster
+
+            name = 'P%d' % (i + 1) if level == 1 else '%s.%d' % (parent_path.split('/')[-1], i + 1)
+            path = '%s/%s' % (parent_path, name)
+            population_paths.append(path)
+
+            x_index, y_index = rng.choice(gated_count, 2, replace=False)
+            gate_xml = _polygon_gate_xml(
+                name,
+                channel_labels[x_index],
+                channel_labels[y_index],
+                _random_polygon(rng, centers[gate_cluster], x_index, y_index)
+            )
+
+            if level < depth:
+                children_xml = generate_level(path, level + 1, gate_cluster)
+            else:
+                children_xml = ''
+
+            level_xml.append(
+                '<Population nodeName=%s>%s%s</Population>' % (quoteattr(name), gate_xml, children_xml)
+            )
+
+        return ''.join(level_xml)
+
+    populations_xml = generate_level('', 1, None)
+    polygon_paths = list(population_paths)
+
+    boolean_xml = []
+    for i in range(boolean_gate_count):
+        if len(polygon_paths) < 2:
+            break
+
+        first, second = rng.choice(len(polygon_paths), 2, replace=False)
+        specification = 'G0&!G1' if i % 2 == 0 else 'G0|G1'
+        name = 'B%d' % (i + 1)
+        population_paths.append('/' + name)
+
+        boolean_xml.append(
+            '<Population nodeName=%s>%s</Population>' % (
+                quoteattr(name),
+                _boolean_gate_xml(specification, [polygon_paths[first], polygon_paths[second]])
+            )
+        )
+
+    return populations_xml + ''.join(boolean_xml), population_paths
+
+
+def generate_workspace(
+        file_path,
+        fcs_filenames,
+        event_count,
+        channel_count=8,
+        depth=3,
+        fan_out=2,
+        boolean_gate_count=0,
+        random_seed=1
+):
+    """
+    Generates a FlowJo style XML workspace, with a sample for each FCS file
+    name and a group containing all the samples. The sample and group gating
+    hierarchies are generated with generate_populations_xml.
+
+    Sample IDs are numbered from 1, and the group ID is 1.
+
+    :return: list of the population paths of the gating hierarchy
+    """
+    populations_xml, population_paths = generate_populations_xml(
+        channel_count,
+        depth,
+        fan_out,
+        boolean_gate_count,
+        random_seed
+    )
+
+    sample_refs = ''.join(
+        '<SampleRef sampleID="%d" />' % (i + 1) for i in range(len(fcs_filenames))
+    )
+
+    with open(file_path, 'w') as xml_file:
+        xml_file.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
+        xml_file.write('<Workspace version="3.0"><Groups>')
+        xml_file.write(
+            '<GroupNode groupID="1" nodeName="Synthetic">'
+            '<Group groupID="1"><SampleRefs>%s</SampleRefs></Group>%s</GroupNode>' %
+            (sample_refs, populations_xml)
+        )
+        xml_file.write('</Groups><SampleList>')
+
+        for i, filename in enumerate(fcs_filenames):
+            xml_file.write(
+                '<Sample eventCount="%d" sampleID="%d">'
+                '<SampleNode sampleID="%d" nodeName=%s>%s</SampleNode></Sample>' %
+                (event_count, i + 1, i + 1, quoteattr(filename), populations_xml)
+            )
+
+        xml_file.write('</SampleList></Workspace>\n')
+
+    return population_paths
@@ -0,0 +1,444 @@
+"""
+Runs the FlowPy benchmarks on synthetic data, writing a JSON report of the
+time and peak memory of each stage
+
+Usage:
+
+    python -m benchmarks.run --events 1000000 --output report.json
+    python -m benchmarks.run --output new.json --compare report.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import flowpy
+from flowpy import Sample, Workspace
+from flowpy.models import gate
+from flowpy.models.gating_plan import GatingPlan
+from benchmarks import generate
+
+# modules that importing flowpy, loading samples and gating must not import
+HEAVY_MODULES = ['pandas', 'matplotlib', 'scipy', 'flowutils']
+
+# stages measured in fresh processes, which must not import HEAVY_MODULES
+IMPORT_STAGES = ['import_flowpy', 'import_classes', 'gating_worker']
+
+# measured in a fresh interpreter, printing the seconds taken by the
+# statements and the heavy modules imported
+IMPORT_BENCHMARK_CODE = """
+import json
+import sys
+import time
+start = time.perf_counter()
+%s
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'modules': [m for m in %r if m in sys.modules]}))
+"""
+
+# a worker that loads an FCS file (argv[1]) and counts the gated events of
+# a workspace group (argv[2])
+GATING_WORKER_STATEMENTS = """
+from flowpy import Sample, Workspace
+s = Sample(sys.argv[1])
+s.compensate_events(None)
+plan = Workspace(sys.argv[2]).get_gating_plan('group', '1', s.channels)
+plan.apply(s.events_compensated).get_count(plan.nodes[0].path)
+"""
+
+
+def measure(setup, func, repeat=3):
+    """
+    Measures a benchmark stage. Each repetition calls setup (not measured)
+    and passes its return value to func. Times are measured without tracing,
+    then the peak memory allocated by func is measured in an additional
+    traced run (memory mapped file data is not included).
+
+    :param setup: function returning the input of func
+    :param func: function to measure
+    :param repeat: number of timed repetitions
+    :return: dictionary of the stage results
+    """
+    times = []
+
+    try:
+        for _ in range(repeat):
+            state = setup()
+            start = time.perf_counter()
+            func(state)
+            times.append(time.perf_counter() - start)
+
+        state = setup()
+        tracemalloc.start()
+        try:
+            func(state)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        return {'error': "%s: %s" % (type(e).__name__, e)}
+
+    return {
+        'times': times,
+        'min_seconds': min(times),
+        'median_seconds': float(np.median(times)),
+        'peak_memory_bytes': peak_memory
+    }
+
+
+def measure_import(statements, repeat=3, args=()):
+    """
+    Measures Python statements (e.g. imports) in fresh interpreter processes,
+    so no modules are already imported
+
+    :param statements: Python statements, sys is imported
+    :param repeat: number of timed repetitions
+    :param args: command line arguments of the statements (sys.argv[1:])
+    :return: dictionary of the stage results, with the 'heavy_modules' (see
+             HEAVY_MODULES) imported by the statements
+    """
+    code = IMPORT_BENCHMARK_CODE % (statements, HEAVY_MODULES)
+    times = []
+
+    try:
+        for _ in range(repeat):
+            output = subprocess.check_output(
+                [sys.executable, '-c', code] + list(args),
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                stderr=subprocess.DEVNULL
+            )
+            result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            times.append(result['seconds'])
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        return {'error': "%s: %s" % (type(e).__name__, e)}
+
+    return {
+        'times': times,
+        'min_seconds': min(times),
+        'median_seconds': float(np.median(times)),
+        'peak_memory_bytes': 0,
+        'heavy_modules': result['modules']
+    }
+
+
+def _get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compensated_sample(fcs_path):
+    s = Sample(fcs_path)
+    s.generate_subsample(0, random_seed=123)
+    s.compensate_events(None)
+    s.events_compensated
+
+    return s
+
+
+def _find_root_gates(populations, gate_type):
+    return [
+        population['gates'][0]
+        for population in populations.values()
+        if len(population['gates']) > 0 and population['gates'][0].get('type') == gate_type
+    ]
+
+
+def run_benchmarks(
+        data_dir,
+        event_count,
+        channel_count,
+        data_type,
+        depth,
+        fan_out,
+        boolean_gate_count,
+        workspace_sample_count,
+        repeat
+):
+    """
+    Generates the synthetic data in data_dir and measures each stage
+
+    :return: dictionary of stage results keyed by stage name
+    """
+    fcs_path = os.path.join(data_dir, 'synthetic.fcs')
+    xml_path = os.path.join(data_dir, 'synthetic.xml')
+
+    generate.generate_fcs(fcs_path, event_count, channel_count, data_type)
+
+    fcs_filenames = ['synthetic.fcs'] + [
+        'synthetic_%d.fcs' % i for i in range(2, workspace_sample_count + 1)
+    ]
+    generate.generate_workspace(
+        xml_path,
+        fcs_filenames,
+        event_count,
+        channel_count,
+        depth,
+        fan_out,
+        boolean_gate_count
+    )
+
+    def no_setup():
+        return None
+
+    def subsampled_sample():
+        s = Sample(fcs_path)
+        s.generate_subsample(0, random_seed=123)
+        s.events_subsampled
+
+        return s
+
+    def compensate(s):
+        s.compensate_events(None)
+        s.events_compensated
+
+    def transform_logicle(s):
+        s.transform_logicle()
+        s.events_transformed
+
+    def transform_asinh(s):
+        s.transform_asinh()
+        s.events_transformed
+
+    ws = Workspace(xml_path)
+    populations = ws.groups['1']['populations']
+
+    def gated_populations():
+        # a gated copy, so the gate results don't stay in the workspace's
+        # populations (measured by the later stages)
+        s = _compensated_sample(fcs_path)
+        gated = copy.deepcopy(populations)
+        gate.apply_gating_hierarchy(s.events_compensated, s.channels, gated)
+
+        return s, gated, _find_root_gates(gated, 'Boolean')
+
+    polygon_gate = _find_root_gates(populations, 'Polygon')[0]
+    boolean_gates = _find_root_gates(populations, 'Boolean')
+
+    stages = [
+        ('sample_load', no_setup, lambda _: Sample(fcs_path)),
+        ('sample_load_memory_map', no_setup, lambda _: Sample(fcs_path, memory_map=True)),
+        (
+            'subsample',
+            lambda: Sample(fcs_path),
+            lambda s: (
+                s.generate_subsample(event_count // 10, random_seed=123),
+                s.events_subsampled
+            )
+        ),
+        ('compensate_events', subsampled_sample, compensate),
+        ('transform_logicle', lambda: _compensated_sample(fcs_path), transform_logicle),
+        ('transform_asinh', lambda: _compensated_sample(fcs_path), transform_asinh),
+        (
+            'parse_polygon_gate',
+            lambda: _compensated_sample(fcs_path),
+            lambda s: gate.parse_polygon_gate(s.events_compensated, s.channels, polygon_gate)
+        ),
+        (
+            'parse_boolean_gates',
+            gated_populations,
+            lambda state: gate.parse_boolean_gates(state[0].events_compensated, state[1], state[2])
+        ),
+        ('workspace_parse', no_setup, lambda _: Workspace(xml_path)),
+        (
+            'gating_plan_compile',
+            lambda: _compensated_sample(fcs_path),
+            lambda s: GatingPlan(populations, s.channels)
+        ),
+        (
+            'analyze_sample',
+            no_setup,
+            lambda _: ws.analyze_sample(fcs_path, None, 'group', '1')
+        )
+    ]
+
+    results = {
+        'import_flowpy': measure_import('import flowpy', repeat),
+        'import_classes': measure_import('from flowpy import Sample, Workspace', repeat),
+        'gating_worker': measure_import(GATING_WORKER_STATEMENTS, repeat, (fcs_path, xml_path))
+    }
+
+    for name, setup, func in stages:
+        if name == 'parse_boolean_gates' and len(boolean_gates) == 0:
+            continue
+
+        results[name] = measure(setup, func, repeat)
+
+    return results
+
+
+def check_imports(stages):
+    """
+    Checks the import stages (see IMPORT_STAGES) of benchmark results
+
+    :param stages: dictionary of the stage results of run_benchmarks
+    :return: list of error messages, for each import stage that failed or
+             imported any HEAVY_MODULES
+    """
+    errors = []
+
+    for stage in IMPORT_STAGES:
+        result = stages.get(stage)
+
+        if result is None:
+            continue
+        elif 'error' in result:
+            errors.append('%s failed: %s' % (stage, result['error']))
+        elif len(result['heavy_modules']) > 0:
+            errors.append('%s imports %s' % (stage, ', '.join(result['heavy_modules'])))
+
+    return errors
+
+
+def compare_reports(baseline, report):
+    """
+    Compares the stage results of two benchmark reports
+
+    :return: list of (stage, baseline seconds, seconds, time ratio, memory
+             ratio) tuples, ratios are None if unavailable
+    """
+    comparison = []
+
+    for stage, result in report['stages'].items():
+        baseline_result = baseline['stages'].get(stage, {})
+
+        if 'min_seconds' not in result or 'min_seconds' not in baseline_result:
+            comparison.append((stage, None, result.get('min_seconds'), None, None))
+            continue
+
+        time_ratio = result['min_seconds'] / baseline_result['min_seconds']
+
+        if baseline_result['peak_memory_bytes'] > 0:
+            memory_ratio = float(result['peak_memory_bytes']) / baseline_result['peak_memory_bytes']
+        else:
+            memory_ratio = None
+
+        comparison.append(
+            (stage, baseline_result['min_seconds'], result['min_seconds'], time_ratio, memory_ratio)
+        )
+
+    return comparison
+
+
+def _format_value(value, value_format):
+    if value is None:
+        return '-'
+
+    return value_format % value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run FlowPy benchmarks on synthetic data')
+    parser.add_argument('--events', type=int, default=1000000, help='number of events')
+    parser.add_argument('--channels', type=int, default=8, help='number of channels')
+    parser.add_argument(
+        '--data-type',
+        default='F',
+        choices=['F', 'D', 'I'],
+        help='FCS data type'
+    )
+    parser.add_argument('--depth', type=int, default=3, help='gating hierarchy depth')
+    parser.add_argument('--fan-out', type=int, default=2, help='child gates per population')
+    parser.add_argument('--booleans', type=int, default=4, help='number of boolean gates')
+    parser.add_argument(
+        '--workspace-samples',
+        type=int,
+        default=100,
+        help='number of samples in the workspace'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions per stage')
+    parser.add_argument(
+        '--data-dir',
+        help='directory for the synthetic data, kept after the run (default: temporary)'
+    )
+    parser.add_argument('--output', help='path of the JSON report')
+    parser.add_argument('--compare', help='path of a baseline JSON report to compare against')
+    args = parser.parse_args(argv)
+
+    parameters = {
+        'event_count': args.events,
+        'channel_count': args.channels,
+        'data_type': args.data_type,
+        'depth': args.depth,
+        'fan_out': args.fan_out,
+        'boolean_gate_count': args.booleans,
+        'workspace_sample_count': args.workspace_samples,
+        'repeat': args.repeat
+    }
+
+    if args.data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix='flowpy_benchmark_')
+    else:
+        data_dir = args.data_dir
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+
+    try:
+        stages = run_benchmarks(data_dir=data_dir, **parameters)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'git_commit': _get_git_commit(),
+        'flowpy_path': os.path.dirname(os.path.abspath(flowpy.__file__)),
+        'python_version': platform.python_version(),
+        'numpy_version': np.__version__,
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'stages': stages
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        print('%-24s %12s %12s %8s %8s' % ('stage', 'baseline_s', 'seconds', 'time_x', 'mem_x'))
+        for stage, baseline_seconds, seconds, time_ratio, memory_ratio in compare_reports(
+                baseline, report
+        ):
+            print('%-24s %12s %12s %8s %8s' % (
+                stage,
+                _format_value(baseline_seconds, '%.4f'),
+                _format_value(seconds, '%.4f'),
+                _format_value(time_ratio, '%.2f'),
+                _format_value(memory_ratio, '%.2f')
+            ))
+    else:
+        for stage, result in stages.items():
+            if 'error' in result:
+                print('%-24s %s' % (stage, result['error']))
+            else:
+                print('%-24s %10.4f s %12d bytes' % (
+                    stage,
+                    result['min_seconds'],
+                    result['peak_memory_bytes']
+                ))
+
+    for error in check_imports(stages):
+        print('ERROR: %s' % error)
+
+    return report
+
+
+if __name__ == '__main__':
+    # exits with an error status if importing flowpy, or loading & gating a
+    # sample, imports heavy modules, so import regressions fail the run
+    if len(check_imports(main(sys.argv[1:])['stages'])) > 0:
+        sys.exit(1)
@@ -1,2 +1,24 @@
-from flowpy.models.sample import Sample as Sample
-from flowpy.models.workspace import Workspace as Workspace
+import importlib
+
+# Sample & Workspace are imported on first access (PEP 562), so importing
+# flowpy (e.g. in worker processes) only loads the modules that are used
+_LAZY_ATTRIBUTES = {
+    'Sample': 'flowpy.models.sample',
+    'Workspace': 'flowpy.models.workspace'
+}
+
+__all__ = ['Sample', 'Workspace']
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module 'flowpy' has no attribute '%s'" % name)
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
@@ -0,0 +1,336 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+def _hash_file(file_path, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+
+    with open(file_path, 'rb') as fh:
+        block = fh.read(block_size)
+        while len(block) > 0:
+            sha1.update(block)
+            block = fh.read(block_size)
+
+    return sha1.hexdigest()
+
+
+def write_atomic(path, write_func):
+    """
+    Writes a file by calling write_func with a binary file handle, writing to
+    a temporary file in the same directory then renaming it, so readers never
+    see a partially written file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            write_func(fh)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def hash_text(text):
+    """
+    Returns the SHA-1 hex digest of a text string, used to key cached arrays
+    by the parameters that produced them (e.g. a compensation matrix)
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class SampleCache(object):
+    """
+    Persistent on-disk cache of parsed FCS sample data and derived arrays
+
+    Entries are keyed by the SHA-1 hash of the FCS file content, and store
+    the raw events, metadata and channel labels of the file along with any
+    derived arrays (e.g. compensated events) as .npy files, which are memory
+    mapped when loaded. A small record per FCS file path, size & modification
+    time maps files to their content hash. The cache is bounded to max_bytes
+    (including the file records), evicting the least recently used entries
+    first along with their file records, and the records of files that have
+    changed or been removed. The cache directory can be shared by multiple
+    processes.
+    """
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        """
+        :param cache_dir: cache directory, created if it doesn't exist
+        :param max_bytes: maximum total size of the cached files (entries &
+                          file records) in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        for sub_dir in ('entries', 'files'):
+            path = os.path.join(cache_dir, sub_dir)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, 'entries', key)
+
+    def get_file_key(self, fcs_file_path):
+        """
+        Returns the cache key (content hash) of an FCS file. The hash is
+        remembered by file path, size and modification time, so unchanged
+        files are not re-read.
+
+        :param fcs_file_path: path to FCS file
+        :return: cache key string
+        """
+        stat = os.stat(fcs_file_path)
+        stat_key = hash_text(
+            '%s|%d|%d' % (os.path.abspath(fcs_file_path), stat.st_size, stat.st_mtime_ns)
+        )
+        stat_path = os.path.join(self.cache_dir, 'files', stat_key)
+
+        try:
+            with open(stat_path, 'r') as fh:
+                return json.load(fh)['key']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            # not recorded yet, removed by another process or unreadable
+            pass
+
+        key = _hash_file(fcs_file_path)
+        # the source file is recorded, so the record can be removed once the
+        # file changes (see evict)
+        record = json.dumps({
+            'key': key,
+            'path': os.path.abspath(fcs_file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns
+        })
+        write_atomic(stat_path, lambda fh: fh.write(record.encode('utf-8')))
+
+        return key
+
+    def _touch(self, key):
+        try:
+            os.utime(self._entry_dir(key), None)
+        except OSError:
+            pass
+
+    def load_sample(self, key):
+        """
+        Load the cached data of an FCS file
+
+        :param key: cache key from get_file_key
+        :return: dictionary with the 'raw_events' (memory mapped, read-only),
+                 'metadata' and 'channels' or None if not cached
+        """
+        entry_dir = self._entry_dir(key)
+        info_path = os.path.join(entry_dir, 'sample.json')
+
+        if not os.path.exists(info_path):
+            return None
+
+        try:
+            with open(info_path, 'r') as fh:
+                info = json.load(fh)
+
+            raw_events = np.load(os.path.join(entry_dir, 'raw_events.npy'), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            # entry evicted or incomplete
+            return None
+
+        self._touch(key)
+
+        return {
+            'raw_events': raw_events,
+            'metadata': info['metadata'],
+            'channels': info['channels']
+        }
+
+    def store_sample(self, key, raw_events, metadata, channels):
+        """
+        Store the parsed data of an FCS file
+
+        :param key: cache key from get_file_key
+        :param raw_events: NumPy array of raw events
+        :param metadata: FCS text dictionary
+        :param channels: dictionary of channel labels
+        """
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+
+        info = json.dumps({'metadata': metadata, 'channels': channels})
+
+        write_atomic(
+            os.path.join(entry_dir, 'raw_events.npy'),
+            lambda fh: np.save(fh, np.asarray(raw_events))
+        )
+        # written last, marks the entry as complete
+        write_atomic(
+            os.path.join(entry_dir, 'sample.json'),
+            lambda fh: fh.write(info.encode('utf-8'))
+        )
+
+        self.evict(keep=key)
+
+    def load_array(self, key, name):
+        """
+        Load a derived array of a cached FCS file
+
+        :param key: cache key from get_file_key
+        :param name: array name
+        :return: memory mapped, read-only NumPy array or None if not cached
+        """
+        try:
+            array = np.load(os.path.join(self._entry_dir(key), name + '.npy'), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+
+        self._touch(key)
+
+        return array
+
+    def store_array(self, key, name, array):
+        """
+        Store a derived array of a cached FCS file
+
+        :param key: cache key from get_file_key
+        :param name: array name
+        :param array: NumPy array
+        """
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+
+        write_atomic(
+            os.path.join(entry_dir, name + '.npy'),
+            lambda fh: np.save(fh, np.asarray(array))
+        )
+
+        self.evict(keep=key)
+
+    def get_size(self):
+        """
+        Returns the total size in bytes of the cached entries & file records
+        """
+        return sum(size for _, _, size in self._list_entries()) + \
+            sum(size for _, _, size in self._list_file_records())
+
+    def _list_file_records(self):
+        """
+        Returns a list of (record path, record, size) tuples of the file
+        records, records that can't be read have a None record
+        """
+        files_dir = os.path.join(self.cache_dir, 'files')
+        records = []
+
+        for name in os.listdir(files_dir):
+            # files being written by write_atomic
+            if name.endswith('.tmp'):
+                continue
+
+            record_path = os.path.join(files_dir, name)
+
+            try:
+                size = os.path.getsize(record_path)
+                with open(record_path, 'r') as fh:
+                    record = json.load(fh)
+            except OSError:
+                # removed by another process
+                continue
+            except ValueError:
+                record = None
+
+            if not isinstance(record, dict):
+                record = None
+
+            records.append((record_path, record, size))
+
+        return records
+
+    @staticmethod
+    def _is_stale_record(record):
+        """
+        Returns True if the source file of a file record has changed or been
+        removed (or the record can't be read)
+        """
+        try:
+            stat = os.stat(record['path'])
+            return stat.st_size != record['size'] or stat.st_mtime_ns != record['mtime_ns']
+        except (OSError, KeyError, TypeError):
+            return True
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _list_entries(self):
+        entries_dir = os.path.join(self.cache_dir, 'entries')
+        entries = []
+
+        for key in os.listdir(entries_dir):
+            entry_dir = os.path.join(entries_dir, key)
+
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir)
+                )
+                last_access = os.stat(entry_dir).st_mtime
+            except OSError:
+                # removed by another process
+                continue
+
+            entries.append((last_access, key, size))
+
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache size is within
+        max_bytes
+
+        :param keep: optional key of an entry that is never evicted
+        """
+        # file records by cache key, without the records of changed files
+        records_by_key = {}
+        total_size = 0
+
+        for record_path, record, size in self._list_file_records():
+            if self._is_stale_record(record):
+                self._remove_file(record_path)
+                continue
+
+            records_by_key.setdefault(record['key'], []).append((record_path, size))
+            total_size += size
+
+        entries = sorted(self._list_entries())
+        total_size += sum(size for _, _, size in entries)
+
+        for _, key, size in entries:
+            if total_size <= self.max_bytes:
+                break
+
+            if key == keep:
+                continue
+
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total_size -= size
+
+            # the file records of the entry are evicted with it
+            for record_path, record_size in records_by_key.pop(key, ()):
+                self._remove_file(record_path)
+                total_size -= record_size
+
+    def clear(self):
+        """
+        Remove all cached entries & file records
+        """
+        for _, key, _ in self._list_entries():
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+        for record_path, _, _ in self._list_file_records():
+            self._remove_file(record_path)
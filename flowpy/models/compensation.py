@@ -0,0 +1,213 @@
+import hashlib
+import numpy as np
+
+# number of events compensated per block, bounding the temporary arrays
+COMPENSATION_CHUNK_SIZE = 65536
+
+# channels never included in an identity compensation
+NON_FLUORO_CHANNELS = [
+    'FSC-A',
+    'FSC-H',
+    'FSC-W',
+    'SSC-A',
+    'SSC-H',
+    'SSC-W',
+    'Time',
+    'Index'
+]
+
+
+class Compensation(object):
+    """
+    A spillover matrix for a set of fluorescence channels, with its inverse
+    computed once so it can be applied to any number of samples
+
+    Compensated events are the fluorescence columns of the events multiplied
+    by the inverse of the spillover matrix (same as flowutils.compensate).
+    Instances are immutable and can be shared across a batch, including
+    between processes.
+    """
+    def __init__(self, spillover, channel_labels):
+        """
+        :param spillover: square spillover matrix (list of rows or NumPy
+                          array), rows & columns ordered by channel_labels
+        :param channel_labels: list of the PnN labels of the fluorescence
+                               channels of the matrix
+        """
+        spillover = np.array(spillover, dtype=np.float64)
+
+        if spillover.ndim != 2 or spillover.shape[0] != spillover.shape[1]:
+            raise ValueError("Spillover matrix must be square")
+        if spillover.shape[0] != len(channel_labels):
+            raise ValueError("Spillover matrix size doesn't match the number of channel labels")
+
+        self.spillover = spillover
+        self.spillover.flags.writeable = False
+        self.channel_labels = tuple(channel_labels)
+
+        self.inverse = np.linalg.inv(spillover)
+        self.inverse.flags.writeable = False
+
+        sha1 = hashlib.sha1()
+        sha1.update('\t'.join(self.channel_labels).encode('utf-8'))
+        sha1.update(spillover.tobytes())
+        self.key = sha1.hexdigest()
+
+        self._fluoro_indices = {}
+
+    def __repr__(self):
+        return "Compensation(%s)" % self.key
+
+    def __eq__(self, other):
+        return isinstance(other, Compensation) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_fluoro_indices'] = {}
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.spillover.flags.writeable = False
+        self.inverse.flags.writeable = False
+
+    @classmethod
+    def from_text(cls, matrix_text):
+        """
+        Parse a tab delimited matrix text, with a header row of the PnN
+        channel labels followed by the matrix rows
+        """
+        # split lines by \r or \n, and values by \t
+        lines = [line.split('\t') for line in matrix_text.strip().splitlines()]
+
+        return cls([[float(v) for v in line] for line in lines[1:]], lines[0])
+
+    @classmethod
+    def from_spillover_keyword(cls, spillover_text):
+        """
+        Parse the value of the FCS $SPILLOVER (or $SPILL) keyword: the number
+        of channels n, the n channel labels and the n x n matrix values (by
+        row), all comma separated
+        """
+        values = [v.strip() for v in spillover_text.split(',')]
+        n = int(values[0])
+
+        if len(values) != 1 + n + n * n:
+            raise ValueError("Invalid spillover keyword value")
+
+        labels = values[1:n + 1]
+        matrix = np.array(values[n + 1:], dtype=np.float64).reshape(n, n)
+
+        return cls(matrix, labels)
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """
+        Returns the compensation defined by the spillover keyword in FCS
+        metadata, or None if the metadata has no spillover keyword
+
+        :param metadata: FCS text dictionary (as in Sample.metadata)
+        """
+        for key in ('spillover', 'spill', '$SPILLOVER', 'SPILL', '$SPILL'):
+            value = metadata.get(key)
+
+            if value is not None and value.strip() != '':
+                return cls.from_spillover_keyword(value)
+
+        return None
+
+    @classmethod
+    def identity(cls, channels):
+        """
+        Returns an identity compensation for the fluorescence channels of a
+        sample, i.e. all channels except scatter, Time and Index channels
+
+        :param channels: dictionary of channel labels (keys are channel #'s)
+        """
+        labels = [
+            (int(c), labels['PnN']) for c, labels in channels.items()
+            if labels['PnN'] not in NON_FLUORO_CHANNELS
+        ]
+        labels.sort()
+
+        return cls(np.identity(len(labels)), [label for _, label in labels])
+
+    def get_fluoro_indices(self, channels):
+        """
+        Returns the column indices of the matrix channels in a sample's events,
+        cached by channel layout
+
+        :param channels: dictionary of channel labels (keys are channel #'s)
+        :return: list of column indices, in the order of the matrix
+        """
+        layout = tuple(sorted((int(c), labels['PnN']) for c, labels in channels.items()))
+
+        if layout not in self._fluoro_indices:
+            channel_map = dict((label, number) for number, label in layout)
+
+            try:
+                indices = [channel_map[label] - 1 for label in self.channel_labels]
+            except KeyError:
+                raise KeyError("Compensation matrix labels do not match FCS file!")
+
+            self._fluoro_indices[layout] = indices
+
+        return list(self._fluoro_indices[layout])
+
+    def apply(self, events, fluoro_indices, in_place=False):
+        """
+        Compensate events
+
+        :param events: NumPy array of events
+        :param fluoro_indices: column indices of the matrix channels in events
+                               (see get_fluoro_indices)
+        :param in_place: if True, events are compensated in place (events must
+                         be a writable floating point array), otherwise a
+                         compensated copy is returned
+        :return: NumPy array of compensated events, with the dtype of events
+                 for floating point events
+        """
+        if not in_place:
+            if np.issubdtype(events.dtype, np.floating):
+                events = np.array(events)
+            else:
+                events = np.array(events, dtype=np.float64)
+
+        fluoro_indices = list(fluoro_indices)
+
+        for start in range(0, events.shape[0], COMPENSATION_CHUNK_SIZE):
+            rows = slice(start, start + COMPENSATION_CHUNK_SIZE)
+            events[rows, fluoro_indices] = np.dot(events[rows, fluoro_indices], self.inverse)
+
+        return events
+
+
+# parsed compensations of matrix texts, so repeated analyses with the same
+# matrix text don't parse & invert it again
+_text_compensations = {}
+_TEXT_CACHE_SIZE = 64
+
+
+def get_compensation(compensation_matrix):
+    """
+    Returns a Compensation for a compensation matrix given as a tab delimited
+    text (see Compensation.from_text, parsed once per text) or a Compensation
+    (returned unchanged). Returns None for None.
+    """
+    if compensation_matrix is None or isinstance(compensation_matrix, Compensation):
+        return compensation_matrix
+
+    if compensation_matrix not in _text_compensations:
+        if len(_text_compensations) >= _TEXT_CACHE_SIZE:
+            _text_compensations.clear()
+
+        _text_compensations[compensation_matrix] = Compensation.from_text(compensation_matrix)
+
+    return _text_compensations[compensation_matrix]
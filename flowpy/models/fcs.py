@@ -0,0 +1,185 @@
+import os
+import re
+import numpy as np
+
+
+def _read_bytes(fh, start, stop):
+    """Read in bytes from start to stop inclusive."""
+    fh.seek(start)
+
+    return fh.read(stop - start + 1)
+
+
+def _parse_header(fh):
+    header = {
+        'version': float(_read_bytes(fh, 3, 5)),
+        'text_start': int(_read_bytes(fh, 10, 17)),
+        'text_stop': int(_read_bytes(fh, 18, 25)),
+        'data_start': int(_read_bytes(fh, 26, 33)),
+        'data_end': int(_read_bytes(fh, 34, 41))
+    }
+
+    return header
+
+
+def _parse_pairs(text):
+    """
+    Return key/value pairs from a delimited string. Keys are lower case with
+    the '$' removed, the same as the text dictionary of flowio.FlowData
+    """
+    delimiter = text[0]
+
+    if delimiter == r'|':
+        delimiter = r'\|'
+    elif delimiter == '\\':
+        delimiter = '\\\\'
+    elif delimiter == r'*':
+        delimiter = r'\*'
+
+    tmp = text[1:-1].replace('$', '')
+    # match the delimited character unless it's doubled
+    regex = re.compile('(?<=[^%s])%s(?!%s)' % (delimiter, delimiter, delimiter))
+    tmp = regex.split(tmp)
+
+    return dict(
+        zip(
+            [x.lower().replace(delimiter + delimiter, delimiter) for x in tmp[::2]],
+            [x.replace(delimiter + delimiter, delimiter) for x in tmp[1::2]]
+        )
+    )
+
+
+def _parse_channels(text):
+    channels = {}
+    regex_pnn = re.compile(r"^p(\d+)n$")
+
+    for key in text.keys():
+        match = regex_pnn.match(key)
+        if not match:
+            continue
+
+        channel_num = match.groups()[0]
+        channels[channel_num] = {'PnN': text[key]}
+
+        # PnS field is optional
+        pns_key = 'p%ss' % channel_num
+        if pns_key in text:
+            channels[channel_num]['PnS'] = text[pns_key]
+
+    return channels
+
+
+def read_fcs_text(fcs_file_path):
+    """
+    Reads the HEADER and TEXT segments of an FCS file, without reading any
+    event data
+
+    :param fcs_file_path: path to FCS file
+    :return: dictionary with the 'header' offsets, the 'text' key / value
+             pairs and the 'channels' labels (same structure as the
+             flowio.FlowData attributes)
+    """
+    with open(fcs_file_path, 'rb') as fh:
+        header = _parse_header(fh)
+        text = _read_bytes(fh, header['text_start'], header['text_stop'])
+
+    try:
+        text = text.decode()
+    except UnicodeDecodeError:
+        text = text.decode("ISO-8859-1")
+
+    text = _parse_pairs(text)
+
+    return {
+        'header': header,
+        'text': text,
+        'channels': _parse_channels(text)
+    }
+
+
+def get_event_dtype(text):
+    """
+    Returns the NumPy dtype of the event values for the list mode layouts that
+    can be memory mapped: float ('F'), double ('D') or integer ('I') data with
+    the same 8, 16 or 32 bit width for all parameters
+
+    :param text: FCS text dictionary
+    :return: NumPy dtype or None if the data layout isn't supported
+    """
+    if text.get('mode', 'L').upper() != 'L':
+        return None
+
+    byte_order = text.get('byteord', '')
+    if byte_order in ('1,2,3,4', '1,2'):
+        order = '<'
+    elif byte_order in ('4,3,2,1', '2,1'):
+        order = '>'
+    else:
+        return None
+
+    data_type = text.get('datatype', '').upper()
+
+    if data_type == 'F':
+        return np.dtype(order + 'f4')
+    elif data_type == 'D':
+        return np.dtype(order + 'f8')
+    elif data_type == 'I':
+        bit_widths = set()
+
+        for i in range(1, int(text['par']) + 1):
+            bit_widths.add(text['p%db' % i])
+
+        if len(bit_widths) != 1:
+            return None
+
+        bit_width = bit_widths.pop()
+        if bit_width not in ('8', '16', '32'):
+            return None
+
+        return np.dtype('%su%d' % (order, int(bit_width) // 8))
+
+    return None
+
+
+def memory_map_events(fcs_file_path, fcs_text=None):
+    """
+    Memory maps the DATA segment of an FCS file as a read-only NumPy array of
+    shape (event count, channel count), no event data is read until it is
+    accessed.
+
+    :param fcs_file_path: path to FCS file
+    :param fcs_text: optional result of read_fcs_text for the file
+    :return: NumPy memmap array or None if the data layout can't be memory
+             mapped (see get_event_dtype)
+    """
+    if fcs_text is None:
+        fcs_text = read_fcs_text(fcs_file_path)
+
+    header = fcs_text['header']
+    text = fcs_text['text']
+
+    dtype = get_event_dtype(text)
+
+    if dtype is None:
+        return None
+
+    # large files store the data offsets in the text segment
+    data_start = int(text.get('begindata', 0)) or header['data_start']
+
+    event_count = int(text['tot'])
+    channel_count = int(text['par'])
+    data_size = event_count * channel_count * dtype.itemsize
+
+    if data_start + data_size > os.path.getsize(fcs_file_path):
+        raise EOFError("FCS text indicates data section greater than file size")
+
+    if event_count == 0:
+        return np.zeros((0, channel_count), dtype=dtype)
+
+    return np.memmap(
+        fcs_file_path,
+        dtype=dtype,
+        mode='r',
+        offset=data_start,
+        shape=(event_count, channel_count)
+    )
@@ -1,156 +1,926 @@
-from matplotlib.path import Path
 import numpy as np
-import pandas as pd
+import re
 import warnings
 
 
-def parse_polygon_gate(events, channel_labels, gate):
+def parent_event_indices(parent_mask):
     """
-    Extract events in given Polygon gate
+    Returns the row indices of the parent population, or None if the parent
+    population is the full event matrix
+    """
+    if parent_mask is None:
+        return None
+
+    return np.flatnonzero(parent_mask)
+
+
+# number of events tested per block in the polygon containment kernel, sized
+# so the temporary arrays of a block stay in the CPU cache (512 KB per array)
+POLYGON_CHUNK_SIZE = 65536
+
+
+def points_in_polygon(x, y, vertices, chunk_size=POLYGON_CHUNK_SIZE):
+    """
+    Test which points are inside a polygon using a vectorized crossing number
+    test. The arithmetic and boundary handling match matplotlib's
+    Path.contains_points (with a radius of 0), so results are identical.
+
+    Points are tested in blocks of chunk_size, and within a block any points
+    outside the bounding box of the polygon are rejected before the crossing
+    number test.
+
+    :param x: 1-D NumPy array of point x values
+    :param y: 1-D NumPy array of point y values
+    :param vertices: NumPy array of polygon vertices with shape (n, 2). The
+                     polygon is implicitly closed.
+    :param chunk_size: number of points tested per block
+    :return: boolean NumPy array, True for points inside the polygon
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    vx = vertices[:, 0]
+    vy = vertices[:, 1]
+    x_min, x_max = vx.min(), vx.max()
+    y_min, y_max = vy.min(), vy.max()
+
+    # edges are (vertex[i - 1], vertex[i]), including the closing edge
+    edges = list(zip(np.roll(vx, 1), np.roll(vy, 1), vx, vy))
+
+    is_inside = np.zeros(x.shape[0], dtype=np.bool_)
+
+    for start in range(0, x.shape[0], chunk_size):
+        # all comparisons are done in double precision, same as matplotlib
+        tx = np.asarray(x[start:start + chunk_size], dtype=np.float64)
+        ty = np.asarray(y[start:start + chunk_size], dtype=np.float64)
+
+        # a point outside the bounding box never crosses an odd number of edges
+        candidates = np.flatnonzero(
+            (tx >= x_min) & (tx <= x_max) & (ty >= y_min) & (ty <= y_max)
+        )
+
+        if candidates.shape[0] == 0:
+            continue
+
+        tx = tx[candidates]
+        ty = ty[candidates]
+
+        inside = np.zeros(candidates.shape[0], dtype=np.bool_)
+        y_flag0 = edges[0][1] >= ty
+
+        for vtx0, vty0, vtx1, vty1 in edges:
+            y_flag1 = vty1 >= ty
+            # the edge crosses the horizontal line through the point, toggle if
+            # the crossing is on the positive x side of the point
+            crosses = y_flag0 != y_flag1
+            crosses &= ((vty1 - ty) * (vtx0 - vtx1) >= (vtx1 - tx) * (vty0 - vty1)) == y_flag1
+            inside ^= crosses
+            y_flag0 = y_flag1
+
+        is_inside[start + candidates] = inside
+
+    return is_inside
+
+
+def get_rectangle_bounds(vertices):
+    """
+    Returns the bounds of an axis-aligned rectangle polygon, along with whether
+    each x bound is inclusive so that containment matches the crossing number
+    test in points_in_polygon.
+
+    :param vertices: NumPy array of polygon vertices with shape (n, 2)
+    :return: tuple of (x_min, x_max, y_min, y_max, x_min_inclusive,
+             x_max_inclusive) or None if the polygon is not an axis-aligned
+             rectangle
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+
+    if vertices.shape[0] != 4:
+        return None
+
+    x_values = np.unique(vertices[:, 0])
+    y_values = np.unique(vertices[:, 1])
+
+    if x_values.shape[0] != 2 or y_values.shape[0] != 2:
+        return None
+
+    x_min, x_max = x_values
+    y_min, y_max = y_values
+    x_min_inclusive = None
+    x_max_inclusive = None
+
+    for i in range(4):
+        x0, y0 = vertices[i - 1]
+        x1, y1 = vertices[i]
+
+        if x0 == x1 and y0 != y1:
+            # vertical edge, a downward edge on the left side or an upward
+            # edge on the right side includes its boundary
+            if x0 == x_min:
+                x_min_inclusive = y1 < y0
+            else:
+                x_max_inclusive = y1 > y0
+        elif y0 != y1:
+            # diagonal edge
+            return None
+
+    if x_min_inclusive is None or x_max_inclusive is None:
+        return None
+
+    return x_min, x_max, y_min, y_max, x_min_inclusive, x_max_inclusive
+
+
+def points_in_rectangle(x, y, bounds, chunk_size=POLYGON_CHUNK_SIZE):
+    """
+    Test which points are inside an axis-aligned rectangle
+
+    :param x: 1-D NumPy array of point x values
+    :param y: 1-D NumPy array of point y values
+    :param bounds: rectangle bounds tuple as returned by get_rectangle_bounds
+    :param chunk_size: number of points tested per block
+    :return: boolean NumPy array, True for points inside the rectangle
+    """
+    x_min, x_max, y_min, y_max, x_min_inclusive, x_max_inclusive = bounds
+
+    is_inside = np.empty(x.shape[0], dtype=np.bool_)
+
+    for start in range(0, x.shape[0], chunk_size):
+        tx = np.asarray(x[start:start + chunk_size], dtype=np.float64)
+        ty = np.asarray(y[start:start + chunk_size], dtype=np.float64)
+
+        # the lower y boundary is excluded and the upper one included,
+        # same as the crossing number test
+        inside = (ty > y_min) & (ty <= y_max)
+
+        if x_min_inclusive:
+            inside &= tx >= x_min
+        else:
+            inside &= tx > x_min
+
+        if x_max_inclusive:
+            inside &= tx <= x_max
+        else:
+            inside &= tx < x_max
+
+        is_inside[start:start + chunk_size] = inside
+
+    return is_inside
+
+
+def points_in_gate_polygon(x, y, vertices, rectangle_bounds=None):
+    """
+    Test which points are inside a polygon gate, using the rectangle fast-path
+    when rectangle bounds are given
+
+    :param x: 1-D NumPy array of point x values
+    :param y: 1-D NumPy array of point y values
+    :param vertices: NumPy array of polygon vertices with shape (n, 2)
+    :param rectangle_bounds: optional bounds as returned by get_rectangle_bounds
+    :return: boolean NumPy array, True for points inside the polygon
+    """
+    if rectangle_bounds is not None:
+        return points_in_rectangle(x, y, rectangle_bounds)
+
+    return points_in_polygon(x, y, vertices)
+
+
+def get_2d_bin_indices(x, y, x_range, y_range, bins, chunk_size=POLYGON_CHUNK_SIZE):
+    """
+    Returns the flattened 2-D histogram bin index (x bin * bins + y bin) of
+    each point, for bins x bins equal width bins over the x & y ranges.
+    Points outside the ranges are counted in the edge bins. Points are binned
+    in blocks of chunk_size, so the float64 temporaries stay in the CPU cache.
+
+    :param x: 1-D NumPy array of point x values
+    :param y: 1-D NumPy array of point y values
+    :param x_range: tuple of the x minimum & maximum
+    :param y_range: tuple of the y minimum & maximum
+    :param bins: number of bins per axis
+    :return: NumPy array of bin indices
+    """
+    x_min, x_scale = x_range[0], bins / float(x_range[1] - x_range[0])
+    y_min, y_scale = y_range[0], bins / float(y_range[1] - y_range[0])
+
+    bin_indices = np.empty(x.shape[0], dtype=np.intp)
+
+    for start in range(0, x.shape[0], chunk_size):
+        block = slice(start, start + chunk_size)
+
+        x_bins = np.subtract(x[block], x_min, dtype=np.float64)
+        x_bins *= x_scale
+        np.floor(x_bins, out=x_bins)
+        np.clip(x_bins, 0, bins - 1, out=x_bins)
+
+        y_bins = np.subtract(y[block], y_min, dtype=np.float64)
+        y_bins *= y_scale
+        np.floor(y_bins, out=y_bins)
+        np.clip(y_bins, 0, bins - 1, out=y_bins)
+
+        # whole numbers, exact in float64
+        x_bins *= bins
+        x_bins += y_bins
+        bin_indices[block] = x_bins
+
+    return bin_indices
+
+
+def find_channel_index(channel_labels, axis_label):
+    """
+    Find the column index of the channel for a gate axis. A channel whose PnN
+    label equals the axis label is preferred, otherwise the channel with the
+    longest PnN label contained in the axis label is used (e.g. 'Comp-FITC-A'
+    for channel 'FITC-A').
+
+    :param channel_labels: dictionary of channel labels (keys are channel #'s)
+    :param axis_label: gate axis label
+    :return: channel index or None if no channel matches
+    """
+    channel_index = None
+    match_length = -1
+
+    for chan_number, labels in channel_labels.items():
+        pnn = labels['PnN']
+
+        if pnn == axis_label:
+            return int(chan_number) - 1
+        elif pnn in axis_label and len(pnn) > match_length:
+            channel_index = int(chan_number) - 1
+            match_length = len(pnn)
+
+    return channel_index
+
+
+def get_polygon_vertices(gate):
+    """
+    Returns the vertices of a polygon gate
+
+    :param gate: dictionary for a 'Polygon' gate
+    :return: NumPy array of float64 vertices with shape (n, 2)
+    """
+    return np.array(
+        [[float(vertex['x']), float(vertex['y'])] for vertex in gate['vertices']],
+        dtype=np.float64
+    )
+
+
+def points_in_ranges(columns, bounds, chunk_size=POLYGON_CHUNK_SIZE):
+    """
+    Test which points are inside a hyper-rectangle, a range on each dimension
+    with an inclusive minimum and exclusive maximum (as in Gating-ML)
+
+    :param columns: list of 1-D NumPy arrays of point values, one per dimension
+    :param bounds: list of (minimum, maximum) tuples, one per dimension. Either
+                   value can be None for an unbounded side.
+    :param chunk_size: number of points tested per block
+    :return: boolean NumPy array, True for points inside the ranges
+    """
+    is_inside = np.ones(columns[0].shape[0], dtype=np.bool_)
+
+    for start in range(0, is_inside.shape[0], chunk_size):
+        inside = is_inside[start:start + chunk_size]
+
+        for values, (minimum, maximum) in zip(columns, bounds):
+            # compare in double precision, same as the polygon tests
+            values = np.asarray(values[start:start + chunk_size], dtype=np.float64)
+
+            if minimum is not None:
+                inside &= values >= minimum
+            if maximum is not None:
+                inside &= values < maximum
+
+    return is_inside
+
+
+def points_in_ellipsoid(
+        columns,
+        mean,
+        inverse_covariance,
+        distance_square,
+        chunk_size=POLYGON_CHUNK_SIZE
+):
+    """
+    Test which points are inside an ellipsoid, i.e. the points whose squared
+    Mahalanobis distance from the mean is at most distance_square
+
+    :param columns: list of 1-D NumPy arrays of point values, one per dimension
+    :param mean: NumPy array of the ellipsoid center
+    :param inverse_covariance: NumPy array of the inverse covariance matrix
+    :param distance_square: squared Mahalanobis distance of the boundary
+    :param chunk_size: number of points tested per block
+    :return: boolean NumPy array, True for points inside the ellipsoid
+    """
+    is_inside = np.empty(columns[0].shape[0], dtype=np.bool_)
+
+    for start in range(0, is_inside.shape[0], chunk_size):
+        diff = np.column_stack(
+            [np.asarray(c[start:start + chunk_size], dtype=np.float64) for c in columns]
+        )
+        diff -= mean
+
+        # quadratic form of each row: diff @ inverse_covariance @ diff.T
+        distance = np.einsum('ij,jk,ik->i', diff, inverse_covariance, diff)
+        is_inside[start:start + chunk_size] = distance <= distance_square
+
+    return is_inside
+
+
+def points_in_quadrants(
+        columns,
+        divider_values,
+        quadrant_intervals,
+        chunk_size=POLYGON_CHUNK_SIZE
+):
+    """
+    Test which points are inside any of the given quadrants of a quadrant gate
+
+    Each divider splits its dimension into intervals at its sorted values,
+    with each interval including its lower value. A quadrant is the set of
+    interval indices on each divider (see get_quadrant_parameters).
+
+    :param columns: list of 1-D NumPy arrays of point values, one per divider
+    :param divider_values: list of sorted NumPy arrays of divider values
+    :param quadrant_intervals: list of tuples of the interval index on each
+                               divider for each quadrant, None for dividers
+                               that don't restrict the quadrant
+    :param chunk_size: number of points tested per block
+    :return: boolean NumPy array, True for points inside the quadrants
+    """
+    is_inside = np.empty(columns[0].shape[0], dtype=np.bool_)
+
+    for start in range(0, is_inside.shape[0], chunk_size):
+        intervals = [
+            np.searchsorted(
+                values,
+                np.asarray(c[start:start + chunk_size], dtype=np.float64),
+                side='right'
+            ) for c, values in zip(columns, divider_values)
+        ]
+
+        inside = np.zeros(intervals[0].shape[0], dtype=np.bool_)
+
+        for quadrant in quadrant_intervals:
+            in_quadrant = np.ones(inside.shape[0], dtype=np.bool_)
+
+            for event_intervals, interval in zip(intervals, quadrant):
+                if interval is not None:
+                    in_quadrant &= event_intervals == interval
+
+            inside |= in_quadrant
+
+        is_inside[start:start + chunk_size] = inside
+
+    return is_inside
+
+
+def get_gate_axes(gate):
+    """
+    Returns the channel labels of the dimensions of a gate
+
+    :param gate: dictionary for a 'Polygon', 'Rectangle', 'Ellipsoid' or
+                 'Quad' gate
+    :return: list of channel labels
+    """
+    gate_type = gate['type']
+
+    if gate_type == 'Polygon':
+        return [gate['x_axis'], gate['y_axis']]
+    elif gate_type == 'Rectangle':
+        return [d['label'] for d in gate['dimensions']]
+    elif gate_type == 'Ellipsoid':
+        return list(gate['dimensions'])
+    elif gate_type == 'Quad':
+        return [d['label'] for d in gate['dividers']]
+
+    raise ValueError("Unsupported gate type: %s" % gate_type)
+
+
+def find_gate_channel_indices(channel_labels, gate):
+    """
+    Returns the column indices of the channels of each dimension of a gate
+
+    :param channel_labels: dictionary of channel labels (keys are channel #'s)
+    :param gate: gate dictionary, see get_gate_axes
+    :return: list of channel indices
+    """
+    indices = [find_channel_index(channel_labels, axis) for axis in get_gate_axes(gate)]
+
+    if None in indices:
+        raise ValueError(
+            "Channel labels not found in data for %s gate" % gate['type'].lower()
+        )
+
+    return indices
+
+
+def get_range_bounds(gate):
+    """
+    Returns the (minimum, maximum) bounds of each dimension of a Rectangle
+    gate, None for unbounded sides
+    """
+    bounds = []
+
+    for dimension in gate['dimensions']:
+        minimum = dimension.get('min')
+        maximum = dimension.get('max')
+
+        bounds.append((
+            None if minimum is None else float(minimum),
+            None if maximum is None else float(maximum)
+        ))
+
+    return bounds
+
+
+def get_ellipsoid_parameters(gate):
+    """
+    Returns the mean, inverse covariance matrix and squared boundary distance
+    of an Ellipsoid gate
+    """
+    mean = np.array(gate['mean'], dtype=np.float64)
+    covariance = np.array(gate['covariance'], dtype=np.float64)
+
+    if covariance.shape != (mean.shape[0], mean.shape[0]):
+        raise ValueError("Ellipsoid gate covariance matrix doesn't match its dimensions")
+
+    return mean, np.linalg.inv(covariance), float(gate['distance_square'])
+
+
+def get_quadrant_parameters(gate):
+    """
+    Returns the sorted divider values and the interval index on each divider
+    of each quadrant of a Quad gate (see points_in_quadrants)
+    """
+    divider_values = []
+    divider_positions = {}
+
+    for i, divider in enumerate(gate['dividers']):
+        divider_values.append(np.sort(np.array(divider['values'], dtype=np.float64)))
+        divider_positions[divider['id']] = i
+
+    quadrant_intervals = []
+
+    for quadrant in gate['quadrants']:
+        intervals = [None] * len(divider_values)
+
+        for divider_id, location in quadrant['locations'].items():
+            try:
+                i = divider_positions[divider_id]
+            except KeyError:
+                raise ValueError("Quadrant references an unknown divider: %s" % divider_id)
+
+            # the quadrant contains its location
+            intervals[i] = int(
+                np.searchsorted(divider_values[i], float(location), side='right')
+            )
+
+        quadrant_intervals.append(tuple(intervals))
+
+    return divider_values, quadrant_intervals
+
+
+def points_in_gate(columns, gate):
+    """
+    Test which points are inside a Rectangle, Ellipsoid or Quad gate
+
+    :param columns: list of 1-D NumPy arrays of point values, one for each gate
+                    dimension (see get_gate_axes)
+    :param gate: gate dictionary
+    :return: boolean NumPy array, True for points inside the gate
+    """
+    gate_type = gate['type']
+
+    if gate_type == 'Rectangle':
+        return points_in_ranges(columns, get_range_bounds(gate))
+    elif gate_type == 'Ellipsoid':
+        return points_in_ellipsoid(columns, *get_ellipsoid_parameters(gate))
+    elif gate_type == 'Quad':
+        return points_in_quadrants(columns, *get_quadrant_parameters(gate))
+
+    raise ValueError("Unsupported gate type: %s" % gate_type)
+
+
+def indices_to_mask(event_count, indices, is_in_gate):
+    """
+    Builds a boolean mask over all events from a gating result computed on
+    a subset of rows
+    """
+    mask = np.zeros(event_count, dtype=np.bool_)
+
+    if indices is None:
+        mask[is_in_gate] = True
+    else:
+        mask[indices[is_in_gate]] = True
+
+    return mask
+
+
+def parse_polygon_gate(events, channel_labels, gate, parent_mask=None):
+    """
+    Find events in given Polygon gate
 
     :param events: NumPy array of events on which to apply the gate
     :param channel_labels: dictionary of channel labels (keys are channel #'s)
     :param gate: dictionary for a 'Polygon' gate
-    :return:
+    :param parent_mask: optional boolean array selecting the parent population
+                        rows of events. If None, all events are used.
+    :return: dictionary with the boolean 'mask' of events in the gate (aligned
+             to the rows of events), the gated 'count' and the 'ungated_count'
     """
     # First, get the column indices for the x and y parameters
-    x_label = gate['x_axis']
-    y_label = gate['y_axis']
-    x_index = None
-    y_index = None
-
-    for chan_number, labels in channel_labels.items():
-        if labels['PnN'] in x_label:
-            x_index = int(chan_number) - 1
-        elif labels['PnN'] in y_label:
-            y_index = int(chan_number) - 1
+    x_index = find_channel_index(channel_labels, gate['x_axis'])
+    y_index = find_channel_index(channel_labels, gate['y_axis'])
 
     if x_index is None or y_index is None:
         raise ValueError("Channel labels not found in data for polygon gate")
 
-    xy_events = events[:, [x_index, y_index]]
+    # only the 2 gated columns of the parent rows are extracted, never the
+    # full event matrix
+    parent_indices = parent_event_indices(parent_mask)
 
-    xy_vertices = []
+    if parent_indices is None:
+        x_events = events[:, x_index]
+        y_events = events[:, y_index]
+    else:
+        x_events = events[parent_indices, x_index]
+        y_events = events[parent_indices, y_index]
 
-    for vertex in gate['vertices']:
-        xy_vertices.append(
-            [
-                float(vertex['x']),
-                float(vertex['y'])
-            ]
-        )
+    xy_vertices = get_polygon_vertices(gate)
 
-    path = Path(xy_vertices)
+    rectangle_bounds = None
+    if gate.get('rectangle', False):
+        rectangle_bounds = get_rectangle_bounds(xy_vertices)
 
-    is_in_gate = path.contains_points(xy_events, radius=0.0)
+    is_in_gate = points_in_gate_polygon(x_events, y_events, xy_vertices, rectangle_bounds)
 
-    gated_events = events[is_in_gate]
+    mask = indices_to_mask(events.shape[0], parent_indices, is_in_gate)
 
     return {
-        'gated_events': gated_events,
-        'ungated_count': events.shape[0]
+        'mask': mask,
+        'count': int(np.count_nonzero(is_in_gate)),
+        'ungated_count': x_events.shape[0]
     }
 
 
-def parse_boolean_gates(events, gating_dict, boolean_gate_list):
+def parse_gate(events, channel_labels, gate, parent_mask=None):
+    """
+    Find events in a given Rectangle (including 1-D range), Ellipsoid or Quad
+    gate, or a Polygon gate (see parse_polygon_gate)
 
-    for gate in boolean_gate_list:
-        specs = [g.strip() for g in gate['specification'].split('&')]
-        group_inclusion = []
-        for g in specs:
-            if g[0] == '!':
-                group_inclusion.append(False)
-            else:
-                group_inclusion.append(True)
+    :param events: NumPy array of events on which to apply the gate
+    :param channel_labels: dictionary of channel labels (keys are channel #'s)
+    :param gate: gate dictionary
+    :param parent_mask: optional boolean array selecting the parent population
+                        rows of events. If None, all events are used.
+    :return: dictionary with the boolean 'mask' of events in the gate (aligned
+             to the rows of events), the gated 'count' and the 'ungated_count'
+    """
+    if gate['type'] == 'Polygon':
+        return parse_polygon_gate(events, channel_labels, gate, parent_mask)
 
-        groups = []
+    channel_indices = find_gate_channel_indices(channel_labels, gate)
 
-        for g in gate['groups']:
-            g_split = g.split('/')
-            if len(g_split) > 2:
-                warnings.warn("Nested boolean gates are not supported (%s)" % g)
-                groups.append(None)
-                continue
+    parent_indices = parent_event_indices(parent_mask)
 
-            groups.append(g_split[1])
+    if parent_indices is None:
+        columns = [events[:, i] for i in channel_indices]
+    else:
+        columns = [events[parent_indices, i] for i in channel_indices]
 
-        # start with including all events, ignore inspection for using 'True'
-        # noinspection PyTypeChecker
-        all_include_events = np.broadcast_to(True, events[:, 0].shape)
+    is_in_gate = points_in_gate(columns, gate)
 
-        for i, g in enumerate(groups):
-            if group_inclusion[i] and g is not None:
-                invert = False
-            elif g is not None:
-                invert = True  # invert because it's an exclusion gate
-            else:
-                continue
+    mask = indices_to_mask(events.shape[0], parent_indices, is_in_gate)
 
-            for group_gate in gating_dict[g]['gates']:
-                # if len(group_gate['result']['gated_events']) > 0:
+    return {
+        'mask': mask,
+        'count': int(np.count_nonzero(is_in_gate)),
+        'ungated_count': columns[0].shape[0]
+    }
 
-                # get the event indices for this gate
-                gate_events = group_gate['result']['gated_events'][:, 0]
 
-                # find boolean array of these indices from all parent events
-                gate_include_events = np.in1d(
-                    events[:, 0],
-                    list(gate_events),
-                    invert=invert
-                )
-                all_include_events = np.logical_and(
-                    all_include_events,
-                    gate_include_events
+def parse_boolean_specification(specification):
+    """
+    Parse a FlowJo boolean gate specification into an expression tree
+
+    Supported operators are '&' (and), '|' (or) and '!' (not), with the
+    usual precedence (not > and > or) and parentheses for grouping. Operands
+    of the form 'G<n>' reference the n-th gate path of the boolean gate, any
+    other operand references the gate paths in order of appearance.
+
+    :param specification: boolean gate specification string, e.g. 'G0&!G1'
+    :return: nested tuples, where each node is one of ('ref', index),
+             ('not', node), ('and', node, node) or ('or', node, node)
+    """
+    tokens = re.findall(r'[&|!()]|[^&|!()\s]+', specification)
+    position = [0]
+    operand_count = [0]
+
+    def peek():
+        if position[0] < len(tokens):
+            return tokens[position[0]]
+        return None
+
+    def take():
+        token = peek()
+        if token is None:
+            raise ValueError(
+                "Unexpected end of boolean gate specification: %s" % specification
+            )
+        position[0] += 1
+        return token
+
+    def parse_or():
+        node = parse_and()
+        while peek() == '|':
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek() == '&':
+            take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        token = take()
+        if token == '!':
+            return 'not', parse_not()
+        elif token == '(':
+            node = parse_or()
+            if take() != ')':
+                raise ValueError(
+                    "Unbalanced parentheses in boolean gate specification: %s" % specification
                 )
+            return node
+        elif token in ('&', '|', ')'):
+            raise ValueError(
+                "Invalid boolean gate specification: %s" % specification
+            )
 
-        gated_events = events[all_include_events]
+        match = re.match(r'^G(\d+)$', token)
+        if match is not None:
+            index = int(match.group(1))
+        else:
+            index = operand_count[0]
+        operand_count[0] += 1
+
+        return 'ref', index
+
+    tree = parse_or()
+
+    if peek() is not None:
+        raise ValueError("Invalid boolean gate specification: %s" % specification)
+
+    return tree
+
+
+def evaluate_boolean_tree(tree, masks):
+    """
+    Evaluate a parsed boolean specification given the referenced population
+    masks. Unresolved references (None) are ignored, as if the term were
+    absent from the specification.
+
+    :param tree: expression tree as returned by parse_boolean_specification
+    :param masks: list of boolean NumPy arrays (or None), indexed by gate path
+    :return: boolean NumPy array or None if no references were resolved
+    """
+    op = tree[0]
+
+    if op == 'ref':
+        return masks[tree[1]]
+    elif op == 'not':
+        operand = evaluate_boolean_tree(tree[1], masks)
+        if operand is None:
+            return None
+        return ~operand
+
+    left = evaluate_boolean_tree(tree[1], masks)
+    right = evaluate_boolean_tree(tree[2], masks)
+
+    if left is None:
+        return right
+    elif right is None:
+        return left
+    elif op == 'and':
+        return left & right
+    else:
+        return left | right
+
+
+def get_boolean_gate_mask(tree, masks, event_count, parent_mask=None, name=None):
+    """
+    Returns the event membership mask of a boolean gate, the evaluated
+    specification (see evaluate_boolean_tree) restricted to the parent
+    population
+
+    :param tree: expression tree as returned by parse_boolean_specification
+    :param masks: list of the referenced population masks (or None)
+    :param event_count: number of events
+    :param parent_mask: optional boolean array selecting the parent population
+                        rows of events. If None, all events are used.
+    :param name: gate path or specification included in errors
+    :return: boolean NumPy array, a new array
+    """
+    try:
+        mask = evaluate_boolean_tree(tree, masks)
+    except IndexError:
+        raise ValueError(
+            "Boolean gate specification references a missing gate path (%s)" % name
+        )
+
+    if mask is None:
+        mask = np.ones(event_count, dtype=np.bool_)
+    else:
+        mask = mask.copy()
+
+    if parent_mask is not None:
+        mask &= parent_mask
+
+    return mask
+
+
+def find_population(gating_dict, gate_path):
+    """
+    Find a population in a gating hierarchy given its gate path
+
+    :param gating_dict: dictionary of the gating hierarchy
+    :param gate_path: '/' delimited population path, e.g. '/Lymphocytes/Singlets'
+    :return: population dictionary or None if the path is not found
+    """
+    labels = [label for label in gate_path.split('/') if label != '']
+
+    if len(labels) == 0:
+        return None
+
+    population = None
+    level = gating_dict
+
+    for label in labels:
+        if label not in level:
+            return None
+
+        population = level[label]
+        level = population['children']
+
+    return population
+
+
+def get_population_mask(population):
+    """
+    Returns the event membership mask of a population, combining the masks
+    of all gate regions in the population.
+
+    :param population: population dictionary, with results for its gates
+    :return: boolean NumPy array or None if the population has not been gated
+    """
+    mask = None
+
+    for gate in population['gates']:
+        if 'result' not in gate:
+            return None
+
+        if mask is None:
+            mask = gate['result']['mask']
+        else:
+            mask = mask | gate['result']['mask']
+
+    return mask
+
+
+def parse_boolean_gates(
+        events,
+        gating_dict,
+        boolean_gate_list,
+        parent_mask=None,
+        level_dict=None
+):
+    """
+    Find events in the given Boolean gates by combining the membership masks
+    of the referenced populations
+
+    Gate paths are resolved from the root of the gating hierarchy, falling
+    back to the hierarchy level containing the boolean gates.
+
+    :param events: NumPy array of events on which to apply the gates
+    :param gating_dict: dictionary of the full gating hierarchy (root level)
+    :param boolean_gate_list: list of 'Boolean' gate dictionaries
+    :param parent_mask: optional boolean array selecting the parent population
+                        rows of events. If None, all events are used.
+    :param level_dict: optional dictionary of the hierarchy level containing
+                       the boolean gates
+    :return: list of the boolean gates that could not be evaluated because a
+             referenced population has not been gated yet. Each evaluated gate
+             dictionary is modified to add its result.
+    """
+    if parent_mask is None:
+        ungated_count = events.shape[0]
+    else:
+        ungated_count = int(np.count_nonzero(parent_mask))
+
+    pending_gates = []
+
+    for gate in boolean_gate_list:
+        masks = []
+        is_pending = False
+
+        for g in gate['groups']:
+            population = find_population(gating_dict, g)
+
+            if population is None and level_dict is not None:
+                population = find_population(level_dict, g)
+
+            if population is None:
+                warnings.warn("Boolean gate path not found in hierarchy (%s)" % g)
+                masks.append(None)
+                continue
+
+            population_mask = get_population_mask(population)
+
+            if population_mask is None:
+                is_pending = True
+                break
+
+            masks.append(population_mask)
+
+        if is_pending:
+            pending_gates.append(gate)
+            continue
+
+        include_events = get_boolean_gate_mask(
+            parse_boolean_specification(gate['specification']),
+            masks,
+            events.shape[0],
+            parent_mask,
+            gate['specification']
+        )
 
         gate['result'] = {
-            'gated_events': gated_events,
-            'ungated_count': events.shape[0]
+            'mask': include_events,
+            'count': int(np.count_nonzero(include_events)),
+            'ungated_count': ungated_count
         }
 
+    return pending_gates
+
 
-def apply_gating_hierarchy(events, channel_labels, gating_dict):
+def apply_gating_hierarchy(
+        events,
+        channel_labels,
+        gating_dict,
+        parent_mask=None,
+        materialize=False,
+        max_threads=1
+):
     """
-    Extract events from root gates and recurse on any children
+    Find events in root gates and recurse on any children
+
+    Gate membership is tracked as boolean masks aligned to the rows of the
+    given events, so event subsets are never copied while traversing the
+    hierarchy. Boolean gates are evaluated by combining the masks of the
+    referenced populations once those have been gated.
+
+    The hierarchy is compiled into a GatingPlan for evaluation. Plans are
+    reused by later calls with the same gate definitions & channel labels
+    (see gating_plan.get_gating_plan), gate results added by earlier calls
+    are ignored.
 
     :param events: NumPy array of events on which to apply the gate
     :param channel_labels: dictionary of channel labels (keys are channel #'s)
     :param gating_dict: dictionary of gating hierarchy where current_gate
                         is a key at the root level. Gating dict is modified to
                         add the results to each gate.
+    :param parent_mask: optional boolean array selecting the parent population
+                        rows of events. If None, all events are used.
+    :param materialize: if True, each gate result also includes the array of
+                        'gated_events'. Default is False.
+    :param max_threads: number of threads evaluating independent gates
+                        concurrently, see GatingPlan.apply. Default is 1.
     :return: None
     """
+    # imported here as the gating plan is built on the gate functions
+    from flowpy.models.gating_plan import get_gating_plan
 
-    # We ignore boolean gates here since they reference other gates that need to be
-    # calculated first. The boolean gates will be handled by another function that
-    # should be run after this one. Don't really like this as it means at least 2
-    # passes through the gating_dict, but it will work for now.
-    boolean_gates = []
+    plan = get_gating_plan(gating_dict, channel_labels)
+    result = plan.apply(events, parent_mask=parent_mask, max_threads=max_threads)
 
-    for gate_label, gate_objects in gating_dict.items():
-        # Iterate through gates, I suppose it is possible to have multiple sub-regions
-        # drawn for a single "gate" so we'll iterate and check in case there's > 1 gate
-        gated_events = np.ndarray(shape=(0, events.shape[1]))
+    for node in plan.nodes:
+        population = find_population(gating_dict, node.path)
 
-        for gate in gate_objects['gates']:
-            gate_type = gate['type']
+        for gate, gate_result in zip(population['gates'], result.get_gate_results(node.path)):
+            if materialize:
+                gate_result['gated_events'] = events[gate_result['mask']]
 
-            if gate_type == 'Polygon':
-                gate['result'] = parse_polygon_gate(events, channel_labels, gate)
-                gated_events = np.vstack((gated_events, gate['result']['gated_events']))
-            elif gate_type == 'Boolean':
-                # Need to save these as the referenced gates may not have been
-                # calculated yet, we'll parse them after all the other ones
-                boolean_gates.append(gate)
-            else:
-                raise ValueError("Unsupported gate type: %s" % gate_type)
+            gate['result'] = gate_result
 
-        apply_gating_hierarchy(gated_events, channel_labels, gate_objects['children'])
 
-    if len(boolean_gates) > 0:
-        parse_boolean_gates(events, gating_dict, boolean_gates)
+def get_gated_events(events, gate):
+    """
+    Materialize the events found in a gate
+
+    :param events: NumPy array of events the gating hierarchy was applied to
+    :param gate: gate dictionary containing a result
+    :return: NumPy array of the gated events (a copy)
+    """
+    return events[gate['result']['mask']]
 
 
 def parse_results_dict(population_root, parent_label):
@@ -164,7 +934,7 @@ def parse_results_dict(population_root, parent_label):
             'parent_path': parent_label,
             'label': label,
             'type': pop['gates'][0]['type'],
-            'count': pop['gates'][0]['result']['gated_events'].shape[0],
+            'count': pop['gates'][0]['result']['count'],
             'parent_count': pop['gates'][0]['result']['ungated_count']
         })
 
@@ -178,6 +948,10 @@ def parse_results_dict(population_root, parent_label):
 
 
 def results_to_dataframe(results):
+    # pandas is only imported for the DataFrame outputs, so loading and
+    # gating samples doesn't import it
+    import pandas as pd
+
     sg_results = parse_results_dict(results['populations'], 'root')
     df = pd.DataFrame(sg_results)
     df = df[['parent_path', 'label', 'type', 'parent_count', 'count']]
@@ -0,0 +1,1226 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from copy import deepcopy
+import heapq
+import pickle
+import threading
+import time
+import warnings
+import numpy as np
+from flowpy.models import gate
+from flowpy.models import profiling
+from flowpy.models.membership import MembershipMatrix
+from flowpy.models.statistics import compute_population_statistics
+
+
+# A compiled polygon gate region: column indices of the x & y channels, the
+# float64 vertex array and the rectangle bounds for the rectangle fast-path
+# (None for general polygons)
+PolygonRegion = namedtuple(
+    'PolygonRegion',
+    ['x_index', 'y_index', 'vertices', 'rectangle_bounds']
+)
+
+# Compiled Rectangle (including 1-D range), Ellipsoid and Quad gate regions:
+# column indices of the gate dimensions and the parameters of the closed-form
+# containment test (see gate.points_in_ranges, gate.points_in_ellipsoid and
+# gate.points_in_quadrants)
+RectangleRegion = namedtuple(
+    'RectangleRegion',
+    ['indices', 'bounds']
+)
+EllipsoidRegion = namedtuple(
+    'EllipsoidRegion',
+    ['indices', 'mean', 'inverse_covariance', 'distance_square']
+)
+QuadRegion = namedtuple(
+    'QuadRegion',
+    ['indices', 'divider_values', 'quadrant_intervals']
+)
+
+# A compiled boolean gate region: the parsed specification tree and the
+# resolved population paths referenced by the specification (None for paths
+# not found in the hierarchy)
+BooleanRegion = namedtuple(
+    'BooleanRegion',
+    ['tree', 'references']
+)
+
+# A population of the gating hierarchy. The path is the '/' delimited
+# population path (e.g. '/Lymphocytes/Singlets'), parent is the parent path
+# (None for root populations) and gates are the source gate dictionaries.
+PlanNode = namedtuple(
+    'PlanNode',
+    ['path', 'parent', 'label', 'gate_type', 'regions', 'gates', 'dependencies']
+)
+
+
+# compiled plans by gate definitions & channel labels, see get_gating_plan
+_gating_plans = {}
+_PLAN_CACHE_SIZE = 64
+
+
+def get_gate_definitions(populations):
+    """
+    Returns a copy of a gating hierarchy with only the gate definitions, the
+    results added to the gates by gating (masks & gated events) are left out
+
+    :param populations: dictionary of the gating hierarchy
+    :return: dictionary of the gating hierarchy
+    """
+    definitions = {}
+
+    for label, population in populations.items():
+        definition = dict(
+            (key, deepcopy(value)) for key, value in population.items()
+            if key not in ('gates', 'children')
+        )
+        definition['gates'] = [
+            deepcopy(dict((key, value) for key, value in g.items() if key != 'result'))
+            for g in population['gates']
+        ]
+        definition['children'] = get_gate_definitions(population['children'])
+
+        definitions[label] = definition
+
+    return definitions
+
+
+def get_gating_plan(populations, channel_labels):
+    """
+    Returns a GatingPlan for a gating hierarchy & channel labels, compiled
+    once per set of gate definitions & channel labels and reused after
+
+    :param populations: dictionary of the gating hierarchy, gate results are
+                        ignored
+    :param channel_labels: dictionary of channel labels (keys are channel #'s)
+    :return: GatingPlan
+    """
+    definitions = get_gate_definitions(populations)
+    # pickled rather than repr'd, as repr abbreviates large NumPy arrays
+    plan_key = pickle.dumps((definitions, sorted(channel_labels.items())), protocol=2)
+
+    if plan_key not in _gating_plans:
+        if len(_gating_plans) >= _PLAN_CACHE_SIZE:
+            _gating_plans.clear()
+
+        _gating_plans[plan_key] = GatingPlan(definitions, channel_labels)
+
+    return _gating_plans[plan_key]
+
+
+def _compile_polygon_region(gate_dict, channel_labels, path):
+    x_index = gate.find_channel_index(channel_labels, gate_dict['x_axis'])
+    y_index = gate.find_channel_index(channel_labels, gate_dict['y_axis'])
+
+    if x_index is None or y_index is None:
+        raise ValueError("Channel labels not found in data for polygon gate %s" % path)
+
+    vertices = gate.get_polygon_vertices(gate_dict)
+    vertices.flags.writeable = False
+
+    rectangle_bounds = None
+    if gate_dict.get('rectangle', False):
+        rectangle_bounds = gate.get_rectangle_bounds(vertices)
+
+    return PolygonRegion(x_index, y_index, vertices, rectangle_bounds)
+
+
+def _compile_channel_region(gate_dict, channel_labels, path):
+    gate_type = gate_dict['type']
+
+    try:
+        indices = tuple(gate.find_gate_channel_indices(channel_labels, gate_dict))
+    except ValueError:
+        raise ValueError(
+            "Channel labels not found in data for %s gate %s" % (gate_type.lower(), path)
+        )
+
+    if gate_type == 'Rectangle':
+        return RectangleRegion(indices, tuple(gate.get_range_bounds(gate_dict)))
+    elif gate_type == 'Ellipsoid':
+        mean, inverse_covariance, distance_square = gate.get_ellipsoid_parameters(gate_dict)
+        mean.flags.writeable = False
+        inverse_covariance.flags.writeable = False
+
+        return EllipsoidRegion(indices, mean, inverse_covariance, distance_square)
+
+    divider_values, quadrant_intervals = gate.get_quadrant_parameters(gate_dict)
+    for values in divider_values:
+        values.flags.writeable = False
+
+    return QuadRegion(indices, tuple(divider_values), tuple(quadrant_intervals))
+
+
+def _resolve_gate_path(populations, parent_path, gate_path):
+    """
+    Resolve a boolean gate path to a population path, first from the root of
+    the hierarchy then relative to the level of the boolean gate
+    """
+    labels = tuple(label for label in gate_path.split('/') if label != '')
+
+    if len(labels) == 0:
+        return None
+
+    if gate.find_population(populations, gate_path) is not None:
+        return '/' + '/'.join(labels)
+
+    if parent_path is not None:
+        parent = gate.find_population(populations, parent_path)
+
+        if gate.find_population(parent['children'], gate_path) is not None:
+            return '/'.join((parent_path,) + labels)
+
+    return None
+
+
+def _compile_boolean_region(gate_dict, populations, parent_path):
+    references = []
+
+    for gate_path in gate_dict['groups']:
+        reference = _resolve_gate_path(populations, parent_path, gate_path)
+
+        if reference is None:
+            warnings.warn("Boolean gate path not found in hierarchy (%s)" % gate_path)
+
+        references.append(reference)
+
+    return BooleanRegion(
+        gate.parse_boolean_specification(gate_dict['specification']),
+        tuple(references)
+    )
+
+
+class GatingPlan(object):
+    """
+    An immutable, compiled gating hierarchy for a set of channel labels
+
+    Compiling resolves the channel indices and vertex arrays of all gates and
+    the evaluation order of the populations, with boolean populations placed
+    after the populations they reference. The plan holds no per-sample state
+    and can be applied to many samples, and shared across threads and
+    processes. Results are returned as a GatingResult.
+    """
+    def __init__(self, populations, channel_labels):
+        """
+        :param populations: dictionary of the gating hierarchy, as found in the
+                            'populations' of Workspace samples and groups
+        :param channel_labels: dictionary of channel labels (keys are channel #'s)
+        """
+        # keep a private copy of the gate definitions, so the plan doesn't
+        # change if the source hierarchy is modified (without the results of
+        # previous gating, which would otherwise be copied too)
+        populations = get_gate_definitions(populations)
+
+        # collect nodes in depth-first order
+        nodes = []
+        self._compile_level(populations, None, channel_labels, populations, nodes)
+
+        self._nodes_by_path = dict((node.path, node) for node in nodes)
+        self._children = dict((node.path, []) for node in nodes)
+        self._children[None] = []
+        self._dependents = dict((node.path, []) for node in nodes)
+
+        for node in nodes:
+            self._children[node.parent].append(node.path)
+
+            for dependency in node.dependencies:
+                self._dependents[dependency].append(node.path)
+
+        self.nodes = self._sort_nodes(nodes)
+        self.channel_labels = deepcopy(channel_labels)
+        self._populations = populations
+
+    def _compile_level(self, level_dict, parent_path, channel_labels, populations, nodes):
+        for label, population in level_dict.items():
+            if parent_path is None:
+                path = '/' + label
+            else:
+                path = '/'.join([parent_path, label])
+
+            for gate_dict in population['gates']:
+                if gate_dict['type'] is None:
+                    raise ValueError(
+                        "Population %s has an unsupported gate element: %s" %
+                        (path, gate_dict['element'])
+                    )
+
+            gate_types = set(g['type'] for g in population['gates'])
+
+            if len(gate_types) != 1:
+                raise ValueError("Population %s must have gates of a single type" % path)
+
+            gate_type = gate_types.pop()
+            regions = []
+
+            for gate_dict in population['gates']:
+                if gate_type == 'Polygon':
+                    regions.append(
+                        _compile_polygon_region(gate_dict, channel_labels, path)
+                    )
+                elif gate_type == 'Boolean':
+                    regions.append(
+                        _compile_boolean_region(gate_dict, populations, parent_path)
+                    )
+                elif gate_type in ('Rectangle', 'Ellipsoid', 'Quad'):
+                    regions.append(
+                        _compile_channel_region(gate_dict, channel_labels, path)
+                    )
+                else:
+                    raise ValueError("Unsupported gate type: %s" % gate_type)
+
+            dependencies = set()
+            if parent_path is not None:
+                dependencies.add(parent_path)
+
+            if gate_type == 'Boolean':
+                for region in regions:
+                    dependencies.update(r for r in region.references if r is not None)
+
+            nodes.append(
+                PlanNode(
+                    path,
+                    parent_path,
+                    label,
+                    gate_type,
+                    tuple(regions),
+                    tuple(population['gates']),
+                    frozenset(dependencies)
+                )
+            )
+
+            self._compile_level(
+                population['children'],
+                path,
+                channel_labels,
+                populations,
+                nodes
+            )
+
+    @staticmethod
+    def _sort_nodes(nodes):
+        """
+        Topologically sort nodes by their dependencies, keeping the depth-first
+        hierarchy order wherever the dependencies allow it
+        """
+        position = dict((node.path, i) for i, node in enumerate(nodes))
+        dependents = dict((node.path, []) for node in nodes)
+        remaining = {}
+
+        for node in nodes:
+            remaining[node.path] = len(node.dependencies)
+
+            for dependency in node.dependencies:
+                dependents[dependency].append(node.path)
+
+        ready = [position[n.path] for n in nodes if remaining[n.path] == 0]
+        heapq.heapify(ready)
+        ordered_nodes = []
+
+        while len(ready) > 0:
+            node = nodes[heapq.heappop(ready)]
+            ordered_nodes.append(node)
+
+            for dependent in dependents[node.path]:
+                remaining[dependent] -= 1
+
+                if remaining[dependent] == 0:
+                    heapq.heappush(ready, position[dependent])
+
+        if len(ordered_nodes) != len(nodes):
+            cyclic = [n.path for n in nodes if remaining[n.path] > 0]
+            raise ValueError(
+                "Boolean gates have circular references: %s" % ', '.join(cyclic)
+            )
+
+        return tuple(ordered_nodes)
+
+    def get_node(self, path):
+        """
+        Returns the PlanNode for a population path (e.g. '/Lymphocytes/Singlets')
+        """
+        return self._nodes_by_path[path]
+
+    def get_children(self, path):
+        """
+        Returns the paths of the child populations of a population path, use
+        None for the root level populations
+        """
+        return tuple(self._children[path])
+
+    def get_dependent_paths(self, paths):
+        """
+        Returns the paths of the given populations and of all populations
+        depending on them (their descendants and any boolean populations
+        referencing them, recursively), in evaluation order
+        """
+        dependent_paths = set()
+        stack = list(paths)
+
+        while len(stack) > 0:
+            path = stack.pop()
+
+            if path in dependent_paths:
+                continue
+
+            dependent_paths.add(path)
+            stack.extend(self._dependents[path])
+
+        return tuple(node.path for node in self.nodes if node.path in dependent_paths)
+
+    def with_gates(self, path, gates):
+        """
+        Returns a new plan with the gates of a population replaced, the plan
+        itself is not modified
+
+        :param path: population path
+        :param gates: list of gate dictionaries (in the format of the
+                      'populations' gates) replacing the population's gates
+        :return: GatingPlan
+        """
+        if path not in self._nodes_by_path:
+            raise KeyError("Population %s not found in gating plan" % path)
+
+        populations = deepcopy(self._populations)
+        labels = [label for label in path.split('/') if label != '']
+        population = {'children': populations}
+
+        for label in labels:
+            population = population['children'][label]
+
+        population['gates'] = list(gates)
+
+        return GatingPlan(populations, self.channel_labels)
+
+    def apply(
+            self,
+            events,
+            parent_mask=None,
+            profiler=None,
+            max_threads=1,
+            histogram_bins=None,
+            histogram_ranges=None
+    ):
+        """
+        Apply the gating plan to events
+
+        :param events: NumPy array of events, with columns ordered by the
+                       channel labels the plan was compiled for
+        :param parent_mask: optional boolean array selecting the rows of events
+                            to gate. If None, all events are used.
+        :param profiler: optional Profiler recording a 'gate' stage for each
+                         population, named by the population path
+        :param max_threads: number of threads evaluating populations
+                            concurrently. Any population can be evaluated as
+                            soon as its parent (and for boolean gates, the
+                            referenced populations) have been, so sibling gates
+                            and independent subtrees run in parallel. Results
+                            are identical to the sequential evaluation (the
+                            default, 1 thread).
+        :param histogram_bins: if given, a 2-D histogram with histogram_bins x
+                               histogram_bins bins of the parent & gated events
+                               is computed on the x & y axes of each polygon
+                               gate while gating (see GatingResult.get_histograms)
+        :param histogram_ranges: optional dictionary of the (minimum, maximum)
+                                 histogram range by channel column index, by
+                                 default the range of the channel's events
+        :return: GatingResult
+        """
+        profiler = profiling.get_profiler(profiler)
+        result = GatingResult(
+            self,
+            events.shape[0],
+            parent_mask,
+            histogram_bins,
+            histogram_ranges
+        )
+
+        self._apply_nodes(events, self.nodes, result, profiler, max_threads)
+
+        return result
+
+    def reapply(self, events, result, paths, profiler=None, max_threads=1):
+        """
+        Re-evaluate some populations of a previous result, e.g. after editing
+        their gates (see with_gates). Only the given populations and the
+        populations depending on them are evaluated, the results of all
+        other populations are taken from the previous result.
+
+        :param events: NumPy array of the events of the previous result
+        :param result: previous GatingResult, of this plan or a plan with the
+                       same population paths
+        :param paths: paths of the populations to re-evaluate
+        :param profiler: optional Profiler recording a 'gate' stage for each
+                         re-evaluated population
+        :param max_threads: number of threads evaluating populations
+                            concurrently (see apply)
+        :return: new GatingResult, the previous result is not modified
+        """
+        if set(result.paths) != set(self._nodes_by_path):
+            raise ValueError("Result populations don't match the gating plan")
+        if result.event_count != events.shape[0]:
+            raise ValueError("Result event count doesn't match the events")
+
+        profiler = profiling.get_profiler(profiler)
+        dependent_paths = set(self.get_dependent_paths(paths))
+        new_result = GatingResult(
+            self,
+            result.event_count,
+            result.parent_mask,
+            result.histogram_bins,
+            result.histogram_ranges
+        )
+
+        for node in self.nodes:
+            if node.path not in dependent_paths:
+                new_result._copy_population(result, node.path)
+
+        nodes = [node for node in self.nodes if node.path in dependent_paths]
+        self._apply_nodes(events, nodes, new_result, profiler, max_threads)
+
+        return new_result
+
+    def _apply_nodes(self, events, nodes, result, profiler, max_threads):
+        """
+        Evaluates nodes (in plan order), any other dependencies of the nodes
+        must already be in the result
+        """
+        result._prepare_histograms(events, nodes)
+
+        if max_threads > 1 and len(nodes) > 1:
+            self._apply_concurrent(events, nodes, result, profiler, max_threads)
+
+            return
+
+        # row indices of parent populations, kept until all of their children
+        # have been evaluated
+        parent_indices = {}
+        pending_children = self._count_children(nodes)
+
+        for node in nodes:
+            parent = node.parent
+
+            if parent not in parent_indices:
+                parent_indices[parent] = gate.parent_event_indices(
+                    result.get_parent_mask(node.path)
+                )
+
+            indices = parent_indices[parent]
+
+            if profiler.enabled:
+                if indices is None:
+                    events_in = events.shape[0]
+                else:
+                    events_in = indices.shape[0]
+
+                with profiler.stage('gate', node.path, events_in) as stage:
+                    self._evaluate_node(events, node, result, indices)
+                    stage.events_out = result.get_count(node.path)
+            else:
+                self._evaluate_node(events, node, result, indices)
+
+            pending_children[parent] -= 1
+            if pending_children[parent] == 0:
+                del parent_indices[parent]
+
+    @staticmethod
+    def _count_children(nodes):
+        # number of nodes of each parent
+        counts = {}
+
+        for node in nodes:
+            counts[node.parent] = counts.get(node.parent, 0) + 1
+
+        return counts
+
+    def _apply_concurrent(self, events, nodes, result, profiler, max_threads):
+        """
+        Evaluates the nodes on a thread pool, submitting each node once all of
+        its dependencies have been evaluated. The NumPy containment tests
+        release the GIL, so nodes are evaluated in parallel.
+        """
+        position = dict((node.path, i) for i, node in enumerate(nodes))
+        remaining = {}
+        dependents = dict((node.path, []) for node in nodes)
+
+        # dependencies outside of the evaluated nodes are already in the result
+        for node in nodes:
+            dependencies = [d for d in node.dependencies if d in dependents]
+            remaining[node.path] = len(dependencies)
+
+            for dependency in dependencies:
+                dependents[dependency].append(node)
+
+        parent_indices = {}
+        pending_children = self._count_children(nodes)
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            def submit(node):
+                parent = node.parent
+
+                if parent not in parent_indices:
+                    parent_indices[parent] = gate.parent_event_indices(
+                        result.get_parent_mask(node.path)
+                    )
+
+                future = executor.submit(
+                    self._evaluate_node_timed,
+                    events,
+                    node,
+                    result,
+                    parent_indices[parent]
+                )
+                futures[future] = node
+
+            for node in nodes:
+                if remaining[node.path] == 0:
+                    submit(node)
+
+            while len(futures) > 0:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                # handle completed nodes in plan order, so nodes are submitted
+                # in the same order for the same plan
+                for future in sorted(done, key=lambda f: position[futures[f].path]):
+                    node = futures.pop(future)
+                    seconds, events_in = future.result()
+
+                    if profiler.enabled:
+                        profiler.add_record(
+                            'gate',
+                            node.path,
+                            seconds,
+                            events_in,
+                            result.get_count(node.path)
+                        )
+
+                    pending_children[node.parent] -= 1
+                    if pending_children[node.parent] == 0:
+                        del parent_indices[node.parent]
+
+                    for dependent in dependents[node.path]:
+                        remaining[dependent.path] -= 1
+
+                        if remaining[dependent.path] == 0:
+                            submit(dependent)
+
+    @classmethod
+    def _evaluate_node_timed(cls, events, node, result, indices):
+        start = time.perf_counter()
+        cls._evaluate_node(events, node, result, indices)
+
+        if indices is None:
+            events_in = events.shape[0]
+        else:
+            events_in = indices.shape[0]
+
+        return time.perf_counter() - start, events_in
+
+    @staticmethod
+    def _evaluate_node(events, node, result, indices):
+        parent_mask = result.get_parent_mask(node.path)
+
+        if indices is None:
+            parent_count = events.shape[0]
+        else:
+            parent_count = indices.shape[0]
+
+        region_masks = []
+        region_histograms = [None] * len(node.regions)
+
+        for region in node.regions:
+            if node.gate_type == 'Polygon':
+                if indices is None:
+                    x_events = events[:, region.x_index]
+                    y_events = events[:, region.y_index]
+                else:
+                    x_events = events[indices, region.x_index]
+                    y_events = events[indices, region.y_index]
+
+                is_in_gate = gate.points_in_gate_polygon(
+                    x_events,
+                    y_events,
+                    region.vertices,
+                    region.rectangle_bounds
+                )
+                mask = gate.indices_to_mask(events.shape[0], indices, is_in_gate)
+
+                if result.histogram_bins is not None:
+                    region_histograms[len(region_masks)] = result._compute_histogram(
+                        events,
+                        node,
+                        region,
+                        x_events,
+                        y_events,
+                        is_in_gate
+                    )
+            elif node.gate_type != 'Boolean':
+                if indices is None:
+                    columns = [events[:, i] for i in region.indices]
+                else:
+                    columns = [events[indices, i] for i in region.indices]
+
+                if node.gate_type == 'Rectangle':
+                    is_in_gate = gate.points_in_ranges(columns, region.bounds)
+                elif node.gate_type == 'Ellipsoid':
+                    is_in_gate = gate.points_in_ellipsoid(
+                        columns,
+                        region.mean,
+                        region.inverse_covariance,
+                        region.distance_square
+                    )
+                else:
+                    is_in_gate = gate.points_in_quadrants(
+                        columns,
+                        region.divider_values,
+                        region.quadrant_intervals
+                    )
+
+                mask = gate.indices_to_mask(events.shape[0], indices, is_in_gate)
+            else:
+                masks = [
+                    None if r is None else result.get_mask(r) for r in region.references
+                ]
+                mask = gate.get_boolean_gate_mask(
+                    region.tree,
+                    masks,
+                    events.shape[0],
+                    parent_mask,
+                    node.path
+                )
+
+            region_masks.append(mask)
+
+        result._set_population(node.path, region_masks, parent_count, region_histograms)
+
+
+class _GatingReport(object):
+    """
+    Builds the hierarchy and report outputs of a gating result, subclasses
+    provide the plan, the event count of each gate region and the parent
+    count of each population, keyed by population path
+    """
+    plan = None
+    _region_counts = None
+    _parent_counts = None
+
+    def get_gate_results(self, path):
+        """
+        Returns the list of gate result dictionaries for the gate regions of a
+        population, with the region's 'count' and 'ungated_count'
+        """
+        return [
+            {
+                'count': count,
+                'ungated_count': self._parent_counts[path]
+            } for count in self._region_counts[path]
+        ]
+
+    def to_populations(self):
+        """
+        Returns a nested dictionary of the gating hierarchy with the gate
+        results, in the same structure as the 'populations' of Workspace
+        samples and groups
+        """
+        populations = {}
+        level_dicts = {None: populations}
+
+        for path in self._hierarchy_paths(None):
+            node = self.plan.get_node(path)
+
+            gates = []
+            for gate_dict, gate_result in zip(node.gates, self.get_gate_results(path)):
+                gate_dict = dict(gate_dict)
+                gate_dict['result'] = gate_result
+                gates.append(gate_dict)
+
+            population = {
+                'gates': gates,
+                'children': {}
+            }
+            level_dicts[node.parent][node.label] = population
+            level_dicts[path] = population['children']
+
+        return populations
+
+    def _hierarchy_paths(self, path):
+        for child in self.plan.get_children(path):
+            yield child
+
+            for descendant in self._hierarchy_paths(child):
+                yield descendant
+
+    def to_dataframe(self):
+        """
+        Returns the summary report of the gate populations as a Pandas
+        DataFrame (see gate.results_to_dataframe)
+        """
+        return gate.results_to_dataframe({'populations': self.to_populations()})
+
+
+class GatingResult(_GatingReport):
+    """
+    Per-sample results of applying a GatingPlan: the event membership mask of
+    each population (aligned to the rows of the gated events) and its counts
+    """
+    def __init__(
+            self,
+            plan,
+            event_count,
+            parent_mask=None,
+            histogram_bins=None,
+            histogram_ranges=None
+    ):
+        self.plan = plan
+        self.event_count = event_count
+        self.parent_mask = parent_mask
+        self.histogram_bins = histogram_bins
+        self.histogram_ranges = histogram_ranges
+        self._masks = {}
+        self._region_masks = {}
+        self._region_counts = {}
+        self._parent_counts = {}
+        self._histograms = {}
+
+        # histogram ranges by column (given or computed from the events) and
+        # the parent histograms by parent path & axes, shared by sibling gates
+        # (with a lock per parent histogram, for concurrent evaluation)
+        self._column_ranges = dict(histogram_ranges or {})
+        self._parent_histograms = {}
+        self._parent_histogram_locks = {}
+        self._histogram_lock = threading.Lock()
+
+    def _set_population(self, path, region_masks, parent_count, region_histograms=None):
+        if len(region_masks) == 1:
+            mask = region_masks[0]
+        else:
+            mask = np.logical_or.reduce(region_masks)
+
+        self._masks[path] = mask
+        self._region_masks[path] = tuple(region_masks)
+        self._region_counts[path] = tuple(int(np.count_nonzero(m)) for m in region_masks)
+        self._parent_counts[path] = parent_count
+
+        if region_histograms is not None and any(h is not None for h in region_histograms):
+            self._histograms[path] = tuple(region_histograms)
+
+    def _copy_population(self, result, path):
+        # share the (unmodified) masks of a population of another result
+        self._masks[path] = result._masks[path]
+        self._region_masks[path] = result._region_masks[path]
+        self._region_counts[path] = result._region_counts[path]
+        self._parent_counts[path] = result._parent_counts[path]
+
+        if path in result._histograms:
+            self._histograms[path] = result._histograms[path]
+
+    def _prepare_histograms(self, events, nodes):
+        """
+        Computes the missing histogram ranges of the polygon gate axes of the
+        nodes before they are evaluated, so evaluation threads only read them
+        """
+        if self.histogram_bins is None:
+            return
+
+        for node in nodes:
+            if node.gate_type != 'Polygon':
+                continue
+
+            for region in node.regions:
+                for index in (region.x_index, region.y_index):
+                    if index not in self._column_ranges:
+                        self._column_ranges[index] = self._get_column_range(events, index)
+
+    @staticmethod
+    def _get_column_range(events, index):
+        column = events[:, index]
+
+        if column.shape[0] > 0:
+            minimum, maximum = float(column.min()), float(column.max())
+        else:
+            minimum, maximum = 0.0, 1.0
+        if maximum <= minimum:
+            maximum = minimum + 1.0
+
+        return minimum, maximum
+
+    def _get_parent_histogram_lock(self, parent_key):
+        with self._histogram_lock:
+            return self._parent_histogram_locks.setdefault(parent_key, threading.Lock())
+
+    def _compute_histogram(self, events, node, region, x_events, y_events, is_in_gate):
+        """
+        Bins the parent & gated events of a polygon gate region, the parent
+        histogram is computed once for all gates of a parent on the same axes
+        """
+        bins = self.histogram_bins
+        x_range = self._column_ranges[region.x_index]
+        y_range = self._column_ranges[region.y_index]
+
+        parent_key = (node.parent, region.x_index, region.y_index)
+        bin_indices = None
+
+        # sibling gates evaluated concurrently wait for the first one to bin
+        # the parent events instead of binning them again
+        with self._get_parent_histogram_lock(parent_key):
+            parent_histogram = self._parent_histograms.get(parent_key)
+
+            if parent_histogram is None:
+                bin_indices = gate.get_2d_bin_indices(x_events, y_events, x_range, y_range, bins)
+                parent_histogram = np.bincount(
+                    bin_indices,
+                    minlength=bins * bins
+                ).astype(np.int32).reshape(bins, bins)
+                self._parent_histograms[parent_key] = parent_histogram
+
+        if bin_indices is not None:
+            gated_indices = bin_indices[is_in_gate]
+        else:
+            gated_indices = gate.get_2d_bin_indices(
+                x_events[is_in_gate],
+                y_events[is_in_gate],
+                x_range,
+                y_range,
+                bins
+            )
+
+        gated_histogram = np.bincount(
+            gated_indices,
+            minlength=bins * bins
+        ).astype(np.int32).reshape(bins, bins)
+
+        return {
+            'x_channel': self.plan.channel_labels[str(region.x_index + 1)]['PnN'],
+            'y_channel': self.plan.channel_labels[str(region.y_index + 1)]['PnN'],
+            'x_edges': np.linspace(x_range[0], x_range[1], bins + 1),
+            'y_edges': np.linspace(y_range[0], y_range[1], bins + 1),
+            'parent': parent_histogram,
+            'gated': gated_histogram
+        }
+
+    @property
+    def paths(self):
+        """
+        Population paths in evaluation order
+        """
+        return [node.path for node in self.plan.nodes]
+
+    def get_mask(self, path):
+        """
+        Returns the event membership mask of a population, combining all gate
+        regions of the population
+        """
+        return self._masks[path]
+
+    def get_parent_mask(self, path):
+        """
+        Returns the event membership mask of the parent of a population (None
+        if the parent is all events)
+        """
+        parent = self.plan.get_node(path).parent
+
+        if parent is None:
+            return self.parent_mask
+
+        return self._masks[parent]
+
+    def get_count(self, path):
+        """
+        Returns the event count of a population, combining all gate regions
+        """
+        return int(np.count_nonzero(self._masks[path]))
+
+    def get_parent_count(self, path):
+        return self._parent_counts[path]
+
+    def get_region_counts(self, path):
+        """
+        Returns a tuple of the event counts of each gate region of a population
+        """
+        return self._region_counts[path]
+
+    def get_histograms(self, path):
+        """
+        Returns the 2-D histograms of the gate regions of a population, if
+        histograms were computed (see GatingPlan.apply)
+
+        :param path: population path
+        :return: tuple with a dictionary for each polygon gate region (None
+                 for other gate types) with the 'x_channel' & 'y_channel'
+                 labels, the 'x_edges' & 'y_edges' of the bins and the int32
+                 'parent' & 'gated' histograms, indexed [x bin, y bin] as
+                 numpy.histogram2d. Returns None if no histograms were
+                 computed for the population.
+        """
+        return self._histograms.get(path)
+
+    def get_gate_results(self, path):
+        """
+        Returns the list of gate result dictionaries for the gate regions of a
+        population, with the region's 'mask', 'count' and 'ungated_count'
+        (and the region's 'histogram' if histograms were computed)
+        """
+        gate_results = super(GatingResult, self).get_gate_results(path)
+        histograms = self._histograms.get(path)
+
+        for i, (gate_result, mask) in enumerate(zip(gate_results, self._region_masks[path])):
+            gate_result['mask'] = mask
+
+            if histograms is not None and histograms[i] is not None:
+                gate_result['histogram'] = histograms[i]
+
+        return gate_results
+
+    def get_gated_events(self, events, path):
+        """
+        Materialize the events of a population
+
+        :param events: NumPy array of the events the plan was applied to
+        :param path: population path
+        :return: NumPy array of the population's events (a copy)
+        """
+        return events[self._masks[path]]
+
+    def to_membership_matrix(self, paths=None, row_indices=None, event_count=None):
+        """
+        Returns the bit-packed event membership of the populations as a
+        MembershipMatrix, see MembershipMatrix.from_gating_result
+        """
+        return MembershipMatrix.from_gating_result(self, paths, row_indices, event_count)
+
+    def statistics_to_dataframe(self, events, quantiles=(), channels=None, median=True):
+        """
+        Returns summary statistics of every population & channel as a Pandas
+        DataFrame with the columns 'parent_path', 'label', 'channel',
+        'count', 'mean', 'median', 'geometric_mean', 'cv' and a column per
+        additional quantile (e.g. 'quantile_0.95'). See
+        statistics.compute_population_statistics.
+
+        :param events: NumPy array of events aligned to the gated events, e.g.
+                       the raw (sub-sampled), compensated or transformed events
+                       of the sample
+        :param quantiles: sequence of additional quantiles (between 0 and 1)
+        :param channels: optional list of the PnN labels of the channels, by
+                         default all channels
+        :param median: if False, the 'median' column is omitted, so
+                       population events are only gathered for quantiles
+        """
+        import pandas as pd
+
+        if events.shape[0] != self.event_count:
+            raise ValueError("Events don't match the gated events")
+
+        channel_numbers = sorted(self.plan.channel_labels, key=int)
+        if channels is None:
+            channels = [self.plan.channel_labels[c]['PnN'] for c in channel_numbers]
+
+        channel_map = dict(
+            (self.plan.channel_labels[c]['PnN'], int(c) - 1) for c in channel_numbers
+        )
+
+        try:
+            channel_indices = [channel_map[label] for label in channels]
+        except KeyError as e:
+            raise ValueError("Channel label not found in data: %s" % e.args[0])
+
+        nodes = self.plan.nodes
+        stats = compute_population_statistics(
+            events,
+            [self._masks[node.path] for node in nodes],
+            channel_indices,
+            quantiles,
+            median
+        )
+
+        parent_paths = [
+            'root' if node.parent is None else 'root' + node.parent for node in nodes
+        ]
+        channel_count = len(channels)
+
+        data = {
+            'parent_path': np.repeat(parent_paths, channel_count),
+            'label': np.repeat([node.label for node in nodes], channel_count),
+            'channel': np.tile(channels, len(nodes)),
+            'count': np.repeat(stats['count'], channel_count)
+        }
+        columns = ['parent_path', 'label', 'channel', 'count']
+        for name in ('mean', 'median', 'geometric_mean', 'cv'):
+            if name in stats:
+                data[name] = stats[name].ravel()
+                columns.append(name)
+
+        for i, quantile in enumerate(quantiles):
+            column = 'quantile_%g' % quantile
+            data[column] = stats['quantiles'][:, i, :].ravel()
+            columns.append(column)
+
+        df = pd.DataFrame(data, columns=columns)
+        df.sort_values(by=['parent_path', 'label'], inplace=True, kind='mergesort')
+
+        return df
+
+
+class GatingSummary(_GatingReport):
+    """
+    Accumulates population counts, and optionally summary statistics, over
+    the GatingResults of consecutive chunks of a sample's events. This allows
+    gating samples in chunks without holding all events or masks in memory.
+    """
+    def __init__(self, plan, statistics=False):
+        """
+        :param plan: GatingPlan applied to each chunk
+        :param statistics: if True, the count, mean, sum of squared deviations
+            from the mean, minimum and maximum of each channel are accumulated
+            for every population
+        """
+        self.plan = plan
+        self.event_count = 0
+        self.statistics = statistics
+        self._region_counts = dict(
+            (node.path, [0] * len(node.regions)) for node in plan.nodes
+        )
+        self._parent_counts = dict((node.path, 0) for node in plan.nodes)
+        self._counts = dict((node.path, 0) for node in plan.nodes)
+        self._statistics_counts = {}
+        self._means = {}
+        self._squared_deviations = {}
+        self._minimums = {}
+        self._maximums = {}
+
+    def add(self, result, events=None):
+        """
+        Add the gating result of a chunk of events
+
+        :param result: GatingResult of the chunk
+        :param events: NumPy array of the chunk events, required if statistics
+            are accumulated
+        """
+        self.event_count += result.event_count
+
+        for node in self.plan.nodes:
+            region_counts = self._region_counts[node.path]
+
+            for i, count in enumerate(result.get_region_counts(node.path)):
+                region_counts[i] += count
+
+            self._parent_counts[node.path] += result.get_parent_count(node.path)
+            self._counts[node.path] += result.get_count(node.path)
+
+        if self.statistics:
+            if events is None:
+                raise ValueError("Events are required to accumulate statistics")
+
+            self._add_statistics(result, events)
+
+    def _add_statistics(self, result, events):
+        channel_count = events.shape[1]
+
+        for node in self.plan.nodes:
+            path = node.path
+
+            if path not in self._means:
+                self._statistics_counts[path] = 0
+                self._means[path] = np.zeros(channel_count)
+                self._squared_deviations[path] = np.zeros(channel_count)
+                self._minimums[path] = np.full(channel_count, np.inf)
+                self._maximums[path] = np.full(channel_count, -np.inf)
+
+            mask = result.get_mask(path)
+
+            if not mask.any():
+                continue
+
+            # copies are bounded by the chunk size
+            population_events = np.asarray(events[mask], dtype=np.float64)
+
+            # the chunk's mean & squared deviations are merged with those of
+            # the previous chunks (Chan et al.), rather than accumulating sums
+            # of squares, which cancel for large values with a small spread
+            chunk_count = population_events.shape[0]
+            chunk_mean = population_events.mean(axis=0)
+            deviations = population_events - chunk_mean
+            chunk_squared_deviations = (deviations * deviations).sum(axis=0)
+
+            count = self._statistics_counts[path]
+            total_count = count + chunk_count
+            delta = chunk_mean - self._means[path]
+
+            self._means[path] += delta * (chunk_count / total_count)
+            self._squared_deviations[path] += (
+                chunk_squared_deviations + delta * delta * (count * chunk_count / total_count)
+            )
+            self._statistics_counts[path] = total_count
+
+            np.minimum(
+                self._minimums[path],
+                population_events.min(axis=0),
+                out=self._minimums[path]
+            )
+            np.maximum(
+                self._maximums[path],
+                population_events.max(axis=0),
+                out=self._maximums[path]
+            )
+
+    def get_count(self, path):
+        """
+        Returns the event count of a population, combining all gate regions
+        """
+        return self._counts[path]
+
+    def get_parent_count(self, path):
+        return self._parent_counts[path]
+
+    def statistics_to_dataframe(self):
+        """
+        Returns the accumulated statistics as a Pandas DataFrame with one row
+        per population and channel, with the columns 'parent_path', 'label',
+        'channel', 'count', 'mean', 'std', 'min' and 'max'
+        """
+        import pandas as pd
+
+        if not self.statistics:
+            raise ValueError("Statistics were not accumulated")
+
+        channel_labels = [
+            self.plan.channel_labels[c]['PnN']
+            for c in sorted(self.plan.channel_labels, key=int)
+        ]
+        rows = []
+
+        for node in self.plan.nodes:
+            if node.parent is None:
+                parent_path = 'root'
+            else:
+                parent_path = 'root' + node.parent
+
+            count = self._counts[node.path]
+
+            for i, channel_label in enumerate(channel_labels):
+                if count > 0:
+                    mean = self._means[node.path][i]
+                    std = np.sqrt(self._squared_deviations[node.path][i] / count)
+                    minimum = self._minimums[node.path][i]
+                    maximum = self._maximums[node.path][i]
+                else:
+                    mean = std = minimum = maximum = np.nan
+
+                rows.append({
+                    'parent_path': parent_path,
+                    'label': node.label,
+                    'channel': channel_label,
+                    'count': count,
+                    'mean': mean,
+                    'std': std,
+                    'min': minimum,
+                    'max': maximum
+                })
+
+        df = pd.DataFrame(
+            rows,
+            columns=['parent_path', 'label', 'channel', 'count', 'mean', 'std', 'min', 'max']
+        )
+        df.sort_values(by=['parent_path', 'label'], inplace=True, kind='mergesort')
+
+        return df
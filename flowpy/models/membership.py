@@ -0,0 +1,133 @@
+import numpy as np
+
+# number of set bits of each byte value
+_BIT_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class MembershipMatrix(object):
+    """
+    Bit-packed event membership of the populations of a gating hierarchy,
+    i.e. a boolean (events x populations) matrix using 1 bit per value
+
+    The bits are stored population-major, one row of packed bytes for each
+    population (see numpy.packbits), so the mask of a single population is
+    unpacked from contiguous memory. Events are in the row order of the
+    sample's raw events, events excluded by a sub-sample are not members of
+    any population.
+    """
+    def __init__(self, packed, paths, event_count):
+        """
+        :param packed: uint8 NumPy array of shape (population count,
+                       ceil(event_count / 8)) of the packed membership bits
+        :param paths: list of population paths, in the order of the rows of
+                      packed
+        :param event_count: number of events
+        """
+        packed = np.asarray(packed, dtype=np.uint8)
+
+        if packed.shape != (len(paths), (event_count + 7) // 8):
+            raise ValueError("Packed membership shape doesn't match the paths & event count")
+
+        self.packed = packed
+        self.paths = tuple(paths)
+        self.path_index = dict((path, i) for i, path in enumerate(self.paths))
+        self.event_count = event_count
+
+    @classmethod
+    def from_gating_result(cls, gating_result, paths=None, row_indices=None, event_count=None):
+        """
+        Packs the population masks of a GatingResult
+
+        :param gating_result: GatingResult
+        :param paths: optional list of the population paths to include, by
+                      default all populations in evaluation order
+        :param row_indices: optional array of the row indices (in the original
+                            events) of the gated events, e.g. the sub-sample
+                            indices of a Sample. If None, the gated events are
+                            the original events.
+        :param event_count: number of original events, required with
+                            row_indices
+        :return: MembershipMatrix
+        """
+        if paths is None:
+            paths = gating_result.paths
+
+        if row_indices is None:
+            event_count = gating_result.event_count
+        elif event_count is None:
+            raise ValueError("event_count is required with row_indices")
+        elif row_indices.shape[0] == event_count:
+            # sorted indices of all events, masks are already aligned
+            row_indices = None
+
+        packed = np.empty((len(paths), (event_count + 7) // 8), dtype=np.uint8)
+
+        for i, path in enumerate(paths):
+            mask = gating_result.get_mask(path)
+
+            if row_indices is not None:
+                aligned_mask = np.zeros(event_count, dtype=np.bool_)
+                aligned_mask[row_indices] = mask
+                mask = aligned_mask
+
+            packed[i] = np.packbits(mask)
+
+        return cls(packed, paths, event_count)
+
+    @property
+    def shape(self):
+        """
+        Shape of the (unpacked) membership matrix, (events, populations)
+        """
+        return self.event_count, len(self.paths)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def get_mask(self, path):
+        """
+        Returns the boolean event membership mask of a population
+
+        :param path: population path
+        :return: boolean NumPy array of length event_count
+        """
+        bits = np.unpackbits(self.packed[self.path_index[path]], count=self.event_count)
+
+        return bits.view(np.bool_)
+
+    def get_count(self, path):
+        """
+        Returns the number of events in a population, without unpacking
+        """
+        return int(_BIT_COUNTS[self.packed[self.path_index[path]]].sum(dtype=np.int64))
+
+    def get_event_membership(self, event_index):
+        """
+        Returns the population membership of a single event
+
+        :param event_index: row index of the event
+        :return: boolean NumPy array with a value for each population path
+        """
+        if not 0 <= event_index < self.event_count:
+            raise IndexError("Event index %d out of range" % event_index)
+
+        byte_index, bit_index = divmod(event_index, 8)
+
+        return ((self.packed[:, byte_index] >> (7 - bit_index)) & 1).astype(np.bool_)
+
+    def to_array(self, paths=None):
+        """
+        Returns the unpacked boolean (events x populations) membership matrix
+
+        :param paths: optional list of population paths for the columns, by
+                      default all populations
+        :return: boolean NumPy array
+        """
+        if paths is None:
+            paths = self.paths
+
+        rows = [self.path_index[path] for path in paths]
+        bits = np.unpackbits(self.packed[rows], axis=1, count=self.event_count)
+
+        return bits.view(np.bool_).T
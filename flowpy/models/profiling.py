@@ -0,0 +1,224 @@
+import time
+import tracemalloc
+
+
+class _NullStage(object):
+    """
+    Stage context of a disabled profiler, does nothing
+    """
+    __slots__ = ()
+
+    events_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        # ignore events_out assignments
+        pass
+
+
+class _NullProfiler(object):
+    """
+    Disabled profiler, used in place of a Profiler so instrumented code
+    doesn't need to check whether profiling is enabled
+    """
+    enabled = False
+
+    _stage = _NullStage()
+
+    def stage(self, stage, name=None, events_in=None):
+        return self._stage
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def get_profiler(profiler):
+    """
+    Returns the given profiler, or the disabled profiler if None
+    """
+    if profiler is None:
+        return NULL_PROFILER
+
+    return profiler
+
+
+class _ProfileStage(object):
+    """
+    Context of a profiled stage, set events_out before the context exits to
+    record the number of output events
+    """
+    def __init__(self, profiler, stage, name, events_in):
+        self.profiler = profiler
+        self.stage = stage
+        self.name = name
+        self.events_in = events_in
+        self.events_out = None
+
+        self._start_time = None
+        self._start_memory = 0
+        self._peak_memory = 0
+        self._started_tracing = False
+
+    def __enter__(self):
+        self.profiler._enter_stage(self)
+        self._start_time = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start_time
+        self.profiler._exit_stage(self, seconds, exc_type is None)
+
+        return False
+
+
+class Profiler(object):
+    """
+    Records the wall time, input & output event counts and peak allocated
+    memory of processing stages, e.g. FCS parsing, sub-sampling, compensation
+    and the evaluation of each gate.
+
+    Stages can be nested, e.g. the gate stages within the gating stage of an
+    analysis. Peak memory is measured with tracemalloc (which adds overhead to
+    the profiled code), and is the peak of the memory allocated during the
+    stage above the memory allocated when the stage started. Memory mapped
+    file data is not included.
+    """
+    enabled = True
+
+    def __init__(self, callback=None, memory=True):
+        """
+        :param callback: optional function called with the record dictionary
+                         of each stage as it completes, e.g. to send the
+                         records to a metrics system
+        :param memory: if True, the peak allocated memory of each stage is
+                       measured. If False, only times & event counts are
+                       recorded, without the overhead of tracing allocations.
+        """
+        self.callback = callback
+        self.memory = memory
+        self.records = []
+
+        self._stack = []
+
+    def stage(self, stage, name=None, events_in=None):
+        """
+        Returns a context manager profiling a stage
+
+        :param stage: stage type, e.g. 'compensate' or 'gate'
+        :param name: optional name of the stage instance, e.g. the population
+                     path of a gate
+        :param events_in: optional number of input events
+        """
+        return _ProfileStage(self, stage, name, events_in)
+
+    def _enter_stage(self, profile_stage):
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                profile_stage._started_tracing = True
+
+            current, peak = tracemalloc.get_traced_memory()
+
+            # the peak is reset for each stage, so keep the peak of the
+            # enclosing stages so far
+            for outer_stage in self._stack:
+                outer_stage._peak_memory = max(outer_stage._peak_memory, peak)
+
+            tracemalloc.reset_peak()
+
+            profile_stage._start_memory = current
+            profile_stage._peak_memory = current
+
+        self._stack.append(profile_stage)
+
+    def _exit_stage(self, profile_stage, seconds, succeeded):
+        self._stack.pop()
+
+        if self.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(profile_stage._peak_memory, peak)
+
+            for outer_stage in self._stack:
+                outer_stage._peak_memory = max(outer_stage._peak_memory, peak)
+
+            peak_memory = peak - profile_stage._start_memory
+
+            if profile_stage._started_tracing:
+                tracemalloc.stop()
+        else:
+            peak_memory = None
+
+        record = {
+            'stage': profile_stage.stage,
+            'name': profile_stage.name,
+            'depth': len(self._stack),
+            'seconds': seconds,
+            'events_in': profile_stage.events_in,
+            'events_out': profile_stage.events_out,
+            'peak_memory_bytes': peak_memory,
+            'succeeded': succeeded
+        }
+
+        self.records.append(record)
+
+        if self.callback is not None:
+            self.callback(record)
+
+    def add_record(self, stage, name, seconds, events_in=None, events_out=None):
+        """
+        Records a stage measured elsewhere, e.g. in a worker thread, without
+        a peak memory value. The stage is nested in the currently open stage.
+        """
+        record = {
+            'stage': stage,
+            'name': name,
+            'depth': len(self._stack),
+            'seconds': seconds,
+            'events_in': events_in,
+            'events_out': events_out,
+            'peak_memory_bytes': None,
+            'succeeded': True
+        }
+
+        self.records.append(record)
+
+        if self.callback is not None:
+            self.callback(record)
+
+    def clear(self):
+        """
+        Remove all recorded stages
+        """
+        self.records = []
+
+    def to_dict(self):
+        """
+        Returns the stage records (in order of completion) as a list of
+        dictionaries
+        """
+        return [dict(record) for record in self.records]
+
+    def to_dataframe(self):
+        """
+        Returns the stage records (in order of completion) as a DataFrame
+        """
+        import pandas as pd
+
+        columns = [
+            'stage',
+            'name',
+            'depth',
+            'seconds',
+            'events_in',
+            'events_out',
+            'peak_memory_bytes',
+            'succeeded'
+        ]
+
+        return pd.DataFrame(self.records, columns=columns)
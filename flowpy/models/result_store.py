@@ -0,0 +1,229 @@
+import json
+import os
+import numpy as np
+from flowpy.models.cache import write_atomic
+from flowpy.models.membership import MembershipMatrix
+
+INDEX_FILE_NAME = 'index.json'
+
+
+class ResultStore(object):
+    """
+    A directory of the gating results of many samples, stored column by
+    column so downstream analyses only read the data they use
+
+    Each sample has its own directory containing the population report, the
+    bit-packed population membership (one row per population, see
+    MembershipMatrix) and optionally the gated events with one .npy file per
+    channel. Arrays are memory mapped when read, so reading the events of one
+    population for two channels only touches those two channel files and
+    that population's membership row. An index file lists the samples, and
+    is rewritten after each sample is added, so results can be appended as
+    samples finish. A store has a single writer at a time.
+    """
+    def __init__(self, store_dir):
+        """
+        :param store_dir: store directory, created if it doesn't exist
+        """
+        self.store_dir = store_dir
+
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+
+        index_path = os.path.join(store_dir, INDEX_FILE_NAME)
+
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as fh:
+                self._samples = json.load(fh)['samples']
+        else:
+            self._samples = []
+
+    def _sample_dir(self, sample_id):
+        return os.path.join(self.store_dir, 'samples', '%06d' % sample_id)
+
+    def _get_entry(self, sample_id):
+        for entry in self._samples:
+            if entry['sample_id'] == sample_id:
+                return entry
+
+        raise KeyError("Sample %s not found in result store" % sample_id)
+
+    def add_sample(self, results, events=None, channel_labels=None, membership=True):
+        """
+        Add the results of a sample to the store
+
+        :param results: results dictionary of Workspace.analyze_sample, with
+                        the 'filename', 'report' and 'gating_result'
+        :param events: optional NumPy array of the gated events (e.g. the
+                       compensated events of the sample) to store
+        :param channel_labels: list of the PnN labels of the columns of events,
+                               required with events
+        :param membership: if True, the population membership of the events is
+                           stored, required to read population events
+        :return: ID of the sample in the store
+        """
+        gating_result = results['gating_result']
+
+        if events is not None:
+            if channel_labels is None or len(channel_labels) != events.shape[1]:
+                raise ValueError("A channel label is required for each column of events")
+            if events.shape[0] != gating_result.event_count:
+                raise ValueError("Events don't match the gated events")
+
+        if len(self._samples) > 0:
+            sample_id = self._samples[-1]['sample_id'] + 1
+        else:
+            sample_id = 0
+
+        sample_dir = self._sample_dir(sample_id)
+        if not os.path.isdir(sample_dir):
+            os.makedirs(sample_dir)
+
+        entry = {
+            'sample_id': sample_id,
+            'filename': results['filename'],
+            'event_count': gating_result.event_count,
+            'channels': [],
+            'paths': []
+        }
+
+        report = results['report']
+        write_atomic(
+            os.path.join(sample_dir, 'report.csv'),
+            lambda fh: fh.write(report.to_csv(index=False).encode('utf-8'))
+        )
+
+        if membership:
+            membership_matrix = gating_result.to_membership_matrix()
+            write_atomic(
+                os.path.join(sample_dir, 'membership.npy'),
+                lambda fh: np.save(fh, membership_matrix.packed)
+            )
+            entry['paths'] = list(membership_matrix.paths)
+
+        if events is not None:
+            for i, label in enumerate(channel_labels):
+                # a contiguous copy of one column at a time
+                column = np.ascontiguousarray(events[:, i])
+                write_atomic(
+                    os.path.join(sample_dir, 'channel_%03d.npy' % i),
+                    lambda fh: np.save(fh, column)
+                )
+
+            entry['channels'] = list(channel_labels)
+
+        # the index is written last, so it only lists complete samples
+        samples = self._samples + [entry]
+        index = json.dumps({'samples': samples})
+
+        write_atomic(
+            os.path.join(self.store_dir, INDEX_FILE_NAME),
+            lambda fh: fh.write(index.encode('utf-8'))
+        )
+        self._samples = samples
+
+        return sample_id
+
+    def get_samples(self):
+        """
+        Returns a list of the stored samples, as dictionaries with the
+        'sample_id', 'filename', 'event_count', stored 'channels' and
+        population 'paths' with stored membership
+        """
+        return [dict(entry) for entry in self._samples]
+
+    def get_report(self, sample_ids=None):
+        """
+        Returns the population reports of the samples as a single Pandas
+        DataFrame, with an additional 'filename' column
+
+        :param sample_ids: optional list of sample IDs, by default all samples
+        """
+        import pandas as pd
+
+        if sample_ids is None:
+            sample_ids = [entry['sample_id'] for entry in self._samples]
+
+        reports = []
+
+        for sample_id in sample_ids:
+            entry = self._get_entry(sample_id)
+            report = pd.read_csv(os.path.join(self._sample_dir(sample_id), 'report.csv'))
+            report.insert(0, 'filename', entry['filename'])
+            reports.append(report)
+
+        if len(reports) == 0:
+            return pd.DataFrame()
+
+        return pd.concat(reports, ignore_index=True)
+
+    def get_membership(self, sample_id):
+        """
+        Returns the MembershipMatrix of a sample, backed by the memory mapped
+        membership file
+        """
+        entry = self._get_entry(sample_id)
+
+        if len(entry['paths']) == 0:
+            raise ValueError("Membership of sample %s was not stored" % sample_id)
+
+        packed = np.load(os.path.join(self._sample_dir(sample_id), 'membership.npy'), mmap_mode='r')
+
+        return MembershipMatrix(packed, entry['paths'], entry['event_count'])
+
+    def get_events(self, sample_id, channels=None, path=None):
+        """
+        Returns stored events of a sample
+
+        :param sample_id: sample ID in the store
+        :param channels: optional list of the PnN labels of the channels, by
+                         default all stored channels
+        :param path: optional population path, if given only the events of
+                     the population are returned
+        :return: NumPy array of the events, with a column per channel
+        """
+        entry = self._get_entry(sample_id)
+
+        if channels is None:
+            channels = entry['channels']
+
+        columns = []
+
+        for label in channels:
+            try:
+                i = entry['channels'].index(label)
+            except ValueError:
+                raise ValueError("Channel %s was not stored for sample %s" % (label, sample_id))
+
+            columns.append(
+                np.load(
+                    os.path.join(self._sample_dir(sample_id), 'channel_%03d.npy' % i),
+                    mmap_mode='r'
+                )
+            )
+
+        if path is not None:
+            mask = self.get_membership(sample_id).get_mask(path)
+            columns = [column[mask] for column in columns]
+
+        if len(columns) == 0:
+            return np.empty((0, 0))
+
+        return np.column_stack(columns)
+
+    def iter_population_events(self, path, channels, sample_ids=None):
+        """
+        Iterates over the events of a population in many samples
+
+        :param path: population path
+        :param channels: list of the PnN labels of the channels
+        :param sample_ids: optional list of sample IDs, by default all samples
+        :return: generator of (sample_id, filename, events) tuples
+        """
+        if sample_ids is None:
+            sample_ids = [entry['sample_id'] for entry in self._samples]
+
+        for sample_id in sample_ids:
+            entry = self._get_entry(sample_id)
+
+            yield sample_id, entry['filename'], self.get_events(sample_id, channels, path)
@@ -1,28 +1,143 @@
 import numpy as np
 import os
-import flowio
-import flowutils
+import warnings
+from flowpy.models import fcs
+from flowpy.models import profiling
+from flowpy.models import transforms
+from flowpy.models.cache import hash_text
+from flowpy.models.compensation import Compensation, get_compensation
+
+
+# processing stages of a Sample, in order. Each stage is computed from the
+# events of the previous stage when first accessed, and changing the
+# parameters of a stage invalidates the cached events of that stage and all
+# of the following stages.
+PIPELINE_STAGES = ('subsample', 'compensate', 'transform')
+
+# dtype policies of the processed (sub-sampled, compensated & transformed)
+# events, see Sample
+DTYPE_POLICIES = (None, 'auto', 'float32', 'float64')
+
+
+def get_events_dtype(dtype, raw_dtype):
+    """
+    Returns the NumPy dtype of the processed events for a dtype policy, None
+    for the default policy (the dtype of each stage is kept)
+
+    :param dtype: dtype policy, one of DTYPE_POLICIES
+    :param raw_dtype: dtype of the raw events
+    """
+    if dtype not in DTYPE_POLICIES:
+        raise ValueError(
+            "dtype must be one of %s, got %r" % (', '.join(repr(d) for d in DTYPE_POLICIES), dtype)
+        )
+
+    if dtype is None:
+        return None
+    elif dtype == 'auto':
+        if raw_dtype == np.float32:
+            return np.dtype(np.float32)
+        return np.dtype(np.float64)
+
+    return np.dtype(dtype)
 
 
 class Sample(object):
     """
     Represents an Flow Cytometry Standard (FCS) sample
     """
-    def __init__(self, fcs_file_path, track_indices=False):
+    def __init__(
+            self,
+            fcs_file_path,
+            track_indices=False,
+            memory_map=False,
+            cache=None,
+            profiler=None,
+            dtype=None
+    ):
         """
         fcs_file_path: path to FCS file
         track_indices: if True, adds a column to event data for tracking event indices
             for all analysis operations
+        memory_map: if True, the FCS DATA segment is memory mapped instead of read,
+            so raw_events is a read-only view of the file and event data is only
+            read from disk when accessed. Falls back to reading the file if the
+            data layout can't be memory mapped. Not compatible with track_indices.
+        cache: optional SampleCache. If the FCS file is in the cache its events,
+            metadata and channels are loaded from the cache (memory mapped,
+            read-only) instead of parsing the file, otherwise they are stored
+            after parsing. Compensated events are cached as well.
+        profiler: optional Profiler recording the time, event counts & memory of
+            loading the file and of each processing stage
+        dtype: dtype policy of the sub-sampled, compensated & transformed events:
+            None keeps the dtype of each stage (raw events are sub-sampled as
+            read, compensated events keep a float dtype, transformed events are
+            float64), 'float32' or 'float64' store the events of every stage in
+            that dtype, and 'auto' uses float32 if the FCS data is float32
+            (DATATYPE 'F') and float64 otherwise. Compensation & transforms are
+            computed in float64 and stored in the policy's dtype, so float32
+            halves the memory & bandwidth of each stage at the cost of rounding
+            the stored values (see Workspace.validate_precision).
 
         Note: Retrieving events always gives the sub-sampled data. Use subsample_count=0 
         to analyze all the events.
         """
-
-        flow_data = flowio.FlowData(fcs_file_path)
-        self.metadata = flow_data.text
-        self.event_count = flow_data.event_count
+        self.profiler = profiling.get_profiler(profiler)
+
+        with self.profiler.stage('load', os.path.basename(fcs_file_path)) as load_stage:
+            raw_events = None
+            cache_key = None
+
+            if cache is not None:
+                cache_key = cache.get_file_key(fcs_file_path)
+                cached = cache.load_sample(cache_key)
+
+                if cached is not None:
+                    raw_events = cached['raw_events']
+                    metadata = cached['metadata']
+                    channels = cached['channels']
+                    event_count = raw_events.shape[0]
+
+            if raw_events is None and memory_map:
+                if track_indices:
+                    raise ValueError("track_indices is not supported for memory mapped samples")
+
+                fcs_text = fcs.read_fcs_text(fcs_file_path)
+                raw_events = fcs.memory_map_events(fcs_file_path, fcs_text)
+
+                if raw_events is None:
+                    warnings.warn(
+                        "FCS data layout of %s can't be memory mapped, reading events instead" %
+                        fcs_file_path
+                    )
+                else:
+                    metadata = fcs_text['text']
+                    channels = fcs_text['channels']
+                    event_count = raw_events.shape[0]
+
+            if raw_events is None:
+                import flowio
+
+                flow_data = flowio.FlowData(fcs_file_path)
+                metadata = flow_data.text
+                channels = flow_data.channels
+                event_count = flow_data.event_count
+
+                # convert events to NumPy array
+                raw_events = np.reshape(
+                    flow_data.events,
+                    (-1, flow_data.channel_count)
+                )
+
+            load_stage.events_out = event_count
+
+            if cache is not None and cached is None:
+                cache.store_sample(cache_key, raw_events, metadata, channels)
+
+        self.metadata = metadata
+        self.event_count = event_count
         try:
-            self.acquisition_date = flow_data.text['date']
+            self.acquisition_date = metadata['date']
         except KeyError:
             self.acquisition_date = None
 
@@ -30,7 +145,7 @@ class Sample(object):
         self.filename = os.path.basename(fcs_file_path)
 
         self.channels = {}
-        for chan_num, labels in flow_data.channels.items():
+        for chan_num, labels in channels.items():
             if track_indices:
                 new_chan_num = str(int(chan_num) + 1)
             else:
@@ -42,26 +157,114 @@ class Sample(object):
             self.channels['1'] = {'PnN': 'Index'}
 
         # compensation & transform info
-        # TODO: implement extraction of compensation from FCS metadata
+        # the spillover keyword is only parsed when it's used (see
+        # get_metadata_compensation)
+        self._metadata_compensation = None
+        self._metadata_compensation_parsed = False
         self._fluoro_indices = None
 
         # sub-sample info
         self.subsample_indices = None
         self.subsample_count = None
 
-        # retrieving event arrays, always based on sub-sampled array
-        self.events_compensated = None
-        self.events_transformed = None
+        # processing pipeline parameters & cached events by stage, retrieving
+        # event arrays is always based on sub-sampled array
+        self._stage_params = {}
+        self._stage_events = {}
+        self._compensation = None
 
-        # convert events to NumPy array
-        self.raw_events = np.reshape(
-            flow_data.events,
-            (-1, flow_data.channel_count)
-        )
+        self._cache = cache
+        self._cache_key = cache_key
+
+        self.raw_events = raw_events
         if track_indices:
-            self.raw_events = np.hstack(
-                (np.array(range(flow_data.event_count))[:, np.newaxis], self.raw_events)
+            # the events are copied once, after the index column
+            index_dtype = raw_events.dtype
+            if index_dtype.kind == 'f' and event_count > 2 ** (np.finfo(index_dtype).nmant + 1):
+                # indices beyond the float's exact integer range
+                index_dtype = np.dtype(np.float64)
+
+            self.raw_events = np.empty(
+                (event_count, raw_events.shape[1] + 1),
+                dtype=index_dtype
             )
+            self.raw_events[:, 0] = np.arange(event_count, dtype=index_dtype)
+            self.raw_events[:, 1:] = raw_events
+
+        self.dtype = dtype
+        self.events_dtype = get_events_dtype(dtype, self.raw_events.dtype)
+
+    def set_dtype(self, dtype):
+        """
+        Changes the dtype policy of the processed events (see Sample),
+        invalidating the cached events of every stage if the dtype changes.
+        Stage parameters (sub-sample, compensation & transform) are kept.
+
+        :param dtype: dtype policy, one of DTYPE_POLICIES
+        """
+        events_dtype = get_events_dtype(dtype, self.raw_events.dtype)
+
+        if events_dtype != self.events_dtype:
+            self._stage_events.clear()
+
+        self.dtype = dtype
+        self.events_dtype = events_dtype
+
+    def _as_events_dtype(self, events):
+        """
+        Returns events in the dtype of the dtype policy, without copying them
+        if they already are
+        """
+        if self.events_dtype is None:
+            return events
+
+        return events.astype(self.events_dtype, copy=False)
+
+    def get_raw_events(self, channel_numbers=None):
+        """
+        Returns the raw events of the given channels as an in-memory NumPy
+        array. For memory mapped samples, only the requested channels are
+        read into memory.
+
+        :param channel_numbers: list of channel numbers (not indices), if None
+            all channels are returned
+        :return: NumPy array of raw events
+        """
+        if channel_numbers is None:
+            return np.array(self.raw_events)
+
+        channel_indices = [int(c) - 1 for c in channel_numbers]
+
+        return np.array(self.raw_events[:, channel_indices])
+
+    def get_channel_ranges(self):
+        """
+        Returns the data ranges of the channels from the PnR keywords of the
+        FCS metadata
+
+        :return: dictionary of the (0, PnR) range tuples keyed by the column
+            index of the channel in the events, channels without a valid PnR
+            value are omitted
+        """
+        ranges_by_label = {}
+
+        for number in range(1, int(self.metadata.get('par', 0)) + 1):
+            label = self.metadata.get('p%dn' % number)
+
+            try:
+                ranges_by_label[label] = (0.0, float(self.metadata['p%dr' % number]))
+            except (KeyError, ValueError):
+                continue
+
+        ranges = {}
+
+        for c, labels in self.channels.items():
+            channel_range = ranges_by_label.get(labels['PnN'])
+
+            if channel_range is not None and channel_range[1] > 0:
+                ranges[int(c) - 1] = channel_range
+
+        return ranges
 
     def get_channel_numbers_by_channel_labels(self):
         channel_map = {}
@@ -71,35 +274,121 @@ class Sample(object):
 
         return channel_map
 
-    def generate_subsample(self, subsample_count, random_seed, filter_neg_scatter=False):
+    def _set_stage_params(self, stage, params):
+        """
+        Sets the parameters of a processing stage, invalidating the cached
+        events of the stage and all following stages if the parameters changed
+
+        :return: True if the parameters changed
+        """
+        if stage in self._stage_params and self._stage_params[stage] == params:
+            return False
+
+        self._stage_params[stage] = params
+
+        for downstream_stage in PIPELINE_STAGES[PIPELINE_STAGES.index(stage):]:
+            self._stage_events.pop(downstream_stage, None)
+
+        return True
+
+    def _get_negative_scatter_mask(self):
+        """
+        Returns a boolean array of the events with a negative value in any
+        scatter channel
+        """
+        scatter_indices = []
+        for c, labels in self.channels.items():
+            if labels['PnN'][0:3] in ['FSC', 'SSC']:
+                scatter_indices.append(int(c) - 1)
+
+        return (self.raw_events[:, scatter_indices] < 0).any(axis=1)
+
+    def generate_subsample(
+            self,
+            subsample_count,
+            random_seed,
+            filter_neg_scatter=False,
+            method='shuffle',
+            time_bins=100
+    ):
         """
         Sub-samples FCS sample. Set subsample_count to 0 (zero) to use all events
         
         Retrieve sub-sampled indices via subsample_indices.
         Retrieve sub-sample events via get_subsample()
+
+        If the sub-sample parameters changed, any compensated and transformed
+        events are recomputed on their next access.
+
+        Sub-sampling methods:
+            'shuffle': shuffles the indices of all events using a RandomState
+                seeded with random_seed, and keeps the first subsample_count.
+                This is the original method, giving the same indices for a
+                given seed as previous versions.
+            'choice': selects subsample_count indices without replacement
+                using a numpy Generator seeded with random_seed, without
+                shuffling all events. The work is proportional to the number
+                of requested events, though the indices differ from 'shuffle'.
+            'time_stratified': divides the events into time_bins equal-width
+                bins of the 'Time' channel and sub-samples each bin in
+                proportion to its event count (using 'choice')
         """
-        # use all events if subsample count is zero (or less)
-        if subsample_count <= 0:
-            subsample_count = self.event_count
+        params = (subsample_count, random_seed, filter_neg_scatter, method, time_bins)
+
+        if self._stage_params.get('subsample') == params:
+            return
+
+        if method not in ('shuffle', 'choice', 'time_stratified'):
+            raise ValueError("Sub-sample method %s is not valid" % method)
+
+        with self.profiler.stage('subsample', method, self.event_count) as subsample_stage:
+            # use all events if subsample count is zero (or less)
+            if subsample_count <= 0:
+                subsample_count = self.event_count
 
+            if method == 'shuffle':
+                indices = self._subsample_shuffle(subsample_count, random_seed, filter_neg_scatter)
+            else:
+                # If flagged, filter out events with negative scatter values.
+                if filter_neg_scatter:
+                    valid_indices = np.flatnonzero(~self._get_negative_scatter_mask())
+                else:
+                    valid_indices = None
+
+                rng = np.random.default_rng(random_seed)
+
+                if method == 'choice':
+                    indices = self._subsample_choice(rng, subsample_count, valid_indices)
+                else:
+                    indices = self._subsample_time_stratified(
+                        rng,
+                        subsample_count,
+                        valid_indices,
+                        time_bins
+                    )
+
+            subsample_stage.events_out = indices.shape[0]
+
+        # save indices
+        self.subsample_indices = indices
+        self.subsample_count = indices.shape[0]
+
+        self._set_stage_params('subsample', params)
+
+    def _subsample_shuffle(self, subsample_count, random_seed, filter_neg_scatter):
         # If flagged, filter out events with negative scatter values.
         # To do that we need the channel annotations
         if filter_neg_scatter:
-            scatter_indices = []
-            for c, labels in self.channels.items():
-                if labels['PnN'][0:3] in ['FSC', 'SSC']:
-                    scatter_indices.append(int(c) - 1)
-
-            is_neg = self.raw_events[:, scatter_indices] < 0
-            is_neg = np.where(is_neg.any(True))[0]
+            is_neg = np.flatnonzero(self._get_negative_scatter_mask())
         else:
             is_neg = []
 
-        if self.event_count - len(is_neg) < subsample_count:
-            # The sample has fewer events than requested,
-            # but we'll go ahead and use what we've got
+        if self.event_count - len(is_neg) <= subsample_count:
+            # The sample has no more events than requested (or all events were
+            # requested), so the sorted sub-sample is all (valid) events and
+            # shuffling them is skipped
             # TODO: at least throw a warning when this happens or make a flag-able option?
-            subsample_count = self.event_count - len(is_neg)
+            return np.delete(np.arange(self.event_count), is_neg)
 
         # generate random indices for subsample
         # using a new RandomState with given seed
@@ -109,8 +398,84 @@ class Sample(object):
         rng.seed(random_seed)
         rng.shuffle(shuffled_indices)
 
-        # save indices
-        self.subsample_indices = np.sort(shuffled_indices[:subsample_count])
+        return np.sort(shuffled_indices[:subsample_count])
+
+    def _subsample_choice(self, rng, subsample_count, valid_indices):
+        if valid_indices is None:
+            population_count = self.event_count
+        else:
+            population_count = valid_indices.shape[0]
+
+        if subsample_count >= population_count:
+            # use all (valid) events
+            if valid_indices is None:
+                return np.arange(self.event_count)
+            return valid_indices
+
+        indices = rng.choice(population_count, subsample_count, replace=False, shuffle=False)
+        indices.sort()
+
+        if valid_indices is not None:
+            indices = valid_indices[indices]
+
+        return indices
+
+    def _subsample_time_stratified(self, rng, subsample_count, valid_indices, time_bins):
+        channel_map = self.get_channel_numbers_by_channel_labels()
+
+        if 'Time' not in channel_map:
+            raise ValueError("Time channel not found for time stratified sub-sampling")
+
+        time_values = self.raw_events[:, channel_map['Time'] - 1]
+
+        if valid_indices is not None:
+            time_values = time_values[valid_indices]
+
+        population_count = time_values.shape[0]
+
+        if subsample_count >= population_count:
+            return self._subsample_choice(rng, subsample_count, valid_indices)
+
+        # assign each event to an equal-width time bin
+        time_min = time_values.min()
+        time_range = float(time_values.max()) - float(time_min)
+
+        if time_range > 0:
+            bins = ((time_values - time_min) * (time_bins / time_range)).astype(np.intp)
+            np.clip(bins, 0, time_bins - 1, out=bins)
+        else:
+            bins = np.zeros(population_count, dtype=np.intp)
+
+        # group event positions by bin
+        order = np.argsort(bins, kind='stable')
+        bin_counts = np.bincount(bins, minlength=time_bins)
+        bin_starts = np.concatenate(([0], np.cumsum(bin_counts)[:-1]))
+
+        # allocate the sub-sample in proportion to the bin counts, using the
+        # largest remainders to distribute the rounding
+        quotas = bin_counts * (float(subsample_count) / population_count)
+        allocation = np.floor(quotas).astype(np.intp)
+        shortfall = subsample_count - allocation.sum()
+
+        if shortfall > 0:
+            remainders = quotas - allocation
+            allocation[np.argsort(-remainders, kind='stable')[:shortfall]] += 1
+
+        selected = []
+
+        for bin_start, bin_count, bin_allocation in zip(bin_starts, bin_counts, allocation):
+            if bin_allocation == 0:
+                continue
+
+            choice = rng.choice(bin_count, bin_allocation, replace=False, shuffle=False)
+            selected.append(order[bin_start + choice])
+
+        indices = np.sort(np.concatenate(selected))
+
+        if valid_indices is not None:
+            indices = valid_indices[indices]
+
+        return indices
 
     @property
     def events_subsampled(self):
@@ -120,99 +485,175 @@ class Sample(object):
         subsample_indices can be set via a given random seed the generate_subsample() method.
         If generate_subsample() is not manually called prior to accessing subsample_events,
         then all events will be used (including negative scatter events).
+
+        The sub-sampled events are cached until the sub-sample changes. If the
+        sub-sample contains all events, the raw events are returned without
+        copying them.
         :return: NumPy array of sub-sampled events
         """
-        if self.subsample_indices is None:
+        if 'subsample' not in self._stage_params:
             self.generate_subsample(0, 1, filter_neg_scatter=False)
 
-        subsample = self.raw_events[self.subsample_indices]
+        if 'subsample' not in self._stage_events:
+            if self.subsample_indices.shape[0] == self.raw_events.shape[0]:
+                # sorted indices of all events, no need to copy
+                subsample = self.raw_events
+            else:
+                subsample = self.raw_events[self.subsample_indices]
+
+            self._stage_events['subsample'] = self._as_events_dtype(subsample)
+
+        return self._stage_events['subsample']
+
+    def get_metadata_compensation(self):
+        """
+        Returns the Compensation defined by the $SPILLOVER (or $SPILL) keyword
+        of the FCS metadata, or None if the FCS file has no spillover matrix.
+        The keyword is parsed on first use, raising a ValueError if it is
+        malformed.
+        """
+        if not self._metadata_compensation_parsed:
+            self._metadata_compensation = Compensation.from_metadata(self.metadata)
+            self._metadata_compensation_parsed = True
+
+        return self._metadata_compensation
+
+    def _get_compensation(self, compensation_matrix):
+        compensation = get_compensation(compensation_matrix)
+
+        if compensation is None:
+            compensation = self.get_metadata_compensation()
 
-        return subsample
+        if compensation is None:
+            compensation = Compensation.identity(self.channels)
+
+        return compensation
 
     def compensate_events(self, compensation_matrix):
         """
         Applies compensation matrix to the sub-sampled events
         
-        The compensation matrix must be a comma delimited text file with
-        a header row containing the corresponding PnN channel labels.
+        The compensation matrix can be a Compensation instance, or a tab
+        delimited text with a header row containing the corresponding PnN
+        channel labels (parsed once per text). If None, the spillover matrix
+        of the FCS metadata ($SPILLOVER or $SPILL) is used, or an identity
+        matrix if the FCS file has none.
+
+        Retrieve compensated events via `events_compensated` attribute. The
+        compensated events are computed on first access and cached, calling
+        this method with a different matrix invalidates the compensated and
+        transformed events.
+        """
+        compensation = self._get_compensation(compensation_matrix)
+
+        if self._stage_params.get('compensate') == compensation:
+            return
+
+        # resolve the channels now to report any label mismatch immediately
+        fluoro_indices = compensation.get_fluoro_indices(self.channels)
 
-        Retrieve compensated events via `events_compensated` attribute
+        self._compensation = compensation
+        self._fluoro_indices = fluoro_indices
+
+        self._set_stage_params('compensate', compensation)
+
+    @property
+    def events_compensated(self):
         """
-        # flowutils compensate() takes the plain matrix and indices as
-        # separate arguments
-        # (also note channel #'s vs indices)
+        Retrieve the compensated events, None if compensate_events has not
+        been called
+        """
+        if 'compensate' not in self._stage_params:
+            return None
 
-        # TODO: if this is called more than once, need to reset downstream transforms to None
+        if 'compensate' not in self._stage_events:
+            compensated = None
 
-        fluoro_indices = []
+            # all events are used if no sub-sample was generated (see
+            # events_subsampled), the sub-sample parameters key cached events
+            if 'subsample' not in self._stage_params:
+                self.generate_subsample(0, 1, filter_neg_scatter=False)
 
-        if compensation_matrix is not None:
-            # remove any white space at the beginning or end
-            compensation_matrix = compensation_matrix.strip()
+            if self._cache is not None:
+                # keyed by the parameters of the sub-sample & compensation
+                # stages, the channel count (for tracked indices) and the
+                # events dtype if a dtype policy is set
+                cache_params = (
+                    self.raw_events.shape[1],
+                    self._stage_params['subsample'],
+                    self._stage_params['compensate']
+                )
+                if self.events_dtype is not None:
+                    cache_params += (self.events_dtype.str,)
 
-            # split lines by \r or \n
-            compensation_matrix = compensation_matrix.splitlines()
+                cache_name = 'compensated_' + hash_text(repr(cache_params))
+                compensated = self._cache.load_array(self._cache_key, cache_name)
 
-            # split values by \t
-            compensation_matrix = [line.split('\t') for line in compensation_matrix]
+            if compensated is None:
+                events = self.events_subsampled
 
-            # convert header to channel indices
-            header = compensation_matrix[0]
-            compensation_matrix = compensation_matrix[1:]  # just the matrix
-            compensation_matrix = np.array(compensation_matrix, dtype=np.float)
+                with self.profiler.stage('compensate', None, events.shape[0]) as stage:
+                    compensated = self._compensation.apply(events, self._fluoro_indices)
+                    stage.events_out = compensated.shape[0]
 
-            channel_map = self.get_channel_numbers_by_channel_labels()
+                if self._cache is not None:
+                    self._cache.store_array(self._cache_key, cache_name, compensated)
 
-            try:
-                for label in header:
-                    fluoro_indices.append(channel_map[label] - 1)
-            except KeyError:
-                raise KeyError("Compensation matrix labels do not match FCS file!")
-        else:
-            # assume identity matrix
-            non_fluoro_channels = [
-                'FSC-A',
-                'FSC-H',
-                'FSC-W',
-                'SSC-A',
-                'SSC-H',
-                'SSC-W',
-                'Time',
-                'Index'
-            ]
-
-            for c, labels in self.channels.items():
-                if labels['PnN'] not in non_fluoro_channels:
-                    fluoro_indices.append(int(c) - 1)
-
-            fluoro_indices.sort()
-            compensation_matrix = np.identity(len(fluoro_indices))
-
-        comp_data = flowutils.compensate.compensate(
-            self.events_subsampled,
-            compensation_matrix,
-            fluoro_indices
-        )
+            self._stage_events['compensate'] = compensated
 
-        self._fluoro_indices = fluoro_indices
-        self.events_compensated = comp_data
+        return self._stage_events['compensate']
 
-    def transform_logicle(self, t=262144, w=0.5):
+    def iter_event_chunks(self, chunk_size):
         """
-        Apply a logicle transform to the **compensated** events.
+        Iterates over the raw events (all events, in order) in fixed-size
+        chunks. For memory mapped samples only one chunk is read into memory
+        at a time.
 
-        Retrieve transformed data via events_transformed
+        :param chunk_size: number of events per chunk
+        :return: generator of NumPy arrays of raw events, in the dtype of the
+                 dtype policy if set
         """
-        # TODO: check t default, need to calculate dynamically?
+        for start in range(0, self.raw_events.shape[0], chunk_size):
+            yield self._as_events_dtype(np.asarray(self.raw_events[start:start + chunk_size]))
 
-        x_data = flowutils.transforms.logicle(
-            self.events_compensated,
-            self._fluoro_indices,
-            t=t,
-            w=w
-        )
+    def iter_compensated_chunks(self, compensation_matrix, chunk_size):
+        """
+        Iterates over the compensated events (all events, in order) in
+        fixed-size chunks, without compensating the full event matrix.
+
+        :param compensation_matrix: compensation matrix (see
+            compensate_events), or None for the FCS metadata spillover matrix
+            or an identity matrix
+        :param chunk_size: number of events per chunk
+        :return: generator of NumPy arrays of compensated events
+        """
+        compensation = self._get_compensation(compensation_matrix)
+        fluoro_indices = compensation.get_fluoro_indices(self.channels)
+
+        for chunk in self.iter_event_chunks(chunk_size):
+            yield compensation.apply(chunk, fluoro_indices)
+
+    def _set_transform(self, params):
+        if 'compensate' not in self._stage_params:
+            raise ValueError("Events must be compensated (compensate_events) before transforming")
+
+        self._set_stage_params('transform', params)
+
+    def transform_logicle(self, t=262144, w=0.5, lookup=False):
+        """
+        Apply a logicle transform to the **compensated** events.
 
-        self.events_transformed = x_data
+        Retrieve transformed data via events_transformed, the transform is
+        computed on first access.
+
+        If lookup is True, the transform is computed with a cached lookup
+        table (see transforms.LogicleTransform) instead of solving the logicle
+        function for each event. The maximum error of the transformed values
+        is given by the max_error of the table (about 5e-7 for the default
+        parameters).
+        """
+        # TODO: check t default, need to calculate dynamically?
+        self._set_transform(('logicle', t, w, lookup))
 
     def transform_asinh(self, pre_scale=0.003):
         """
@@ -220,12 +661,53 @@ class Sample(object):
 
         The default pre-scale factor is 0.003
 
-        Retrieve transformed data via events_transformed
+        Retrieve transformed data via events_transformed, the transform is
+        computed on first access.
+
+        The transform is computed exactly with the vectorized
+        transforms.AsinhTransform.
         """
-        x_data = flowutils.transforms.asinh(
-            self.events_compensated,
-            self._fluoro_indices,
-            pre_scale=pre_scale
-        )
+        self._set_transform(('asinh', pre_scale))
 
-        self.events_transformed = x_data
+    @property
+    def events_transformed(self):
+        """
+        Retrieve the transformed events, None if no transform has been set
+        """
+        if 'transform' not in self._stage_params:
+            return None
+
+        if 'transform' not in self._stage_events:
+            params = self._stage_params['transform']
+
+            events = self.events_compensated
+            transform_dtype = self.events_dtype
+            if transform_dtype is None:
+                transform_dtype = np.dtype(np.float64)
+
+            with self.profiler.stage('transform', params[0], events.shape[0]) as stage:
+                if params[0] == 'logicle' and params[3]:
+                    x_data = transforms.get_logicle_transform(
+                        t=params[1],
+                        w=params[2]
+                    ).apply_channels(events, self._fluoro_indices, transform_dtype)
+                elif params[0] == 'logicle':
+                    import flowutils
+
+                    x_data = flowutils.transforms.logicle(
+                        events,
+                        self._fluoro_indices,
+                        t=params[1],
+                        w=params[2]
+                    )
+                else:
+                    x_data = transforms.get_asinh_transform(
+                        pre_scale=params[1]
+                    ).apply_channels(events, self._fluoro_indices, transform_dtype)
+
+                x_data = self._as_events_dtype(x_data)
+                stage.events_out = x_data.shape[0]
+
+            self._stage_events['transform'] = x_data
+
+        return self._stage_events['transform']
@@ -0,0 +1,97 @@
+from copy import deepcopy
+from flowpy.models import profiling
+
+
+class GatingSession(object):
+    """
+    Interactive gating of a single sample's events, keeping the results of
+    every population between gate edits
+
+    Editing the gates of a population only re-evaluates that population, its
+    descendants and the boolean populations referencing any of them (see
+    GatingPlan.reapply), so a single gate change doesn't re-gate the whole
+    hierarchy.
+    """
+    def __init__(self, plan, events, parent_mask=None, profiler=None, max_threads=1):
+        """
+        :param plan: GatingPlan of the gating hierarchy
+        :param events: NumPy array of the events to gate, with columns ordered
+                       by the channel labels of the plan (e.g. the compensated
+                       events of a Sample). The events must not be modified
+                       during the session.
+        :param parent_mask: optional boolean array selecting the rows of events
+                            to gate. If None, all events are used.
+        :param profiler: optional Profiler recording the 'gate' stages of the
+                         initial gating and of every edit
+        :param max_threads: number of threads evaluating populations
+                            concurrently (see GatingPlan.apply)
+        """
+        self.plan = plan
+        self.events = events
+        self.profiler = profiling.get_profiler(profiler)
+        self.max_threads = max_threads
+
+        self.result = plan.apply(
+            events,
+            parent_mask,
+            profiler=self.profiler,
+            max_threads=max_threads
+        )
+
+    def get_gates(self, path):
+        """
+        Returns a copy of the list of gate dictionaries of a population
+        """
+        return deepcopy(list(self.plan.get_node(path).gates))
+
+    def set_gates(self, path, gates):
+        """
+        Replaces the gates of a population and re-gates the populations
+        depending on it
+
+        :param path: population path (e.g. '/Lymphocytes/Singlets')
+        :param gates: list of gate dictionaries, in the format of the
+                      'populations' gates
+        :return: tuple of the re-evaluated population paths
+        """
+        plan = self.plan.with_gates(path, gates)
+
+        result = plan.reapply(
+            self.events,
+            self.result,
+            [path],
+            profiler=self.profiler,
+            max_threads=self.max_threads
+        )
+
+        # only replace the plan & result once the new gates were evaluated
+        self.plan = plan
+        self.result = result
+
+        return plan.get_dependent_paths([path])
+
+    def set_gate(self, path, gate_dict, index=0):
+        """
+        Replaces a single gate of a population, see set_gates
+
+        :param path: population path
+        :param gate_dict: gate dictionary replacing the gate
+        :param index: index of the replaced gate within the population's gates
+        :return: tuple of the re-evaluated population paths
+        """
+        gates = self.get_gates(path)
+        gates[index] = gate_dict
+
+        return self.set_gates(path, gates)
+
+    def get_mask(self, path):
+        return self.result.get_mask(path)
+
+    def get_count(self, path):
+        return self.result.get_count(path)
+
+    def to_populations(self):
+        return self.result.to_populations()
+
+    def to_dataframe(self):
+        return self.result.to_dataframe()
@@ -0,0 +1,160 @@
+import numpy as np
+
+# maximum number of values processed at once, for the blocks of events
+# & population masks multiplied together and for gathered quantile values
+STATISTICS_BLOCK_SIZE = 1 << 24
+
+
+def _population_sums(events, masks, channel_indices):
+    """
+    Sums the values, squared values (shifted by the mean of the first event
+    block, to limit cancellation in the variance), logs of positive values
+    and positive value counts of every population & channel, as matrix
+    products of the stacked population masks with blocks of events
+    """
+    population_count = len(masks)
+    channel_count = len(channel_indices)
+    event_count = events.shape[0]
+
+    sums = np.zeros((population_count, channel_count))
+    square_sums = np.zeros((population_count, channel_count))
+    log_sums = np.zeros((population_count, channel_count))
+    positive_counts = np.zeros((population_count, channel_count))
+
+    block_size = max(1, STATISTICS_BLOCK_SIZE // (population_count + channel_count))
+    mask_block = np.empty((population_count, min(block_size, event_count)))
+    shift = None
+
+    for start in range(0, event_count, block_size):
+        rows = slice(start, start + block_size)
+        values = np.asarray(events[rows][:, channel_indices], dtype=np.float64)
+        block_masks = mask_block[:, :values.shape[0]]
+
+        for i, mask in enumerate(masks):
+            block_masks[i] = mask[rows]
+
+        is_positive = values > 0
+        log_values = np.zeros(values.shape)
+        np.log(values, out=log_values, where=is_positive)
+
+        log_sums += block_masks.dot(log_values)
+        positive_counts += block_masks.dot(is_positive)
+
+        if shift is None:
+            shift = values.mean(axis=0)
+
+        values -= shift
+        sums += block_masks.dot(values)
+        values *= values
+        square_sums += block_masks.dot(values)
+
+    if shift is None:
+        shift = np.zeros(channel_count)
+
+    return shift, sums, square_sums, log_sums, positive_counts
+
+
+def _population_quantiles(events, mask, channel_indices, quantiles):
+    """
+    Computes quantiles of a single population, gathering the population's
+    events once per block of channels
+    """
+    indices = np.flatnonzero(mask)
+    channel_count = len(channel_indices)
+    population_quantiles = np.full((len(quantiles), channel_count), np.nan)
+
+    if indices.shape[0] == 0:
+        return population_quantiles
+
+    block_size = max(1, STATISTICS_BLOCK_SIZE // indices.shape[0])
+
+    for start in range(0, channel_count, block_size):
+        block = channel_indices[start:start + block_size]
+        values = events[np.ix_(indices, block)]
+
+        # the copy is no longer needed, so it can be partitioned in place
+        population_quantiles[:, start:start + len(block)] = np.quantile(
+            values,
+            quantiles,
+            axis=0,
+            overwrite_input=True
+        )
+
+    return population_quantiles
+
+
+def compute_population_statistics(
+        events,
+        masks,
+        channel_indices=None,
+        quantiles=(),
+        median=True
+):
+    """
+    Computes summary statistics of every channel for a set of populations
+
+    The counts, means, standard deviations & geometric means of all
+    populations are computed together as matrix products of the stacked
+    population masks with blocks of the events, so population events are
+    not copied. Only the median & quantiles need each population's events,
+    which are then gathered once per population.
+
+    :param events: NumPy array of events
+    :param masks: list of boolean event membership masks of the populations,
+                  aligned to the rows of events
+    :param channel_indices: optional list of the column indices of the
+                            channels, by default all columns
+    :param quantiles: sequence of additional quantiles (between 0 and 1)
+    :param median: if False, the median is not computed, so no population
+                   events are gathered unless quantiles are given
+    :return: dictionary of NumPy arrays: 'count' (per population), 'mean',
+             'median' (if computed), 'geometric_mean' & 'cv' (populations x
+             channels) and 'quantiles' (populations x quantiles x channels).
+             The geometric mean is computed over the positive values, the CV
+             is the standard deviation as a percentage of the mean.
+             Statistics of empty populations are NaN.
+    """
+    if channel_indices is None:
+        channel_indices = list(range(events.shape[1]))
+    else:
+        channel_indices = list(channel_indices)
+
+    counts = np.array([np.count_nonzero(mask) for mask in masks], dtype=np.int64)
+    shift, sums, square_sums, log_sums, positive_counts = _population_sums(
+        events,
+        masks,
+        channel_indices
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shifted_mean = sums / counts[:, np.newaxis]
+        variance = np.maximum(square_sums / counts[:, np.newaxis] - shifted_mean ** 2, 0.0)
+        mean = shifted_mean + shift
+        cv = 100.0 * np.sqrt(variance) / np.abs(mean)
+        geometric_mean = np.exp(log_sums / positive_counts)
+
+    # all quantiles of a population are computed from the same partition
+    all_quantiles = ([0.5] if median else []) + list(quantiles)
+
+    if len(all_quantiles) > 0:
+        population_quantiles = np.array([
+            _population_quantiles(events, mask, channel_indices, all_quantiles)
+            for mask in masks
+        ]).reshape(len(masks), len(all_quantiles), len(channel_indices))
+    else:
+        population_quantiles = np.empty((len(masks), 0, len(channel_indices)))
+
+    stats = {
+        'count': counts,
+        'mean': mean,
+        'geometric_mean': geometric_mean,
+        'cv': cv
+    }
+
+    if median:
+        stats['median'] = population_quantiles[:, 0, :]
+        stats['quantiles'] = population_quantiles[:, 1:, :]
+    else:
+        stats['quantiles'] = population_quantiles
+
+    return stats
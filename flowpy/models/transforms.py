@@ -0,0 +1,318 @@
+import math
+import numpy as np
+
+# default number of entries in a transform lookup table (4 MB of float64)
+LOOKUP_TABLE_SIZE = 1 << 19
+
+# number of values transformed per block, bounding the temporary arrays
+LOOKUP_CHUNK_SIZE = 65536
+
+
+def _apply_channels(transform, events, channel_indices, dtype):
+    """
+    Transform the given channels of an event matrix, the values of each
+    channel are transformed in float64 and stored in dtype
+    """
+    transformed = np.array(events, dtype=dtype)
+
+    for i in channel_indices:
+        transformed[:, i] = transform.apply(events[:, i])
+
+    return transformed
+
+
+class LogicleTransform(object):
+    """
+    The logicle transform (Parks et al. 2006) as parametrized in Gating-ML 2.0,
+    mapping data values to a scale where 1 is the top of scale t
+
+    The inverse (transformed to data values) has a closed form. The forward
+    transform is the root of the inverse, computed by bisection for exact
+    values (apply_exact). A table of exact transform values on a uniform grid
+    of data values is built once, and apply transforms values within the grid
+    by linear interpolation between the 2 nearest table entries (values
+    outside the grid are transformed exactly).
+
+    The maximum interpolation error is h^2 / 8 * max|f''| for a grid spacing
+    h, available as the max_error attribute (computed from the second
+    derivative sampled densely over the grid).
+    """
+    def __init__(self, t=262144, w=0.5, m=4.5, a=0, table_size=LOOKUP_TABLE_SIZE):
+        """
+        :param t: top of scale data value
+        :param w: number of decades in the approximately linear region
+        :param m: number of decades of the full scale
+        :param a: number of additional negative decades
+        :param table_size: number of lookup table entries, covering the data
+                           values from -t to t
+        """
+        if t <= 0 or m <= 0:
+            raise ValueError("Logicle t and m must be positive")
+        if w < 0 or w > m / 2.0:
+            raise ValueError("Logicle w must be between 0 and m / 2")
+        if -a > w or a + w > m - w:
+            raise ValueError("Logicle a is out of range")
+
+        self.t = float(t)
+        self.w = float(w)
+        self.m = float(m)
+        self.a = float(a)
+
+        # scale parameters, see Moore & Parks 2012
+        w_scaled = self.w / (self.m + self.a)
+        self._x2 = self.a / (self.m + self.a)
+        self._x1 = self._x2 + w_scaled
+        self._x0 = self._x2 + 2 * w_scaled
+        self._b = (self.m + self.a) * math.log(10)
+        self._d = self._solve_d(self._b, w_scaled)
+
+        c_a = math.exp(self._x0 * (self._b + self._d))
+        mf_a = math.exp(self._b * self._x1) - c_a / math.exp(self._d * self._x1)
+
+        self._a = self.t / ((math.exp(self._b) - mf_a) - c_a / math.exp(self._d))
+        self._c = c_a * self._a
+        self._f = -mf_a * self._a
+
+        self._build_table(-self.t, self.t, table_size)
+
+    def _build_table(self, x_min, x_max, table_size):
+        self.x_min = float(x_min)
+        self.x_max = float(x_max)
+        self.step = (self.x_max - self.x_min) / (table_size - 1)
+
+        x_grid = np.linspace(self.x_min, self.x_max, table_size)
+        self.table = self.apply_exact(x_grid)
+        self.table.flags.writeable = False
+
+        self.max_error = self.step ** 2 / 8.0 * self._max_second_derivative()
+
+    @staticmethod
+    def _solve_d(b, w):
+        # root of 2 * (ln(d) - ln(b)) + w * (b + d) = 0 in (0, b], by bisection
+        if w == 0:
+            return b
+
+        low, high = 0.0, b
+        for _ in range(200):
+            mid = (low + high) / 2.0
+
+            if 2 * (math.log(mid) - math.log(b)) + w * (b + mid) > 0:
+                high = mid
+            else:
+                low = mid
+
+        return (low + high) / 2.0
+
+    def _biexponential(self, y):
+        # data value of transformed values y >= x1
+        return self._a * np.exp(self._b * y) - self._c * np.exp(-self._d * y) + self._f
+
+    def inverse(self, y):
+        """
+        Map transformed values back to data values (exact)
+
+        :param y: transformed value or NumPy array of transformed values
+        :return: data values (float64)
+        """
+        y = np.asarray(y, dtype=np.float64)
+
+        # the function is antisymmetric about x1 (data value 0)
+        reflected = y < self._x1
+        x = self._biexponential(np.where(reflected, 2 * self._x1 - y, y))
+
+        return np.where(reflected, -x, x)
+
+    def apply_exact(self, x):
+        """
+        Transform data values exactly (by bisection of the inverse)
+
+        :param x: NumPy array of data values
+        :return: NumPy array (float64) of transformed values
+        """
+        x = np.asarray(x, dtype=np.float64)
+        magnitude = np.abs(x)
+
+        # solve for the transformed value of |x|, which is >= x1
+        low = np.full(x.shape, self._x1)
+        high = np.full(x.shape, 1.0)
+
+        # grow the bracket for data values above the top of scale
+        too_low = self._biexponential(high) < magnitude
+        while np.any(too_low):
+            high[too_low] += high[too_low] - self._x1
+            too_low = self._biexponential(high) < magnitude
+
+        for _ in range(64):
+            mid = (low + high) / 2.0
+            is_above = self._biexponential(mid) > magnitude
+            high = np.where(is_above, mid, high)
+            low = np.where(is_above, low, mid)
+
+        y = (low + high) / 2.0
+
+        return np.where(x < 0, 2 * self._x1 - y, y)
+
+    def apply(self, x):
+        """
+        Transform data values using the lookup table
+
+        :param x: NumPy array of data values
+        :return: NumPy array (float64) of transformed values, same shape as x
+        """
+        x = np.asarray(x)
+        flat_x = x.reshape(-1)
+        y = np.empty(flat_x.shape[0], dtype=np.float64)
+        last_index = self.table.shape[0] - 1
+
+        for start in range(0, flat_x.shape[0], LOOKUP_CHUNK_SIZE):
+            chunk = np.asarray(flat_x[start:start + LOOKUP_CHUNK_SIZE], dtype=np.float64)
+
+            position = (chunk - self.x_min) / self.step
+            index = np.floor(position)
+            in_table = (index >= 0) & (index < last_index)
+
+            # interpolate between the table entries surrounding each value
+            index = np.where(in_table, index, 0).astype(np.intp)
+            fraction = position - index
+            lower = self.table[index]
+            y_chunk = lower + fraction * (self.table[index + 1] - lower)
+
+            outside = np.flatnonzero(~in_table)
+            if outside.shape[0] > 0:
+                y_chunk[outside] = self.apply_exact(chunk[outside])
+
+            y[start:start + chunk.shape[0]] = y_chunk
+
+        return y.reshape(x.shape)
+
+    def apply_channels(self, events, channel_indices, dtype=np.float64):
+        """
+        Transform the given channels of an event matrix using the lookup table
+
+        :param events: NumPy array of events
+        :param channel_indices: list of column indices to transform, other
+                                columns are copied unchanged
+        :param dtype: float dtype of the transformed events, values are
+                      transformed in float64 and stored in this dtype
+        :return: transformed copy of events
+        """
+        return _apply_channels(self, events, channel_indices, dtype)
+
+    def _max_second_derivative(self):
+        # y''(x) = -B''(y) / B'(y)^3 for the inverse B, sampled over the table
+        y = self.apply_exact(np.array([self.x_min, self.x_max]))
+        y = np.linspace(y[0], y[1], 1 << 16)
+        z = np.where(y < self._x1, 2 * self._x1 - y, y)
+
+        first = self._a * self._b * np.exp(self._b * z) + self._c * self._d * np.exp(-self._d * z)
+        second = self._a * self._b ** 2 * np.exp(self._b * z) - \
+            self._c * self._d ** 2 * np.exp(-self._d * z)
+
+        return float(np.max(np.abs(second) / first ** 3))
+
+
+class AsinhTransform(object):
+    """
+    The inverse hyperbolic sine transform, arcsinh(x * pre_scale), as used by
+    Sample.transform_asinh
+
+    NumPy's vectorized arcsinh is faster than interpolating a lookup table,
+    so values are always transformed exactly (max_error is 0). The class has
+    the same interface as LogicleTransform.
+    """
+    max_error = 0.0
+
+    def __init__(self, pre_scale=0.003):
+        """
+        :param pre_scale: data values are multiplied by pre_scale before the
+                          transform
+        """
+        if pre_scale <= 0:
+            raise ValueError("Asinh pre_scale must be positive")
+
+        self.pre_scale = float(pre_scale)
+
+    def apply_exact(self, x):
+        """
+        Transform data values
+
+        :param x: NumPy array of data values
+        :return: NumPy array (float64) of transformed values
+        """
+        return np.arcsinh(np.asarray(x, dtype=np.float64) * self.pre_scale)
+
+    apply = apply_exact
+
+    def inverse(self, y):
+        """
+        Map transformed values back to data values (exact)
+        """
+        return np.sinh(np.asarray(y, dtype=np.float64)) / self.pre_scale
+
+    def apply_channels(self, events, channel_indices, dtype=np.float64):
+        """
+        Transform the given channels of an event matrix
+
+        :param events: NumPy array of events
+        :param channel_indices: list of column indices to transform, other
+                                columns are copied unchanged
+        :param dtype: float dtype of the transformed events, values are
+                      transformed in float64 and stored in this dtype
+        :return: transformed copy of events
+        """
+        return _apply_channels(self, events, channel_indices, dtype)
+
+
+# lookup transforms by parameters, tables are built once per parameter set
+_transform_cache = {}
+
+
+def get_logicle_transform(t=262144, w=0.5, m=4.5, a=0, table_size=LOOKUP_TABLE_SIZE):
+    """
+    Returns the cached LogicleTransform for a parameter set, building it on
+    first use
+    """
+    key = ('logicle', float(t), float(w), float(m), float(a), table_size)
+
+    if key not in _transform_cache:
+        _transform_cache[key] = LogicleTransform(t, w, m, a, table_size)
+
+    return _transform_cache[key]
+
+
+def get_asinh_transform(pre_scale=0.003):
+    """
+    Returns the cached AsinhTransform for a pre-scale factor
+    """
+    key = ('asinh', float(pre_scale))
+
+    if key not in _transform_cache:
+        _transform_cache[key] = AsinhTransform(pre_scale)
+
+    return _transform_cache[key]
+
+
+def transform_vertices(vertices, x_transform=None, y_transform=None, inverse=False):
+    """
+    Map gate vertices between data and transformed scales
+
+    :param vertices: NumPy array of vertices with shape (n, 2)
+    :param x_transform: transform of the x axis, or None to leave x unchanged
+    :param y_transform: transform of the y axis, or None to leave y unchanged
+    :param inverse: if True, vertices are mapped from the transformed scale
+                    to data values, otherwise from data values to the
+                    transformed scale (exactly in both cases)
+    :return: NumPy array (float64) of mapped vertices
+    """
+    vertices = np.array(vertices, dtype=np.float64)
+
+    for axis, transform in enumerate((x_transform, y_transform)):
+        if transform is None:
+            continue
+
+        if inverse:
+            vertices[:, axis] = transform.inverse(vertices[:, axis])
+        else:
+            vertices[:, axis] = transform.apply_exact(vertices[:, axis])
+
+    return vertices
@@ -1,14 +1,199 @@
 from xml.etree import cElementTree
 import os
-from flowpy import Sample
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from flowpy.models.sample import Sample
 from flowpy.models import gate
-from copy import deepcopy
+from flowpy.models import profiling
+from flowpy.models.compensation import Compensation, get_compensation
+from flowpy.models.gating_plan import GatingPlan, GatingSummary
+from flowpy.models.session import GatingSession
+
+# workspace instance used by process pool workers, set once per worker
+_worker_workspace = None
+
+
+def _local_name(name):
+    # strip any XML namespace, e.g. Gating-ML's '{...gating}min' to 'min'
+    return name.rsplit('}', 1)[-1]
+
+
+def _get_attribute(element, name):
+    for key, value in element.attrib.items():
+        if _local_name(key) == name:
+            return value
+
+    return None
+
+
+def _find_children(element, name):
+    return [child for child in element if _local_name(child.tag) == name]
+
+
+def _get_dimension_label(element):
+    # channel label of the first fcs-dimension element within element
+    for child in element.iter():
+        if _local_name(child.tag) == 'fcs-dimension':
+            return _get_attribute(child, 'name')
+
+    return None
+
+
+def _parse_float(value):
+    if value is None:
+        return None
+
+    return float(value)
+
+
+def parse_rectangle_element(gate_element):
+    """
+    Parses a Gating-ML style rectangle gate, a range on each 'dimension' with
+    optional 'min' and 'max' attributes. A gate with a single dimension is a
+    1-D range gate.
+    """
+    dimensions = []
+
+    for dimension_el in _find_children(gate_element, 'dimension'):
+        dimensions.append({
+            'label': _get_dimension_label(dimension_el),
+            'min': _parse_float(_get_attribute(dimension_el, 'min')),
+            'max': _parse_float(_get_attribute(dimension_el, 'max'))
+        })
+
+    return {
+        'type': 'Rectangle',
+        'dimensions': dimensions
+    }
+
+
+def parse_ellipsoid_element(gate_element):
+    """
+    Parses a Gating-ML style ellipsoid gate, with the 'dimension' channels,
+    the 'mean' coordinates, the 'covarianceMatrix' rows and the
+    'distanceSquare' of the boundary
+    """
+    dimensions = [
+        _get_dimension_label(d) for d in _find_children(gate_element, 'dimension')
+    ]
+
+    mean = []
+    for mean_el in _find_children(gate_element, 'mean'):
+        for coordinate_el in _find_children(mean_el, 'coordinate'):
+            mean.append(float(_get_attribute(coordinate_el, 'value')))
+
+    covariance = []
+    for matrix_el in _find_children(gate_element, 'covarianceMatrix'):
+        for row_el in _find_children(matrix_el, 'row'):
+            covariance.append(
+                [float(_get_attribute(e, 'value')) for e in _find_children(row_el, 'entry')]
+            )
+
+    distance_square_el = _find_children(gate_element, 'distanceSquare')[0]
+
+    return {
+        'type': 'Ellipsoid',
+        'dimensions': dimensions,
+        'mean': mean,
+        'covariance': covariance,
+        'distance_square': float(_get_attribute(distance_square_el, 'value'))
+    }
+
+
+def parse_quad_element(gate_element):
+    """
+    Parses a Gating-ML style quadrant gate, with the 'divider' elements (each
+    splitting a channel at one or more values) and the 'Quadrant' elements
+    (each locating a quadrant with a 'position' on dividers). A gate with
+    multiple quadrants includes the events of all of them.
+    """
+    dividers = []
+
+    for divider_el in _find_children(gate_element, 'divider'):
+        dividers.append({
+            'id': _get_attribute(divider_el, 'id'),
+            'label': _get_dimension_label(divider_el),
+            'values': [float(v.text) for v in _find_children(divider_el, 'value')]
+        })
+
+    quadrants = []
+
+    for quadrant_el in _find_children(gate_element, 'Quadrant'):
+        locations = {}
+
+        for position_el in _find_children(quadrant_el, 'position'):
+            locations[_get_attribute(position_el, 'divider_ref')] = float(
+                _get_attribute(position_el, 'location')
+            )
+
+        quadrants.append({
+            'id': _get_attribute(quadrant_el, 'id'),
+            'locations': locations
+        })
+
+    return {
+        'type': 'Quad',
+        'dividers': dividers,
+        'quadrants': quadrants
+    }
+
+
+def parse_polygon_element(gate_element):
+    """
+    Parses a Gating-ML style polygon gate (as used by FlowJo 10), with the
+    2 'dimension' channels and a 'vertex' element per vertex containing a
+    'coordinate' per dimension
+    """
+    dimensions = [
+        _get_dimension_label(d) for d in _find_children(gate_element, 'dimension')
+    ]
+
+    vertices = []
+    for vertex_el in _find_children(gate_element, 'vertex'):
+        coordinates = [
+            _get_attribute(c, 'value') for c in _find_children(vertex_el, 'coordinate')
+        ]
+        vertices.append({'x': coordinates[0], 'y': coordinates[1]})
+
+    return {
+        'type': 'Polygon',
+        'parameters': dimensions,
+        'x_axis': dimensions[0],
+        'y_axis': dimensions[1],
+        'vertices': vertices,
+        'rectangle': False
+    }
 
 
 def parse_gate_element(gate_element):
-    gate_type, _ = gate_element.tag.split('Gate')
+    """
+    Parses a gate element to a gate dictionary. FlowJo 10 wraps each gate in
+    a 'Gate' element, which is unwrapped. Unsupported gate elements are
+    parsed to a dictionary with a None 'type' and the 'element' name, so the
+    workspace still loads but gating the population raises a ValueError.
+    """
+    element_name = _local_name(gate_element.tag)
 
-    if gate_type == 'Polygon':
+    if element_name == 'Gate':
+        gate_children = [
+            child for child in gate_element if _local_name(child.tag).endswith('Gate')
+        ]
+
+        if len(gate_children) != 1:
+            return {'type': None, 'element': element_name}
+
+        return parse_gate_element(gate_children[0])
+
+    gate_type = element_name[:-len('Gate')] if element_name.endswith('Gate') else None
+
+    if gate_type == 'Polygon' and gate_element.find('ParameterNames') is None:
+        if len(_find_children(gate_element, 'vertex')) > 0:
+            return parse_polygon_element(gate_element)
+
+        return {'type': None, 'element': element_name}
+    elif gate_type == 'Polygon':
         params = []
 
         params_el = gate_element.find('ParameterNames').find('StringArray').findall('String')
@@ -23,7 +208,7 @@ def parse_gate_element(gate_element):
         elif len(gate_element.findall('PolyRect')) > 0:
             poly_el = gate_element.find('PolyRect')
         else:
-            return {}
+            return {'type': None, 'element': element_name}
 
         x_axis = poly_el.attrib['xAxisName']
         y_axis = poly_el.attrib['yAxisName']
@@ -39,7 +224,8 @@ def parse_gate_element(gate_element):
             'parameters': params,
             'x_axis': x_axis,
             'y_axis': y_axis,
-            'vertices': vertices
+            'vertices': vertices,
+            'rectangle': poly_el.tag == 'PolyRect'
         }
     elif gate_type == 'Boolean':
         groups = []
@@ -54,12 +240,66 @@ def parse_gate_element(gate_element):
             'specification': gate_element.attrib['specification'],
             'groups': groups
         }
+    elif gate_type == 'Rectangle':
+        gate_dict = parse_rectangle_element(gate_element)
+    elif gate_type == 'Ellipsoid':
+        gate_dict = parse_ellipsoid_element(gate_element)
+    elif gate_type in ('Quad', 'Quadrant'):
+        gate_dict = parse_quad_element(gate_element)
     else:
-        gate_dict = {}
+        gate_dict = {'type': None, 'element': element_name}
 
     return gate_dict
 
 
+# compensation matrix elements: FlowJo's CompensationMatrix & Gating-ML's
+# spilloverMatrix (as used by FlowJo 10)
+COMPENSATION_MATRIX_TAGS = ('CompensationMatrix', 'spilloverMatrix')
+
+
+def parse_compensation_matrix_element(matrix_element):
+    """
+    Parses a compensation matrix element to a Compensation
+
+    FlowJo CompensationMatrix elements contain a Channel element per row with
+    ChannelValue elements (name & value) per column, Gating-ML spilloverMatrix
+    elements contain a spillover element per row with coefficient elements
+    (parameter & value) per column.
+
+    :return: tuple of the matrix name and the Compensation
+    """
+    if _local_name(matrix_element.tag) == 'CompensationMatrix':
+        row_tag, column_tag, label_attribute = 'Channel', 'ChannelValue', 'name'
+    else:
+        row_tag, column_tag, label_attribute = 'spillover', 'coefficient', 'parameter'
+
+    labels = []
+    rows = []
+
+    for row_element in _find_children(matrix_element, row_tag):
+        labels.append(_get_attribute(row_element, label_attribute))
+        rows.append(
+            dict(
+                (
+                    _get_attribute(value_element, label_attribute),
+                    float(_get_attribute(value_element, 'value'))
+                )
+                for value_element in _find_children(row_element, column_tag)
+            )
+        )
+
+    try:
+        spillover = [[row[label] for label in labels] for row in rows]
+    except KeyError:
+        raise ValueError("Compensation matrix rows & columns don't match")
+
+    name = _get_attribute(matrix_element, 'name')
+    if name is None:
+        name = _get_attribute(matrix_element, 'id')
+
+    return name, Compensation(spillover, labels)
+
+
 def find_group_samples(group_element):
     group_samples = group_element.iter('SampleRef')
 
@@ -71,6 +311,34 @@ def find_group_samples(group_element):
     return samples
 
 
+def _init_worker(workspace):
+    global _worker_workspace
+    _worker_workspace = workspace
+
+
+def _analyze_sample_report(workspace, fcs_file_path, comp_matrix, gate_type, gate_id):
+    """
+    Analyze a single sample, returning a tuple of the FCS file path, the report
+    DataFrame (or None on failure) and the error message (or None on success)
+    """
+    try:
+        results = workspace.analyze_sample(fcs_file_path, comp_matrix, gate_type, gate_id)
+    except Exception as e:
+        return fcs_file_path, None, "%s: %s" % (type(e).__name__, e)
+
+    return fcs_file_path, results['report'], None
+
+
+def _analyze_sample_worker(fcs_file_path, comp_matrix, gate_type, gate_id):
+    return _analyze_sample_report(
+        _worker_workspace,
+        fcs_file_path,
+        comp_matrix,
+        gate_type,
+        gate_id
+    )
+
+
 def find_nested_populations(element):
     populations = element.findall('Population')
 
@@ -97,60 +365,140 @@ class Workspace(object):
     """
     Parses an FlowJo XML workspace file to extract gating information
     """
-    def __init__(self, xml_workspace):
+    def __init__(self, xml_workspace, sample_ids=None, group_ids=None, sample_cache=None):
         """
-        
+        The workspace XML is parsed incrementally, discarding each element once
+        it has been processed, so memory use doesn't grow with the size of
+        the workspace file.
+
         :param xml_workspace: FlowJo XML workspace file
+        :param sample_ids: optional list of sample IDs for which to load the
+                           gating hierarchies, if None all are loaded
+        :param group_ids: optional list of group IDs for which to load the
+                          gating hierarchies, if None all are loaded
+        :param sample_cache: optional SampleCache used when analyzing samples,
+                             so a repeated analysis of the same FCS file
+                             loads the parsed & compensated events from disk
         """
-
-        with open(xml_workspace, 'r') as in_file:
-            tree = cElementTree.parse(in_file)
-
-        # first parse out the samples
-        samples = tree.iter('Sample')
+        if sample_ids is not None:
+            sample_ids = set(str(s_id) for s_id in sample_ids)
+        if group_ids is not None:
+            group_ids = set(str(g_id) for g_id in group_ids)
 
         sample_dict = {}
+        group_dict = {}
 
-        for s in samples:
-            sample_node = s.find('SampleNode')
-            filename = sample_node.attrib['nodeName']
+        # lookup indexes, the filename index covers all samples in the
+        # workspace while the group index only covers the loaded groups
+        self._sample_ids_by_filename = {}
+        self._group_ids_by_sample_id = {}
 
-            if filename == "":
-                continue
+        # workspace level compensation matrices by name
+        compensations = {}
 
-            # a sample may have it's own individual gating hierarchy independent of
-            # a sample group, we'll search for them here
-            sample_populations = find_nested_populations(sample_node)
+        # open elements, and the number of open Sample, GroupNode or
+        # compensation matrix elements being collected
+        element_stack = []
+        collecting = 0
 
-            sample_dict[s.attrib['sampleID']] = {
-                'filename': sample_node.attrib['nodeName'],
-                'eventCount': s.attrib['eventCount'],
-                'populations': sample_populations
-            }
+        with open(xml_workspace, 'rb') as in_file:
+            for event, element in cElementTree.iterparse(in_file, events=('start', 'end')):
+                if event == 'start':
+                    element_stack.append(element)
 
-        # next, parse the sample groups
-        groups = tree.iter('GroupNode')
+                    if element.tag in ('Sample', 'GroupNode'):
+                        collecting += 1
+                    elif _local_name(element.tag) in COMPENSATION_MATRIX_TAGS:
+                        collecting += 1
 
-        group_dict = {}
+                    continue
 
-        for g in groups:
-            pops = find_nested_populations(g)
+                element_stack.pop()
 
-            # don't store groups with no gates
-            if len(pops) <= 0:
-                continue
+                if element.tag == 'Sample':
+                    collecting -= 1
+                    self._parse_sample_element(element, sample_ids, sample_dict)
+                elif element.tag == 'GroupNode':
+                    collecting -= 1
+                    self._parse_group_element(element, group_ids, group_dict)
+                elif _local_name(element.tag) in COMPENSATION_MATRIX_TAGS:
+                    collecting -= 1
 
-            group_samples = find_group_samples(g)
+                    # sample level matrices are parsed with their sample
+                    if not any(e.tag == 'Sample' for e in element_stack):
+                        name, compensation = parse_compensation_matrix_element(element)
+                        compensations[name] = compensation
 
-            group_dict[g.attrib['groupID']] = {
-                'group_name': g.attrib['nodeName'],
-                'samples': group_samples,
-                'populations': pops
-            }
+                # discard processed elements unless they are part of a sample
+                # or group still being collected
+                if collecting == 0 and len(element_stack) > 0:
+                    element.clear()
+                    element_stack[-1].remove(element)
 
-        # TODO: add comp attribute for lookup
         self.samples = sample_dict
         self.groups = group_dict
+        self.compensations = compensations
+
+        # compiled gating plans, keyed by gate type, gate ID & channel labels
+        self._gating_plans = {}
+
+        self.sample_cache = sample_cache
+
+    def _parse_sample_element(self, sample_element, sample_ids, sample_dict):
+        sample_node = sample_element.find('SampleNode')
+        filename = sample_node.attrib['nodeName']
+
+        if filename == "":
+            return
+
+        sample_id = sample_element.attrib['sampleID']
+        self._sample_ids_by_filename.setdefault(filename, []).append(sample_id)
+
+        if sample_ids is not None and sample_id not in sample_ids:
+            return
+
+        # a sample may have it's own individual gating hierarchy independent of
+        # a sample group, we'll search for them here
+        sample_populations = find_nested_populations(sample_node)
+
+        # FlowJo 10 stores the sample's compensation in the Sample element
+        compensation = None
+        for child in sample_element:
+            if _local_name(child.tag) in COMPENSATION_MATRIX_TAGS:
+                _, compensation = parse_compensation_matrix_element(child)
+
+        sample_dict[sample_id] = {
+            'filename': filename,
+            'eventCount': sample_element.attrib['eventCount'],
+            'populations': sample_populations,
+            'compensation': compensation
+        }
+
+    def _parse_group_element(self, group_element, group_ids, group_dict):
+        group_id = group_element.attrib['groupID']
+
+        if group_ids is not None and group_id not in group_ids:
+            return
+
+        pops = find_nested_populations(group_element)
+
+        # don't store groups with no gates
+        if len(pops) <= 0:
+            return
+
+        group_samples = find_group_samples(group_element)
+
+        group_dict[group_id] = {
+            'group_name': group_element.attrib['nodeName'],
+            'samples': group_samples,
+            'populations': pops
+        }
+
+        for sample_id in group_samples:
+            sample_groups = self._group_ids_by_sample_id.setdefault(sample_id, [])
+
+            if group_id not in sample_groups:
+                sample_groups.append(group_id)
 
     def get_gate_hierarchies(self):
         gate_dict = {
@@ -173,57 +521,708 @@ class Workspace(object):
 
     def find_matching_gate_hierarchies(self, fcs_file_path):
         base_name = os.path.basename(fcs_file_path)
-        chosen_sample = None
 
-        for sample_id, ws_sample in self.samples.items():
-            if base_name == ws_sample['filename']:
-                chosen_sample = sample_id
-                break
-
-        if chosen_sample is None:
-            UserWarning("%s was not found in workspace" % base_name)
+        if base_name not in self._sample_ids_by_filename:
+            warnings.warn("%s was not found in workspace" % base_name)
             return None
 
+        chosen_sample = self._sample_ids_by_filename[base_name][0]
+
         matching_gates = {
             'sample_id': chosen_sample,
-            'groups': []
+            'groups': list(self._group_ids_by_sample_id.get(chosen_sample, []))
         }
 
-        # find groups to which the sample belongs
-        for group_id, ws_group in self.groups.items():
-            if chosen_sample in ws_group['samples']:
-                matching_gates['groups'].append(group_id)
-
         return matching_gates
 
-    def analyze_sample(self, fcs_file_path, comp_matrix, gate_type, gate_id):
-        base_name = os.path.basename(fcs_file_path)
+    def get_gating_plan(self, gate_type, gate_id, channel_labels):
+        """
+        Returns the compiled GatingPlan of a gating hierarchy for the given
+        channel labels. Plans are compiled once and reused for all samples
+        with the same channel labels.
 
-        s = Sample(fcs_file_path, track_indices=True)
-        s.generate_subsample(0, random_seed=123)
-        s.compensate_events(comp_matrix)
-        
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param channel_labels: dictionary of channel labels (keys are channel #'s)
+        :return: GatingPlan
+        """
         # check gate type, options are 'sample' or 'group'
         if gate_type == 'sample':
-            chosen_gate = deepcopy(self.samples[str(gate_id)])
+            chosen_gate = self.samples[str(gate_id)]
         elif gate_type == 'group':
-            chosen_gate = deepcopy(self.groups[str(gate_id)])
+            chosen_gate = self.groups[str(gate_id)]
         else:
             raise ValueError("Gate type %s is not valid, use 'sample' or 'group'" % gate_type)
 
+        plan_key = (
+            gate_type,
+            str(gate_id),
+            tuple(sorted((c, labels['PnN']) for c, labels in channel_labels.items()))
+        )
+
+        if plan_key not in self._gating_plans:
+            self._gating_plans[plan_key] = GatingPlan(
+                chosen_gate['populations'],
+                channel_labels
+            )
+
+        return self._gating_plans[plan_key]
+
+    def analyze_sample(
+            self,
+            fcs_file_path,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            include_events=False,
+            profiler=None,
+            membership=False,
+            max_threads=1,
+            statistics=None,
+            quantiles=(),
+            histogram_bins=None,
+            dtype=None
+    ):
+        """
+        Applies a gating hierarchy to the given FCS file
+
+        :param fcs_file_path: path to FCS file
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param include_events: if True, the 'gated_events' array is included in
+                               each gate result. By default only the event
+                               membership mask and counts are stored.
+        :param profiler: optional Profiler recording the time, event counts and
+                         memory of each stage of the analysis: 'load',
+                         'subsample', 'compensate', 'gating' (with a 'gate'
+                         stage for each population) and 'report'
+        :param membership: if True, the results include the bit-packed event
+                           membership of all populations as a MembershipMatrix
+                           ('membership'), aligned to the sample's raw events
+        :param max_threads: number of threads evaluating independent gates
+                            concurrently (see GatingPlan.apply), the results
+                            are identical for any number of threads
+        :param statistics: if 'raw', 'compensated' or 'transformed', the
+                           results include a DataFrame of the summary
+                           statistics of every population & channel on the
+                           given events ('statistics', see
+                           GatingResult.statistics_to_dataframe). Transformed
+                           events use a logicle transform with the default
+                           parameters.
+        :param quantiles: additional quantiles included in the statistics
+        :param histogram_bins: if given, the gate results of polygon gates
+                               include a 'histogram' of the parent & gated
+                               events on the gate axes, with histogram_bins x
+                               histogram_bins bins spanning 0 to the channel's
+                               PnR range (see GatingResult.get_histograms)
+        :param dtype: dtype policy of the sub-sampled, compensated & transformed
+                      events (None, 'auto', 'float32' or 'float64', see
+                      Sample). Use validate_precision to check the effect of
+                      float32 events on the population counts.
+        :return: dictionary of results
+        """
+        base_name = os.path.basename(fcs_file_path)
+        profiler = profiling.get_profiler(profiler)
+
+        with profiler.stage('analyze_sample', base_name):
+            s = Sample(fcs_file_path, cache=self.sample_cache, profiler=profiler, dtype=dtype)
+
+            results_dict = self._analyze_sample(
+                s,
+                comp_matrix,
+                gate_type,
+                gate_id,
+                include_events,
+                profiler,
+                membership,
+                max_threads,
+                statistics,
+                quantiles,
+                histogram_bins
+            )
+
+        return results_dict
+
+    def _analyze_sample(
+            self,
+            s,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            include_events=False,
+            profiler=profiling.NULL_PROFILER,
+            membership=False,
+            max_threads=1,
+            statistics=None,
+            quantiles=(),
+            histogram_bins=None
+    ):
+        """
+        Applies a gating hierarchy to a loaded Sample, see analyze_sample
+        """
+        s.generate_subsample(0, random_seed=123)
+        s.compensate_events(comp_matrix)
+        
+        plan = self.get_gating_plan(gate_type, gate_id, s.channels)
+
         results_dict = {
-            'filename': base_name
+            'filename': s.filename
         }
 
         # looks like the FlowJo XML gates are saved
         # on compensated but not transformed data
-        gate.apply_gating_hierarchy(
+        events = s.events_compensated
+
+        histogram_ranges = None
+        if histogram_bins is not None:
+            histogram_ranges = s.get_channel_ranges()
+
+        with profiler.stage('gating', None, events.shape[0]):
+            result = plan.apply(
+                events,
+                profiler=profiler,
+                max_threads=max_threads,
+                histogram_bins=histogram_bins,
+                histogram_ranges=histogram_ranges
+            )
+
+        with profiler.stage('report'):
+            populations = result.to_populations()
+
+            if include_events:
+                for node in plan.nodes:
+                    population = gate.find_population(populations, node.path)
+
+                    for gate_dict in population['gates']:
+                        gate_dict['result']['gated_events'] = gate.get_gated_events(
+                            events,
+                            gate_dict
+                        )
+
+            results_dict['populations'] = populations
+            results_dict['gating_result'] = result
+            results_dict['report'] = gate.results_to_dataframe(results_dict)
+
+        if membership:
+            with profiler.stage('membership', None, events.shape[0]):
+                results_dict['membership'] = result.to_membership_matrix(
+                    row_indices=s.subsample_indices,
+                    event_count=s.event_count
+                )
+
+        if statistics is not None:
+            if statistics == 'raw':
+                statistics_events = s.events_subsampled
+            elif statistics == 'compensated':
+                statistics_events = events
+            elif statistics == 'transformed':
+                if s.events_transformed is None:
+                    s.transform_logicle(lookup=True)
+
+                statistics_events = s.events_transformed
+            else:
+                raise ValueError(
+                    "Statistics events %s are not valid, use 'raw', 'compensated' or 'transformed'" %
+                    statistics
+                )
+
+            with profiler.stage('statistics', statistics, events.shape[0]):
+                results_dict['statistics'] = result.statistics_to_dataframe(
+                    statistics_events,
+                    quantiles
+                )
+
+        return results_dict
+
+    def create_session(
+            self,
+            fcs_file_path,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            profiler=None,
+            max_threads=1,
+            dtype=None
+    ):
+        """
+        Loads and gates an FCS file for interactive gate editing, gate edits
+        only re-evaluate the affected populations (see GatingSession)
+
+        :param fcs_file_path: path to FCS file
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param profiler: optional Profiler recording the loading, compensation
+                         and gating of the sample and of every edit
+        :param max_threads: number of threads evaluating independent gates
+                            concurrently (see GatingPlan.apply)
+        :param dtype: dtype policy of the compensated events (see Sample)
+        :return: GatingSession of the sample's compensated events
+        """
+        s = Sample(fcs_file_path, cache=self.sample_cache, profiler=profiler, dtype=dtype)
+        s.generate_subsample(0, random_seed=123)
+        s.compensate_events(comp_matrix)
+
+        plan = self.get_gating_plan(gate_type, gate_id, s.channels)
+
+        return GatingSession(
+            plan,
             s.events_compensated,
-            s.channels,
-            chosen_gate['populations']
+            profiler=profiler,
+            max_threads=max_threads
         )
 
-        results_dict['populations'] = chosen_gate['populations']
-        results_dict['report'] = gate.results_to_dataframe(chosen_gate)
+    def validate_precision(
+            self,
+            fcs_file_paths,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            dtype='float32'
+    ):
+        """
+        Compares the population counts of a dtype policy (see Sample) to the
+        counts of float64 events, to check that analyzing the samples in
+        float32 doesn't change the gating results. Each sample is read once
+        and analyzed with both dtypes. A warning is issued if any count
+        differs.
 
-        return results_dict
+        :param fcs_file_paths: iterable of FCS file paths
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param dtype: dtype policy compared to float64
+        :return: Pandas DataFrame with the 'filename', 'parent_path', 'label'
+                 and 'type' of every population, its 'count_float64', its
+                 'count' with the dtype policy and the 'difference' of the two
+                 counts
+        """
+        import pandas as pd
+
+        comparisons = []
+
+        for fcs_file_path in fcs_file_paths:
+            s = Sample(fcs_file_path, cache=self.sample_cache, dtype='float64')
+            reference = self._analyze_sample(s, comp_matrix, gate_type, gate_id)['report']
+
+            s.set_dtype(dtype)
+            report = self._analyze_sample(s, comp_matrix, gate_type, gate_id)['report']
+
+            # both reports come from the same gating plan, so rows are aligned
+            comparison = reference[['parent_path', 'label', 'type']].reset_index(drop=True)
+            comparison.insert(0, 'filename', s.filename)
+            comparison['count_float64'] = reference['count'].values
+            comparison['count'] = report['count'].values
+            comparison['difference'] = comparison['count'] - comparison['count_float64']
+
+            comparisons.append(comparison)
+
+        if len(comparisons) > 0:
+            comparison = pd.concat(comparisons, ignore_index=True)
+        else:
+            comparison = pd.DataFrame(
+                columns=[
+                    'filename', 'parent_path', 'label', 'type',
+                    'count_float64', 'count', 'difference'
+                ]
+            )
+
+        differences = comparison[comparison['difference'] != 0]
+
+        if len(differences) > 0:
+            warnings.warn(
+                "%d population counts differ from float64 with dtype %s (largest difference: %d events)" %
+                (len(differences), dtype, differences['difference'].abs().max())
+            )
+
+        return comparison
+
+    def analyze_sample_streaming(
+            self,
+            fcs_file_path,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            chunk_size=1000000,
+            statistics=False
+    ):
+        """
+        Applies a gating hierarchy to the given FCS file in fixed-size chunks of
+        events, for samples too large to hold in memory along with their
+        compensated copies. The FCS file is memory mapped when possible, and
+        each chunk is compensated, gated and accumulated before the next one is
+        read. Population counts are identical to analyze_sample.
+
+        :param fcs_file_path: path to FCS file
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param chunk_size: number of events per chunk
+        :param statistics: if True, per population channel statistics (mean,
+                           standard deviation, minimum & maximum of the
+                           compensated events) are included in the results
+        :return: dictionary of results with the keys 'filename', 'report' and
+                 'statistics' (None unless requested)
+        """
+        s = Sample(fcs_file_path, memory_map=True)
+
+        plan = self.get_gating_plan(gate_type, gate_id, s.channels)
+        summary = GatingSummary(plan, statistics=statistics)
+
+        for chunk in s.iter_compensated_chunks(comp_matrix, chunk_size):
+            summary.add(plan.apply(chunk), chunk)
+
+        if statistics:
+            statistics_df = summary.statistics_to_dataframe()
+        else:
+            statistics_df = None
+
+        return {
+            'filename': os.path.basename(fcs_file_path),
+            'report': summary.to_dataframe(),
+            'statistics': statistics_df
+        }
+
+    def iter_analyze_prefetched(
+            self,
+            fcs_file_paths,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            prefetch=2
+    ):
+        """
+        Applies a gating hierarchy to many FCS files in this process, reading
+        the next FCS files on background threads while the current sample is
+        compensated and gated, so reading and analysis overlap. Results are
+        yielded in the order of the given files.
+
+        :param fcs_file_paths: iterable of FCS file paths
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param prefetch: number of files read ahead of the sample being
+                         analyzed, at most prefetch + 1 samples are held in
+                         memory at any time
+        :return: generator of (fcs_file_path, report, error) tuples, where the
+                 report is None and error is the error message if the sample
+                 failed
+        """
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1")
+
+        # parse & invert a matrix text once for the whole batch
+        comp_matrix = get_compensation(comp_matrix)
+
+        for fcs_file_path, loaded in self._iter_prefetched_samples(fcs_file_paths, prefetch):
+            try:
+                results = self._analyze_sample(
+                    loaded.result(),
+                    comp_matrix,
+                    gate_type,
+                    gate_id
+                )
+            except Exception as e:
+                yield fcs_file_path, None, "%s: %s" % (type(e).__name__, e)
+                continue
+
+            yield fcs_file_path, results['report'], None
+
+    def _iter_prefetched_samples(self, fcs_file_paths, prefetch):
+        """
+        Reads FCS files on prefetch background threads, yielding a
+        (fcs_file_path, future) tuple for each file in order, where the
+        future's result is the loaded Sample. The next file is read while the
+        yielded sample is being analyzed.
+        """
+        fcs_file_paths = iter(fcs_file_paths)
+
+        def load_sample(fcs_file_path):
+            return Sample(fcs_file_path, cache=self.sample_cache)
+
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            loading = deque()
+
+            for fcs_file_path in islice(fcs_file_paths, prefetch):
+                loading.append((fcs_file_path, executor.submit(load_sample, fcs_file_path)))
+
+            while len(loading) > 0:
+                fcs_file_path, future = loading.popleft()
+
+                # start reading the next file before analyzing this one
+                for next_path in islice(fcs_file_paths, 1):
+                    loading.append((next_path, executor.submit(load_sample, next_path)))
+
+                yield fcs_file_path, future
+
+    def store_many(
+            self,
+            fcs_file_paths,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            result_store,
+            include_events=False,
+            membership=True,
+            prefetch=2
+    ):
+        """
+        Applies a gating hierarchy to many FCS files in this process, adding
+        the results of each sample to a ResultStore as soon as it finishes.
+        The next files are read on background threads (see
+        iter_analyze_prefetched).
+
+        :param fcs_file_paths: iterable of FCS file paths
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param result_store: ResultStore the results are added to
+        :param include_events: if True, the compensated events of every
+                               sample are stored
+        :param membership: if True, the population membership of the events is
+                           stored
+        :param prefetch: number of files read ahead of the sample being
+                         analyzed
+        :return: dictionary of the error messages of failed samples, keyed by
+                 FCS file path
+        """
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1")
+
+        comp_matrix = get_compensation(comp_matrix)
+        failures = {}
+
+        for fcs_file_path, loaded in self._iter_prefetched_samples(fcs_file_paths, prefetch):
+            try:
+                s = loaded.result()
+                results = self._analyze_sample(s, comp_matrix, gate_type, gate_id)
+
+                if include_events:
+                    channel_labels = [s.channels[c]['PnN'] for c in sorted(s.channels, key=int)]
+
+                    result_store.add_sample(
+                        results,
+                        s.events_compensated,
+                        channel_labels,
+                        membership=membership
+                    )
+                else:
+                    result_store.add_sample(results, membership=membership)
+            except Exception as e:
+                failures[fcs_file_path] = "%s: %s" % (type(e).__name__, e)
+
+        return failures
+
+    def iter_analyze_many(
+            self,
+            fcs_file_paths,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            max_workers=None,
+            max_pending=None,
+            prefetch=0
+    ):
+        """
+        Applies a gating hierarchy to many FCS files using a pool of processes,
+        yielding results as each sample finishes (not necessarily in the order
+        given).
+
+        :param fcs_file_paths: iterable of FCS file paths
+        :param comp_matrix: Compensation, tab delimited compensation matrix
+                            text, or None (see Sample.compensate_events)
+        :param gate_type: 'sample' or 'group'
+        :param gate_id: sample or group ID of the gating hierarchy
+        :param max_workers: number of worker processes, defaults to the number
+                            of CPUs. If 1, samples are analyzed in this process.
+        :param max_pending: maximum number of samples submitted to the pool at
+                            any time, bounding the number of samples held in
+                            memory. Defaults to twice the number of workers.
+        :param prefetch: if max_workers is 1, the number of files read ahead on
+                         background threads (see iter_analyze_prefetched). By
+                         default files are not read ahead.
+        :return: generator of (fcs_file_path, report, error) tuples, where the
+                 report is None and error is the error message if the sample
+                 failed
+        """
+        # parse & invert a matrix text once for the whole batch, workers get
+        # the parsed Compensation
+        comp_matrix = get_compensation(comp_matrix)
+
+        if max_workers == 1 and prefetch > 0:
+            for sample_result in self.iter_analyze_prefetched(
+                    fcs_file_paths,
+                    comp_matrix,
+                    gate_type,
+                    gate_id,
+                    prefetch=prefetch
+            ):
+                yield sample_result
+            return
+
+        if max_workers == 1:
+            for fcs_file_path in fcs_file_paths:
+                yield _analyze_sample_report(
+                    self,
+                    fcs_file_path,
+                    comp_matrix,
+                    gate_type,
+                    gate_id
+                )
+            return
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        if max_pending is None:
+            max_pending = 2 * max_workers
+
+        with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(self,)
+        ) as executor:
+            pending = set()
+
+            for fcs_file_path in fcs_file_paths:
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        yield future.result()
+
+                pending.add(
+                    executor.submit(
+                        _analyze_sample_worker,
+                        fcs_file_path,
+                        comp_matrix,
+                        gate_type,
+                        gate_id
+                    )
+                )
+
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    yield future.result()
+
+    def analyze_many(
+            self,
+            fcs_file_paths,
+            comp_matrix,
+            gate_type,
+            gate_id,
+            max_workers=None,
+            max_pending=None,
+            prefetch=0
+    ):
+        """
+        Applies a gating hierarchy to many FCS files using a pool of processes.
+        A failure in one sample is recorded and does not abort the batch.
+
+        See iter_analyze_many for a description of the parameters.
+
+        :return: dictionary with the combined 'report' DataFrame of all samples
+                 (with an additional 'filename' column) and a 'failures' list
+                 of (index, FCS file path, error message) tuples, ordered by
+                 the index of the failed sample in fcs_file_paths
+        """
+        import pandas as pd
+
+        # the paths are walked twice, to analyze and to order the results
+        fcs_file_paths = list(fcs_file_paths)
+
+        # indices of each path in the given order, results are assigned to
+        # the pending indices of their path (a path may be repeated)
+        path_indices = {}
+        for index, fcs_file_path in enumerate(fcs_file_paths):
+            path_indices.setdefault(fcs_file_path, deque()).append(index)
+
+        reports = {}
+        failures = []
+
+        for fcs_file_path, report, error in self.iter_analyze_many(
+                fcs_file_paths,
+                comp_matrix,
+                gate_type,
+                gate_id,
+                max_workers=max_workers,
+                max_pending=max_pending,
+                prefetch=prefetch
+        ):
+            index = path_indices[fcs_file_path].popleft()
+
+            if error is not None:
+                failures.append((index, fcs_file_path, error))
+                continue
+
+            report.insert(0, 'filename', os.path.basename(fcs_file_path))
+            reports[index] = report
+
+        failures.sort()
+
+        # combine reports in the order the files were given
+        ordered_reports = [reports[index] for index in sorted(reports)]
+
+        if len(ordered_reports) > 0:
+            combined_report = pd.concat(ordered_reports, ignore_index=True)
+        else:
+            combined_report = pd.DataFrame()
+
+        return {
+            'report': combined_report,
+            'failures': failures
+        }
+
+    def analyze_group(
+            self,
+            group_id,
+            fcs_dir,
+            comp_matrix,
+            max_workers=None,
+            max_pending=None,
+            prefetch=0
+    ):
+        """
+        Applies a group gating hierarchy to all samples in the group using a
+        pool of processes. FCS files are expected in fcs_dir under the file
+        names found in the workspace. Group samples not loaded in the
+        workspace (e.g. excluded by sample_ids) are skipped with a warning.
+
+        See analyze_many for a description of the parameters and results.
+        """
+        fcs_file_paths = []
+        missing_sample_ids = []
+
+        for sample_id in self.groups[str(group_id)]['samples']:
+            if sample_id not in self.samples:
+                missing_sample_ids.append(sample_id)
+                continue
+
+            fcs_file_paths.append(
+                os.path.join(fcs_dir, self.samples[sample_id]['filename'])
+            )
+
+        if len(missing_sample_ids) > 0:
+            warnings.warn(
+                "Group %s samples not found in workspace, skipped: %s" %
+                (group_id, ', '.join(missing_sample_ids))
+            )
+
+        return self.analyze_many(
+            fcs_file_paths,
+            comp_matrix,
+            'group',
+            group_id,
+            max_workers=max_workers,
+            max_pending=max_pending,
+            prefetch=prefetch
+        )
@@ -7,7 +7,6 @@ setup(
     packages=['flowpy', 'flowpy.models'],
     description='Python library for analyzing Flow Cytometry Standard (FCS) files',
     requires=[
-        'matplotlib',
         'numpy',
         'pandas',
         'flowio',
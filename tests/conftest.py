@@ -0,0 +1,91 @@
+import os
+from copy import deepcopy
+import numpy as np
+import pytest
+from benchmarks import generate
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+SYNTHETIC_EVENT_COUNT = 20000
+SYNTHETIC_CHANNEL_COUNT = 6
+
+
+@pytest.fixture(scope='session')
+def example_workspace_path():
+    return os.path.join(EXAMPLES_DIR, '20171218 Workspace.xml')
+
+
+@pytest.fixture(scope='session')
+def example_fcs_paths():
+    return [
+        os.path.join(EXAMPLES_DIR, 'test_data_2d_%02d.fcs' % i) for i in (1, 2, 3)
+    ]
+
+
+@pytest.fixture(scope='session')
+def synthetic_data(tmp_path_factory):
+    """
+    Two synthetic float32 FCS files and a workspace of polygon and boolean
+    gates (group 1 and samples 1 & 2), see benchmarks.generate
+    """
+    data_dir = tmp_path_factory.mktemp('synthetic')
+    fcs_paths = []
+
+    for i in range(2):
+        fcs_path = str(data_dir / ('sample_%d.fcs' % (i + 1)))
+        channel_labels = generate.generate_fcs(
+            fcs_path,
+            SYNTHETIC_EVENT_COUNT,
+            channel_count=SYNTHETIC_CHANNEL_COUNT,
+            random_seed=i + 1
+        )
+        fcs_paths.append(fcs_path)
+
+    xml_path = str(data_dir / 'workspace.xml')
+    population_paths = generate.generate_workspace(
+        xml_path,
+        [os.path.basename(p) for p in fcs_paths],
+        SYNTHETIC_EVENT_COUNT,
+        channel_count=SYNTHETIC_CHANNEL_COUNT,
+        depth=3,
+        fan_out=2,
+        boolean_gate_count=4
+    )
+
+    return {
+        'fcs_paths': fcs_paths,
+        'xml_path': xml_path,
+        'channel_labels': channel_labels,
+        'population_paths': population_paths
+    }
+
+
+@pytest.fixture(scope='session')
+def synthetic_sample(synthetic_data):
+    """
+    Events (a float64 copy of the raw events) and channels of the first
+    synthetic FCS file
+    """
+    from flowpy import Sample
+
+    s = Sample(synthetic_data['fcs_paths'][0])
+
+    return {
+        'events': np.array(s.raw_events, dtype=np.float64),
+        'channels': s.channels
+    }
+
+
+@pytest.fixture
+def synthetic_populations(synthetic_data):
+    """
+    A fresh copy of the group gating hierarchy of the synthetic workspace
+    """
+    from flowpy import Workspace
+
+    return deepcopy(Workspace(synthetic_data['xml_path']).groups['1']['populations'])
+
+
+@pytest.fixture
+def rng():
+    return np.random.RandomState(0)
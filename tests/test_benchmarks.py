@@ -0,0 +1,188 @@
+import json
+import numpy as np
+import pytest
+from benchmarks import generate, run
+from flowpy import Workspace
+from tests.util import find_populations, make_channel_labels
+
+
+def test_generate_events():
+    chunks = list(generate.generate_events(2500, 6, random_seed=4, chunk_size=1000))
+    events = np.concatenate(chunks)
+
+    assert [c.shape for c in chunks] == [(1000, 6), (1000, 6), (500, 6)]
+    assert events.min() >= 0
+    assert events.max() < generate.DATA_RANGE
+    assert (np.diff(events[:, -1]) > 0).all()
+
+    # reproducible for a seed
+    np.testing.assert_array_equal(
+        np.concatenate(list(generate.generate_events(2500, 6, random_seed=4, chunk_size=1000))),
+        events
+    )
+
+    with pytest.raises(ValueError):
+        generate.get_channel_labels(3)
+
+
+@pytest.mark.parametrize('data_type, dtype', [('F', np.float32), ('D', np.float64), ('I', np.uint32)])
+def test_write_fcs(tmp_path, rng, data_type, dtype):
+    flowio = pytest.importorskip('flowio')
+    events = rng.uniform(0, 1000, (300, 3))
+    labels = ['FSC-A', 'FL1-A', 'Time']
+    fcs_path = str(tmp_path / 'events.fcs')
+
+    generate.write_fcs(fcs_path, [events[:100], events[100:]], 300, labels, data_type)
+
+    flow_data = flowio.FlowData(fcs_path)
+
+    # integer data is rounded
+    if data_type == 'I':
+        events = np.round(events)
+
+    assert [flow_data.channels[str(i + 1)]['PnN'] for i in range(3)] == labels
+    np.testing.assert_array_equal(
+        np.reshape(flow_data.events, (-1, 3)),
+        events.astype(dtype)
+    )
+
+    with pytest.raises(ValueError):
+        generate.write_fcs(fcs_path, [events], 300, labels, 'A')
+
+
+def test_generate_workspace(tmp_path):
+    xml_path = str(tmp_path / 'workspace.xml')
+    population_paths = generate.generate_workspace(
+        xml_path,
+        ['a.fcs', 'b.fcs'],
+        1000,
+        channel_count=5,
+        depth=2,
+        fan_out=3,
+        boolean_gate_count=2
+    )
+    workspace = Workspace(xml_path)
+
+    # 3 + 9 polygon populations and the boolean populations at the root level
+    assert len(population_paths) == 3 + 9 + 2
+    assert population_paths[-2:] == ['/B1', '/B2']
+    assert workspace.groups['1']['samples'] == ['1', '2']
+    assert workspace.samples['2']['filename'] == 'b.fcs'
+
+    plan = workspace.get_gating_plan(
+        'group',
+        '1',
+        make_channel_labels(generate.get_channel_labels(5))
+    )
+    assert sorted(node.path for node in plan.nodes) == sorted(population_paths)
+    assert workspace.samples['1']['populations'] == workspace.groups['1']['populations']
+
+
+def test_benchmark_report(tmp_path, capsys):
+    report_path = str(tmp_path / 'report.json')
+    arguments = [
+        '--events', '2000',
+        '--channels', '5',
+        '--workspace-samples', '2',
+        '--repeat', '1',
+        '--data-dir', str(tmp_path / 'data'),
+        '--output', report_path
+    ]
+
+    report = run.main(arguments)
+
+    with open(report_path, 'r') as report_file:
+        assert json.load(report_file) == json.loads(json.dumps(report))
+
+    assert report['parameters']['event_count'] == 2000
+    for stage, result in report['stages'].items():
+        assert 'error' not in result, stage
+        assert len(result['times']) == 1
+
+    assert 'analyze_sample' in report['stages']
+    assert 'parse_boolean_gates' in report['stages']
+
+    # comparing against a baseline report
+    run.main(arguments[:-2] + ['--compare', report_path])
+    output = capsys.readouterr().out
+
+    assert 'baseline_s' in output
+    assert all(stage in output for stage in report['stages'])
+
+    comparison = run.compare_reports(report, report)
+    assert all(c[3] == 1.0 for c in comparison)
+
+
+def test_import_stages_skip_heavy_modules(synthetic_data):
+    stages = {
+        'import_flowpy': run.measure_import('import flowpy', 1),
+        'import_classes': run.measure_import('from flowpy import Sample, Workspace', 1),
+        'gating_worker': run.measure_import(
+            run.GATING_WORKER_STATEMENTS,
+            1,
+            (synthetic_data['fcs_paths'][0], synthetic_data['xml_path'])
+        )
+    }
+
+    for stage, result in stages.items():
+        assert 'error' not in result, stage
+        assert result['heavy_modules'] == [], stage
+
+    assert run.check_imports(stages) == []
+
+    # the reports of a full analysis still use pandas
+    result = run.measure_import(
+        "from flowpy import Workspace\n"
+        "Workspace(sys.argv[2]).analyze_sample(sys.argv[1], None, 'group', 1)",
+        1,
+        (synthetic_data['fcs_paths'][0], synthetic_data['xml_path'])
+    )
+
+    assert result['heavy_modules'] == ['pandas']
+
+
+def test_check_imports():
+    stages = {
+        'import_flowpy': {'error': 'CalledProcessError: failed'},
+        'import_classes': {'heavy_modules': ['pandas', 'matplotlib']},
+        'gating_worker': {'heavy_modules': []},
+        'analyze_sample': {'times': [1.0]}
+    }
+
+    assert run.check_imports(stages) == [
+        'import_flowpy failed: CalledProcessError: failed',
+        'import_classes imports pandas, matplotlib'
+    ]
+    assert run.check_imports({}) == []
+
+
+def test_lazy_attributes():
+    import flowpy
+
+    assert flowpy.Sample.__name__ == 'Sample'
+    assert flowpy.Workspace.__name__ == 'Workspace'
+    assert set(flowpy.__all__) <= set(dir(flowpy))
+
+    with pytest.raises(AttributeError):
+        flowpy.missing
+
+
+def test_stages_measure_clean_populations(tmp_path, monkeypatch):
+    compiled = []
+
+    class CheckedGatingPlan(run.GatingPlan):
+        def __init__(self, populations, channel_labels):
+            # gate results of earlier stages would be copied by the plan
+            compiled.append(populations)
+            assert all(
+                'result' not in g for _, p in find_populations(populations) for g in p['gates']
+            )
+            super(CheckedGatingPlan, self).__init__(populations, channel_labels)
+
+    monkeypatch.setattr(run, 'GatingPlan', CheckedGatingPlan)
+
+    stages = run.run_benchmarks(str(tmp_path), 2000, 5, 'F', 2, 2, 1, 1, 1)
+
+    assert len(compiled) > 0
+    for stage, result in stages.items():
+        assert 'error' not in result, stage
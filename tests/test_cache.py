@@ -0,0 +1,170 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from flowpy import Sample, Workspace
+from flowpy.models.cache import SampleCache
+from flowpy.models.compensation import Compensation
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SampleCache(str(tmp_path / 'cache'))
+
+
+def test_file_key_by_content(cache, synthetic_data, tmp_path):
+    fcs_path = synthetic_data['fcs_paths'][0]
+    copy_path = str(tmp_path / 'copy.fcs')
+    shutil.copy(fcs_path, copy_path)
+
+    key = cache.get_file_key(fcs_path)
+
+    assert cache.get_file_key(copy_path) == key
+    assert cache.get_file_key(synthetic_data['fcs_paths'][1]) != key
+
+    # a modified file gets a new key
+    with open(copy_path, 'ab') as fh:
+        fh.write(b'\0')
+    os.utime(copy_path, ns=(0, 0))
+
+    assert cache.get_file_key(copy_path) != key
+
+
+def test_store_and_load(cache, rng):
+    events = rng.uniform(size=(100, 3)).astype(np.float32)
+    metadata = {'par': '3', 'tot': '100'}
+    channels = {'1': {'PnN': 'A'}, '2': {'PnN': 'B'}, '3': {'PnN': 'C', 'PnS': 'c'}}
+
+    assert cache.load_sample('key') is None
+    assert cache.load_array('key', 'array') is None
+
+    cache.store_sample('key', events, metadata, channels)
+    cache.store_array('key', 'array', events[:10])
+
+    cached = cache.load_sample('key')
+
+    assert isinstance(cached['raw_events'], np.memmap)
+    assert not cached['raw_events'].flags.writeable
+    np.testing.assert_array_equal(cached['raw_events'], events)
+    assert cached['raw_events'].dtype == events.dtype
+    assert cached['metadata'] == metadata
+    assert cached['channels'] == channels
+    np.testing.assert_array_equal(cache.load_array('key', 'array'), events[:10])
+
+    cache.clear()
+
+    assert cache.load_sample('key') is None
+    assert cache.get_size() == 0
+
+
+def test_lru_eviction(tmp_path):
+    entry_size = 8000 + 128
+    cache = SampleCache(str(tmp_path / 'cache'), max_bytes=int(2.5 * entry_size))
+    events = np.zeros((1000, 1))
+
+    cache.store_array('a', 'events', events)
+    cache.store_array('b', 'events', events)
+    os.utime(cache._entry_dir('a'), (1, 1))
+    os.utime(cache._entry_dir('b'), (2, 2))
+
+    # loading an entry marks it as recently used
+    cache.load_array('a', 'events')
+    cache.store_array('c', 'events', events)
+
+    assert cache.load_array('b', 'events') is None
+    assert cache.load_array('a', 'events') is not None
+    assert cache.load_array('c', 'events') is not None
+    assert cache.get_size() <= cache.max_bytes
+
+    # the stored entry is kept even if it exceeds the cache size
+    cache.store_array('d', 'events', np.zeros((10000, 1)))
+
+    assert cache.load_array('d', 'events') is not None
+    assert cache.load_array('a', 'events') is None
+    assert cache.load_array('c', 'events') is None
+
+
+def test_file_record_eviction(cache, synthetic_data, tmp_path):
+    files_dir = os.path.join(cache.cache_dir, 'files')
+    fcs_path = synthetic_data['fcs_paths'][0]
+    copy_path = str(tmp_path / 'copy.fcs')
+    removed_path = str(tmp_path / 'removed.fcs')
+    shutil.copy(fcs_path, copy_path)
+    shutil.copy(synthetic_data['fcs_paths'][1], removed_path)
+
+    key = cache.get_file_key(fcs_path)
+    cache.get_file_key(copy_path)
+    cache.get_file_key(removed_path)
+    cache.store_array(key, 'events', np.zeros((1000, 1)))
+
+    # file records count toward the cache size
+    record_size = sum(os.path.getsize(os.path.join(files_dir, n)) for n in os.listdir(files_dir))
+    assert record_size > 0
+    assert cache.get_size() == 8000 + 128 + record_size
+
+    # records of modified & removed files are pruned
+    with open(copy_path, 'ab') as fh:
+        fh.write(b'\0')
+    os.utime(copy_path, ns=(0, 0))
+    os.remove(removed_path)
+    cache.evict()
+
+    assert len(os.listdir(files_dir)) == 1
+    assert cache.get_file_key(fcs_path) == key
+
+    # the records of an entry are evicted with it
+    cache.max_bytes = 0
+    cache.evict()
+
+    assert cache.load_array(key, 'events') is None
+    assert os.listdir(files_dir) == []
+
+    cache.get_file_key(fcs_path)
+    cache.clear()
+
+    assert os.listdir(files_dir) == []
+    assert cache.get_size() == 0
+
+
+def test_warm_analysis_skips_parsing_and_compensation(cache, synthetic_data, monkeypatch):
+    flowio = pytest.importorskip('flowio')
+    fcs_path = synthetic_data['fcs_paths'][0]
+    workspace = Workspace(synthetic_data['xml_path'], sample_cache=cache)
+
+    cold = workspace.analyze_sample(fcs_path, None, 'group', 1)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cached data was recomputed")
+
+    monkeypatch.setattr(flowio, 'FlowData', fail)
+    monkeypatch.setattr(Compensation, 'apply', fail)
+
+    warm = workspace.analyze_sample(fcs_path, None, 'group', 1)
+
+    pd.testing.assert_frame_equal(warm['report'], cold['report'])
+
+    s = Sample(fcs_path, cache=cache)
+    s.generate_subsample(0, random_seed=123)
+    s.compensate_events(None)
+
+    assert isinstance(s.raw_events, np.memmap)
+    assert isinstance(s.events_compensated, np.memmap)
+
+    # a different sub-sample is compensated again
+    s.generate_subsample(1000, random_seed=1)
+
+    with pytest.raises(AssertionError):
+        s.events_compensated
+
+
+def test_cached_compensation_without_subsample(cache, synthetic_data):
+    fcs_path = synthetic_data['fcs_paths'][0]
+    expected = Sample(fcs_path)
+    expected.compensate_events(None)
+
+    for _ in range(2):
+        s = Sample(fcs_path, cache=cache)
+        s.compensate_events(None)
+
+        np.testing.assert_array_equal(s.events_compensated, expected.events_compensated)
@@ -0,0 +1,231 @@
+import pickle
+import numpy as np
+import pytest
+from flowpy import Sample
+from flowpy.models import compensation
+from flowpy.models.compensation import Compensation
+from tests.util import make_channel_labels
+
+SPILLOVER = [[1.0, 0.1, 0.0], [0.05, 1.0, 0.2], [0.0, 0.02, 1.0]]
+LABELS = ['FL1-A', 'FL2-A', 'FL3-A']
+
+
+def _matrix_text(spillover, labels):
+    return '\n'.join(['\t'.join(labels)] + ['\t'.join(repr(v) for v in row) for row in spillover])
+
+
+def test_apply_matches_solve(rng):
+    # more events than a compensation block
+    events = rng.uniform(0, 1000, (compensation.COMPENSATION_CHUNK_SIZE + 1001, 5))
+    comp = Compensation(SPILLOVER, LABELS)
+    fluoro_indices = [3, 1, 2]
+
+    compensated = comp.apply(events, fluoro_indices)
+    expected = events.copy()
+    expected[:, fluoro_indices] = np.linalg.solve(
+        np.array(SPILLOVER).T,
+        events[:, fluoro_indices].T
+    ).T
+
+    np.testing.assert_allclose(compensated, expected, rtol=1e-12, atol=1e-9)
+    assert not np.shares_memory(compensated, events)
+
+    flowutils = pytest.importorskip('flowutils')
+    np.testing.assert_allclose(
+        compensated,
+        flowutils.compensate.compensate(events, np.array(SPILLOVER), fluoro_indices),
+        rtol=1e-12,
+        atol=1e-9
+    )
+
+
+def test_apply_dtypes(rng):
+    comp = Compensation(SPILLOVER, LABELS)
+    events = rng.uniform(0, 1000, (100, 3))
+
+    # float events keep their dtype, integer events are compensated in float64
+    assert comp.apply(events.astype(np.float32), [0, 1, 2]).dtype == np.float32
+    integer_compensated = comp.apply(events.astype(np.uint32), [0, 1, 2])
+    assert integer_compensated.dtype == np.float64
+    np.testing.assert_allclose(
+        integer_compensated,
+        comp.apply(events.astype(np.uint32).astype(np.float64), [0, 1, 2])
+    )
+
+    expected = comp.apply(events, [0, 1, 2])
+    result = comp.apply(events, [0, 1, 2], in_place=True)
+
+    assert result is events
+    np.testing.assert_array_equal(events, expected)
+
+
+def test_parsing():
+    comp = Compensation(SPILLOVER, LABELS)
+    keyword = '3,%s,%s' % (','.join(LABELS), ','.join(repr(v) for row in SPILLOVER for v in row))
+
+    assert Compensation.from_text(_matrix_text(SPILLOVER, LABELS)) == comp
+    assert Compensation.from_spillover_keyword(keyword) == comp
+    assert Compensation.from_metadata({'spillover': keyword}) == comp
+    assert Compensation.from_metadata({'$SPILL': keyword}) == comp
+    assert Compensation.from_metadata({'spillover': ' '}) is None
+    assert Compensation.from_metadata({}) is None
+
+    np.testing.assert_allclose(comp.inverse.dot(comp.spillover), np.identity(3), atol=1e-15)
+
+    with pytest.raises(ValueError):
+        Compensation.from_spillover_keyword('2,FL1-A,FL2-A,1,0,0')
+    with pytest.raises(ValueError):
+        Compensation([[1, 0]], ['FL1-A'])
+    with pytest.raises(ValueError):
+        Compensation(np.identity(2), LABELS)
+
+
+def test_equality_and_pickling():
+    comp = Compensation(SPILLOVER, LABELS)
+    channels = make_channel_labels(['FSC-A'] + LABELS)
+
+    assert comp == Compensation(np.array(SPILLOVER), LABELS)
+    assert hash(comp) == hash(Compensation(SPILLOVER, LABELS))
+    assert comp != Compensation(SPILLOVER, ['FL2-A', 'FL1-A', 'FL3-A'])
+    assert comp != Compensation(np.identity(3), LABELS)
+
+    assert comp.get_fluoro_indices(channels) == [1, 2, 3]
+
+    unpickled = pickle.loads(pickle.dumps(comp))
+    assert unpickled == comp
+    assert not unpickled.inverse.flags.writeable
+    assert unpickled.get_fluoro_indices(channels) == [1, 2, 3]
+
+    with pytest.raises(KeyError):
+        comp.get_fluoro_indices(make_channel_labels(['FSC-A', 'FL1-A']))
+
+
+def test_identity_and_text_cache():
+    channels = make_channel_labels(['FSC-A', 'SSC-A', 'FL2-A', 'FL1-A', 'Time'])
+    identity = Compensation.identity(channels)
+
+    assert identity.channel_labels == ('FL2-A', 'FL1-A')
+    np.testing.assert_array_equal(identity.spillover, np.identity(2))
+
+    text = _matrix_text(SPILLOVER, LABELS)
+    comp = compensation.get_compensation(text)
+
+    assert compensation.get_compensation(text) is comp
+    assert compensation.get_compensation(comp) is comp
+    assert compensation.get_compensation(None) is None
+
+
+def test_sample_compensation(synthetic_data):
+    sample = Sample(synthetic_data['fcs_paths'][0])
+    comp = Compensation(SPILLOVER, LABELS)
+    fluoro_indices = comp.get_fluoro_indices(sample.channels)
+
+    sample.compensate_events(_matrix_text(SPILLOVER, LABELS))
+    np.testing.assert_array_equal(
+        sample.events_compensated,
+        comp.apply(sample.raw_events, fluoro_indices)
+    )
+
+    chunks = list(sample.iter_compensated_chunks(comp, 7000))
+
+    assert [c.shape[0] for c in chunks] == [7000, 7000, 6000]
+    np.testing.assert_array_equal(np.concatenate(chunks), sample.events_compensated)
+
+    with pytest.raises(KeyError):
+        sample.compensate_events(_matrix_text([[1.0]], ['FL9-A']))
+
+
+def test_sample_metadata_spillover(synthetic_data, tmp_path):
+    from flowpy.models.cache import SampleCache
+
+    fcs_path = synthetic_data['fcs_paths'][0]
+    sample = Sample(fcs_path)
+    keyword = '3,%s,%s' % (','.join(LABELS), ','.join(repr(v) for row in SPILLOVER for v in row))
+
+    # a cached copy of the file with a spillover keyword in its metadata
+    cache = SampleCache(str(tmp_path / 'cache'))
+    key = cache.get_file_key(fcs_path)
+    cache.store_sample(key, sample.raw_events, dict(sample.metadata, spillover=keyword), sample.channels)
+
+    spill_sample = Sample(fcs_path, cache=cache)
+    spill_sample.compensate_events(None)
+    comp = Compensation(SPILLOVER, LABELS)
+
+    assert spill_sample.get_metadata_compensation() == comp
+    assert sample.get_metadata_compensation() is None
+    np.testing.assert_array_equal(
+        spill_sample.events_compensated,
+        comp.apply(sample.raw_events, comp.get_fluoro_indices(sample.channels))
+    )
+
+
+def test_workspace_compensation_matrices(tmp_path):
+    from flowpy import Workspace
+
+    flowjo_matrix = '<CompensationMatrix name="Comp 1">%s</CompensationMatrix>' % ''.join(
+        '<Channel name="%s">%s</Channel>' % (row_label, ''.join(
+            '<ChannelValue name="%s" value="%r" />' % (label, v)
+            for label, v in zip(LABELS, row)
+        )) for row_label, row in zip(LABELS, SPILLOVER)
+    )
+    # rows & columns in a different order
+    order = [2, 0, 1]
+    gating_ml_matrix = (
+        '<transforms:spilloverMatrix transforms:id="Acquisition">%s</transforms:spilloverMatrix>'
+    ) % ''.join(
+        '<transforms:spillover data-type:parameter="%s">%s</transforms:spillover>' % (
+            LABELS[i],
+            ''.join(
+                '<transforms:coefficient data-type:parameter="%s" transforms:value="%r" />' %
+                (LABELS[j], SPILLOVER[i][j]) for j in order
+            )
+        ) for i in order
+    )
+
+    xml_path = str(tmp_path / 'compensation.xml')
+    with open(xml_path, 'w') as out_file:
+        out_file.write(
+            '<?xml version="1.0" encoding="UTF-8"?><Workspace '
+            'xmlns:transforms="http://www.isac-net.org/std/Gating-ML/v2.0/transformations" '
+            'xmlns:data-type="http://www.isac-net.org/std/Gating-ML/v2.0/datatypes">'
+            '<CompensationMatrices>%s</CompensationMatrices><SampleList>'
+            '<Sample eventCount="10" sampleID="1">%s<SampleNode nodeName="a.fcs" /></Sample>'
+            '</SampleList></Workspace>' % (flowjo_matrix, gating_ml_matrix)
+        )
+
+    workspace = Workspace(xml_path)
+    comp = Compensation(SPILLOVER, LABELS)
+    sample_comp = workspace.samples['1']['compensation']
+
+    assert workspace.compensations == {'Comp 1': comp}
+    assert sample_comp.channel_labels == tuple(LABELS[i] for i in order)
+    np.testing.assert_array_equal(
+        sample_comp.spillover,
+        np.array(SPILLOVER)[order][:, order]
+    )
+
+
+def test_sample_malformed_spillover(synthetic_data, tmp_path):
+    from flowpy.models.cache import SampleCache
+
+    fcs_path = synthetic_data['fcs_paths'][0]
+    sample = Sample(fcs_path)
+
+    cache = SampleCache(str(tmp_path / 'cache'))
+    key = cache.get_file_key(fcs_path)
+    cache.store_sample(
+        key,
+        sample.raw_events,
+        dict(sample.metadata, spillover='2,FL1-A,FL2-A,1,0,0'),
+        sample.channels
+    )
+
+    # the keyword is only parsed for metadata compensation
+    spill_sample = Sample(fcs_path, cache=cache)
+    spill_sample.compensate_events(_matrix_text(SPILLOVER, LABELS))
+    sample.compensate_events(_matrix_text(SPILLOVER, LABELS))
+
+    np.testing.assert_array_equal(spill_sample.events_compensated, sample.events_compensated)
+
+    with pytest.raises(ValueError):
+        spill_sample.compensate_events(None)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from benchmarks import generate
+from flowpy import Sample
+from flowpy.models import fcs
+
+
+def _flowio_events(fcs_path):
+    flowio = pytest.importorskip('flowio')
+    flow_data = flowio.FlowData(fcs_path)
+
+    return flow_data, np.reshape(flow_data.events, (-1, flow_data.channel_count))
+
+
+@pytest.fixture(scope='module', params=['F', 'D', 'I'])
+def fcs_path(request, tmp_path_factory):
+    fcs_path = str(tmp_path_factory.mktemp('fcs') / ('data_%s.fcs' % request.param))
+    generate.generate_fcs(fcs_path, 5000, channel_count=5, data_type=request.param)
+
+    return fcs_path
+
+
+def test_memory_map_events_match_flowio(fcs_path):
+    flow_data, expected = _flowio_events(fcs_path)
+    events = fcs.memory_map_events(fcs_path)
+
+    assert isinstance(events, np.memmap)
+    assert not events.flags.writeable
+    assert events.shape == expected.shape
+    np.testing.assert_array_equal(events, expected)
+
+
+def test_read_fcs_text_matches_flowio(fcs_path):
+    flow_data, _ = _flowio_events(fcs_path)
+    fcs_text = fcs.read_fcs_text(fcs_path)
+
+    assert fcs_text['channels'] == flow_data.channels
+    for key in ('par', 'tot', 'datatype', 'byteord', 'p1n'):
+        assert fcs_text['text'][key] == flow_data.text[key]
+
+
+def test_memory_mapped_sample(fcs_path):
+    sample = Sample(fcs_path)
+    mapped_sample = Sample(fcs_path, memory_map=True)
+
+    assert isinstance(mapped_sample.raw_events, np.memmap)
+    assert mapped_sample.channels == sample.channels
+    assert mapped_sample.event_count == sample.event_count
+    np.testing.assert_array_equal(mapped_sample.raw_events, sample.raw_events)
+
+    with pytest.raises(ValueError):
+        Sample(fcs_path, memory_map=True, track_indices=True)
+
+
+def test_memory_mapped_example_files(example_fcs_paths):
+    for fcs_path in example_fcs_paths:
+        fcs_text = fcs.read_fcs_text(fcs_path)
+        events = fcs.memory_map_events(fcs_path, fcs_text)
+
+        if events is None:
+            assert fcs.get_event_dtype(fcs_text['text']) is None
+            continue
+
+        np.testing.assert_array_equal(events, _flowio_events(fcs_path)[1])
+
+
+def test_get_event_dtype():
+    text = {'mode': 'L', 'byteord': '4,3,2,1', 'datatype': 'F', 'par': '2'}
+    assert fcs.get_event_dtype(text) == np.dtype('>f4')
+
+    text = {'byteord': '1,2', 'datatype': 'I', 'par': '2', 'p1b': '16', 'p2b': '16'}
+    assert fcs.get_event_dtype(text) == np.dtype('<u2')
+
+    # layouts that can't be memory mapped
+    assert fcs.get_event_dtype(dict(text, p2b='8')) is None
+    assert fcs.get_event_dtype(dict(text, p1b='10', p2b='10')) is None
+    assert fcs.get_event_dtype(dict(text, mode='C')) is None
+    assert fcs.get_event_dtype(dict(text, byteord='3,4,1,2')) is None
+    assert fcs.get_event_dtype(dict(text, datatype='A')) is None
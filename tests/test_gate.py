@@ -0,0 +1,475 @@
+import numpy as np
+import pytest
+from flowpy.models import gate
+from tests.util import find_populations
+
+
+def _copy_gating_counts(events, channel_labels, populations):
+    """
+    Counts of the polygon populations gated the original way, copying the
+    events of each population and gating its children on the copy with
+    matplotlib's Path.contains_points
+    """
+    Path = pytest.importorskip('matplotlib.path').Path
+    counts = {}
+
+    def walk(level, parent_events, parent_path):
+        for label, population in level.items():
+            gate_dict = population['gates'][0]
+
+            if gate_dict['type'] != 'Polygon':
+                continue
+
+            x_index = gate.find_channel_index(channel_labels, gate_dict['x_axis'])
+            y_index = gate.find_channel_index(channel_labels, gate_dict['y_axis'])
+            path = Path(gate.get_polygon_vertices(gate_dict))
+
+            is_in_gate = path.contains_points(parent_events[:, [x_index, y_index]])
+            gated_events = parent_events[is_in_gate]
+
+            population_path = '%s/%s' % (parent_path, label)
+            counts[population_path] = gated_events.shape[0]
+
+            walk(population['children'], gated_events, population_path)
+
+    walk(populations, events, '')
+
+    return counts
+
+
+def _remove_boolean_gates(populations):
+    for label in list(populations):
+        if populations[label]['gates'][0]['type'] == 'Boolean':
+            del populations[label]
+
+    return populations
+
+
+def test_gating_hierarchy_masks_match_copied_gating(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+    channels = synthetic_sample['channels']
+    populations = _remove_boolean_gates(synthetic_populations)
+
+    expected_counts = _copy_gating_counts(events, channels, populations)
+    gate.apply_gating_hierarchy(events, channels, populations)
+
+    for path, population in find_populations(populations):
+        result = population['gates'][0]['result']
+        mask = result['mask']
+
+        assert mask.dtype == np.bool_
+        assert mask.shape == (events.shape[0],)
+        assert result['count'] == np.count_nonzero(mask) == expected_counts[path]
+        assert 'gated_events' not in result
+
+        parent = gate.find_population(populations, path.rsplit('/', 1)[0])
+        if parent is None:
+            assert result['ungated_count'] == events.shape[0]
+        else:
+            parent_mask = gate.get_population_mask(parent)
+
+            assert result['ungated_count'] == np.count_nonzero(parent_mask)
+            assert not (mask & ~parent_mask).any()
+
+
+def test_gating_hierarchy_materializes_gated_events(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+    populations = _remove_boolean_gates(synthetic_populations)
+
+    gate.apply_gating_hierarchy(
+        events,
+        synthetic_sample['channels'],
+        populations,
+        materialize=True
+    )
+
+    for _, population in find_populations(populations):
+        gate_dict = population['gates'][0]
+        gated_events = gate_dict['result']['gated_events']
+
+        np.testing.assert_array_equal(gated_events, events[gate_dict['result']['mask']])
+        np.testing.assert_array_equal(gate.get_gated_events(events, gate_dict), gated_events)
+
+
+def test_gating_hierarchy_reuses_plan(synthetic_sample, synthetic_populations, monkeypatch):
+    from flowpy.models import gating_plan
+
+    events = synthetic_sample['events']
+    channels = synthetic_sample['channels']
+    compiled = []
+    gating_plan_class = gating_plan.GatingPlan
+
+    def compile_plan(populations, channel_labels):
+        compiled.append(populations)
+        return gating_plan_class(populations, channel_labels)
+
+    monkeypatch.setattr(gating_plan, '_gating_plans', {})
+    monkeypatch.setattr(gating_plan, 'GatingPlan', compile_plan)
+
+    gate.apply_gating_hierarchy(events, channels, synthetic_populations, materialize=True)
+    first_counts = dict(
+        (path, population['gates'][0]['result']['count'])
+        for path, population in find_populations(synthetic_populations)
+    )
+
+    # gating again reuses the plan, the stored results aren't copied
+    gate.apply_gating_hierarchy(events, channels, synthetic_populations)
+    plan = gating_plan.get_gating_plan(synthetic_populations, channels)
+
+    assert len(compiled) == 1
+    assert all(
+        'result' not in g for _, p in find_populations(compiled[0]) for g in p['gates']
+    )
+    assert all('result' not in g for node in plan.nodes for g in node.gates)
+    for path, population in find_populations(synthetic_populations):
+        assert population['gates'][0]['result']['count'] == first_counts[path]
+        assert 'gated_events' not in population['gates'][0]['result']
+
+    # an edited gate compiles a new plan
+    path, population = find_populations(synthetic_populations, 'Polygon')[0]
+    population['gates'][0]['vertices'] = population['gates'][0]['vertices'][:-1]
+    gate.apply_gating_hierarchy(events, channels, synthetic_populations)
+
+    assert len(compiled) == 2
+
+
+def test_gating_hierarchy_parent_mask(synthetic_sample, synthetic_populations, rng):
+    events = synthetic_sample['events']
+    populations = _remove_boolean_gates(synthetic_populations)
+    parent_mask = rng.uniform(size=events.shape[0]) < 0.5
+
+    expected_counts = _copy_gating_counts(
+        events[parent_mask],
+        synthetic_sample['channels'],
+        populations
+    )
+    gate.apply_gating_hierarchy(
+        events,
+        synthetic_sample['channels'],
+        populations,
+        parent_mask=parent_mask
+    )
+
+    for path, population in find_populations(populations):
+        result = population['gates'][0]['result']
+
+        assert result['count'] == expected_counts[path]
+        assert not (result['mask'] & ~parent_mask).any()
+
+
+def test_indices_to_mask():
+    is_in_gate = np.array([True, False, True])
+
+    np.testing.assert_array_equal(
+        gate.indices_to_mask(5, np.array([0, 2, 4]), is_in_gate),
+        [True, False, False, False, True]
+    )
+    np.testing.assert_array_equal(
+        gate.indices_to_mask(3, None, is_in_gate),
+        is_in_gate
+    )
+    assert gate.parent_event_indices(None) is None
+    np.testing.assert_array_equal(
+        gate.parent_event_indices(np.array([False, True, True])),
+        [1, 2]
+    )
+
+
+def test_parse_boolean_specification():
+    assert gate.parse_boolean_specification('G0&!G1') == (
+        'and', ('ref', 0), ('not', ('ref', 1))
+    )
+    # not binds tighter than and, which binds tighter than or
+    assert gate.parse_boolean_specification('G0|G1&!G2') == (
+        'or', ('ref', 0), ('and', ('ref', 1), ('not', ('ref', 2)))
+    )
+    assert gate.parse_boolean_specification('(G0|G1)&G2') == (
+        'and', ('or', ('ref', 0), ('ref', 1)), ('ref', 2)
+    )
+    # operands other than G<n> reference the gate paths in order
+    assert gate.parse_boolean_specification('a | !b') == (
+        'or', ('ref', 0), ('not', ('ref', 1))
+    )
+
+
+@pytest.mark.parametrize('specification', ['G0&', '(G0|G1', 'G0 G1', '&G0', 'G0)'])
+def test_parse_boolean_specification_errors(specification):
+    with pytest.raises(ValueError):
+        gate.parse_boolean_specification(specification)
+
+
+def test_evaluate_boolean_tree(rng):
+    masks = [rng.uniform(size=100) < 0.5 for _ in range(3)]
+    tree = gate.parse_boolean_specification('!(G0|G1)&G2')
+
+    np.testing.assert_array_equal(
+        gate.evaluate_boolean_tree(tree, masks),
+        ~(masks[0] | masks[1]) & masks[2]
+    )
+
+    # unresolved references are ignored
+    np.testing.assert_array_equal(
+        gate.evaluate_boolean_tree(tree, [masks[0], None, masks[2]]),
+        ~masks[0] & masks[2]
+    )
+    assert gate.evaluate_boolean_tree(tree, [None, None, None]) is None
+
+
+def test_get_boolean_gate_mask(rng):
+    masks = [rng.uniform(size=100) < 0.5 for _ in range(2)]
+    parent_mask = rng.uniform(size=100) < 0.5
+    tree = gate.parse_boolean_specification('G0&!G1')
+
+    mask = gate.get_boolean_gate_mask(tree, masks, 100, parent_mask)
+
+    np.testing.assert_array_equal(mask, masks[0] & ~masks[1] & parent_mask)
+
+    # no resolved references select the parent population, in a new array
+    mask = gate.get_boolean_gate_mask(tree, [None, None], 100, parent_mask)
+
+    np.testing.assert_array_equal(mask, parent_mask)
+    assert mask is not parent_mask
+    assert gate.get_boolean_gate_mask(tree, [None, None], 100).all()
+
+    single = gate.get_boolean_gate_mask(gate.parse_boolean_specification('G0'), masks, 100)
+    assert single is not masks[0]
+
+    with pytest.raises(ValueError):
+        gate.get_boolean_gate_mask(tree, masks[:1], 100, name='G0&!G1')
+
+
+def test_boolean_gates_combine_referenced_masks(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+
+    gate.apply_gating_hierarchy(events, synthetic_sample['channels'], synthetic_populations)
+
+    boolean_populations = find_populations(synthetic_populations, 'Boolean')
+    assert len(boolean_populations) > 0
+
+    for _, population in boolean_populations:
+        gate_dict = population['gates'][0]
+        first, second = [
+            gate.get_population_mask(gate.find_population(synthetic_populations, g))
+            for g in gate_dict['groups']
+        ]
+
+        if gate_dict['specification'] == 'G0&!G1':
+            expected = first & ~second
+        else:
+            expected = first | second
+
+        np.testing.assert_array_equal(gate_dict['result']['mask'], expected)
+        assert gate_dict['result']['count'] == np.count_nonzero(expected)
+        assert gate_dict['result']['ungated_count'] == events.shape[0]
+
+
+def test_boolean_gate_nested_paths(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+    polygon_paths = [path for path, _ in find_populations(synthetic_populations, 'Polygon')]
+    deepest = max(polygon_paths, key=lambda p: p.count('/'))
+    sibling = [p for p in polygon_paths if p.count('/') == deepest.count('/') and p != deepest][0]
+
+    # a boolean gate nested under a population, referencing populations of
+    # other branches by their full paths
+    parent = gate.find_population(synthetic_populations, polygon_paths[0])
+    parent['children']['Nested'] = {
+        'gates': [{
+            'type': 'Boolean',
+            'specification': 'G0|G1',
+            'groups': [deepest, sibling]
+        }],
+        'children': {}
+    }
+
+    gate.apply_gating_hierarchy(events, synthetic_sample['channels'], synthetic_populations)
+
+    parent_mask = gate.get_population_mask(parent)
+    expected = (
+        gate.get_population_mask(gate.find_population(synthetic_populations, deepest)) |
+        gate.get_population_mask(gate.find_population(synthetic_populations, sibling))
+    ) & parent_mask
+    result = parent['children']['Nested']['gates'][0]['result']
+
+    np.testing.assert_array_equal(result['mask'], expected)
+    assert result['ungated_count'] == np.count_nonzero(parent_mask)
+
+
+def test_parse_boolean_gates_pending(synthetic_sample, synthetic_populations):
+    boolean_gates = [
+        population['gates'][0]
+        for _, population in find_populations(synthetic_populations, 'Boolean')
+    ]
+
+    # the referenced populations have not been gated yet
+    pending = gate.parse_boolean_gates(
+        synthetic_sample['events'],
+        synthetic_populations,
+        boolean_gates
+    )
+
+    assert pending == boolean_gates
+
+
+def _contains_points(vertices, x, y):
+    Path = pytest.importorskip('matplotlib.path').Path
+
+    return Path(vertices).contains_points(np.column_stack((x, y)))
+
+
+def _boundary_points(vertices, rng):
+    # vertices, edge midpoints and random points on the edges
+    starts = vertices
+    ends = np.roll(vertices, -1, axis=0)
+    fractions = np.concatenate(([0.0, 0.5], rng.uniform(size=8)))
+
+    points = [starts + f * (ends - starts) for f in fractions]
+
+    return np.concatenate(points)
+
+
+@pytest.mark.parametrize('vertex_count', [3, 4, 5, 8, 20])
+def test_points_in_polygon_matches_matplotlib(vertex_count, rng):
+    for _ in range(10):
+        # random (possibly concave or self-intersecting) polygons
+        vertices = rng.uniform(-10, 10, (vertex_count, 2))
+        points = np.concatenate((
+            rng.uniform(-12, 12, (5000, 2)),
+            _boundary_points(vertices, rng)
+        ))
+
+        np.testing.assert_array_equal(
+            gate.points_in_polygon(points[:, 0], points[:, 1], vertices),
+            _contains_points(vertices, points[:, 0], points[:, 1])
+        )
+
+
+def test_points_in_polygon_integer_boundaries(rng):
+    # integer vertices & a grid of integer points hit vertices, horizontal and
+    # vertical edges exactly
+    vertices = np.array([[0, 0], [6, 0], [6, 4], [3, 2], [3, 6], [0, 6]], dtype=np.float64)
+    x, y = np.meshgrid(np.arange(-1, 8, 0.5), np.arange(-1, 8, 0.5))
+    x = x.ravel()
+    y = y.ravel()
+
+    np.testing.assert_array_equal(
+        gate.points_in_polygon(x, y, vertices),
+        _contains_points(vertices, x, y)
+    )
+
+
+def test_points_in_polygon_chunks_and_dtypes(rng):
+    vertices = rng.uniform(0, 100, (7, 2))
+    points = rng.uniform(0, 100, (10001, 2))
+    expected = gate.points_in_polygon(points[:, 0], points[:, 1], vertices)
+
+    np.testing.assert_array_equal(
+        gate.points_in_polygon(points[:, 0], points[:, 1], vertices, chunk_size=97),
+        expected
+    )
+
+    # float32 values are tested in double precision
+    points_32 = points.astype(np.float32)
+    np.testing.assert_array_equal(
+        gate.points_in_polygon(points_32[:, 0], points_32[:, 1], vertices),
+        _contains_points(vertices, points_32[:, 0], points_32[:, 1])
+    )
+
+    assert gate.points_in_polygon(np.empty(0), np.empty(0), vertices).shape == (0,)
+
+
+@pytest.mark.parametrize('vertex_order', [
+    [0, 1, 2, 3], [3, 2, 1, 0], [1, 2, 3, 0], [2, 1, 0, 3]
+])
+def test_rectangle_fast_path_matches_polygon(vertex_order, rng):
+    corners = np.array([[1.0, 2.0], [5.0, 2.0], [5.0, 7.0], [1.0, 7.0]])
+    vertices = corners[vertex_order]
+    bounds = gate.get_rectangle_bounds(vertices)
+
+    assert bounds is not None
+
+    grid_x, grid_y = np.meshgrid(np.arange(0, 8, 0.5), np.arange(0, 9, 0.5))
+    x = np.concatenate((grid_x.ravel(), rng.uniform(0, 8, 1000)))
+    y = np.concatenate((grid_y.ravel(), rng.uniform(0, 9, 1000)))
+
+    np.testing.assert_array_equal(
+        gate.points_in_gate_polygon(x, y, vertices, bounds),
+        gate.points_in_polygon(x, y, vertices)
+    )
+    np.testing.assert_array_equal(
+        gate.points_in_rectangle(x, y, bounds, chunk_size=13),
+        _contains_points(vertices, x, y)
+    )
+
+
+def test_get_rectangle_bounds_rejects_other_polygons():
+    assert gate.get_rectangle_bounds([[0, 0], [2, 0], [3, 2], [0, 2]]) is None
+    assert gate.get_rectangle_bounds([[0, 0], [2, 0], [2, 2]]) is None
+    assert gate.get_rectangle_bounds([[0, 0], [2, 0], [2, 2], [0, 2], [0, 1]]) is None
+
+
+def test_points_in_ranges(rng):
+    columns = [rng.uniform(0, 10, 1000), np.round(rng.uniform(0, 10, 1000))]
+    bounds = [(2.0, 8.0), (None, 5.0)]
+
+    # inclusive minimum, exclusive maximum
+    expected = (columns[0] >= 2) & (columns[0] < 8) & (columns[1] < 5)
+
+    np.testing.assert_array_equal(gate.points_in_ranges(columns, bounds, chunk_size=77), expected)
+    np.testing.assert_array_equal(
+        gate.points_in_gate(columns, {
+            'type': 'Rectangle',
+            'dimensions': [{'label': 'A', 'min': '2', 'max': '8'}, {'label': 'B', 'max': 5}]
+        }),
+        expected
+    )
+
+
+def test_points_in_ellipsoid(rng):
+    points = rng.uniform(-5, 5, (2000, 2))
+    mean = np.array([1.0, -1.0])
+    covariance = np.array([[4.0, 1.5], [1.5, 2.0]])
+    gate_dict = {
+        'type': 'Ellipsoid',
+        'dimensions': ['A', 'B'],
+        'mean': mean.tolist(),
+        'covariance': covariance.tolist(),
+        'distance_square': 3.0
+    }
+
+    diff = points - mean
+    distance = (diff.dot(np.linalg.inv(covariance)) * diff).sum(axis=1)
+
+    np.testing.assert_array_equal(
+        gate.points_in_gate([points[:, 0], points[:, 1]], gate_dict),
+        distance <= 3.0
+    )
+
+    gate_dict['covariance'] = [[1.0]]
+    with pytest.raises(ValueError):
+        gate.get_ellipsoid_parameters(gate_dict)
+
+
+def test_points_in_quadrants():
+    x = np.array([-1.0, 0.0, 1.0, 5.0, 10.0, 12.0])
+    y = np.array([-1.0, 3.0, 3.0, -2.0, 4.0, 0.0])
+    gate_dict = {
+        'type': 'Quad',
+        'dividers': [
+            {'id': 'dx', 'label': 'A', 'values': [10.0, 0.0]},
+            {'id': 'dy', 'label': 'B', 'values': [0.0]}
+        ],
+        'quadrants': [
+            # 0 <= x < 10 and y >= 0, or x >= 10 (any y)
+            {'id': 'Q1', 'locations': {'dx': 5.0, 'dy': 1.0}},
+            {'id': 'Q2', 'locations': {'dx': 10.0}}
+        ]
+    }
+
+    np.testing.assert_array_equal(
+        gate.points_in_gate([x, y], gate_dict),
+        [False, True, True, False, True, True]
+    )
+
+    gate_dict['quadrants'][1]['locations'] = {'dz': 1.0}
+    with pytest.raises(ValueError):
+        gate.get_quadrant_parameters(gate_dict)
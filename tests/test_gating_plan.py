@@ -0,0 +1,235 @@
+import numpy as np
+import pytest
+from flowpy.models import gate
+from flowpy.models.gating_plan import GatingPlan, GatingSummary
+from flowpy.models.profiling import Profiler
+from tests.util import find_populations, make_channel_labels
+
+
+def _polygon_gate(x_axis, y_axis, vertices):
+    return {
+        'type': 'Polygon',
+        'x_axis': x_axis,
+        'y_axis': y_axis,
+        'vertices': [{'x': x, 'y': y} for x, y in vertices]
+    }
+
+
+def _population(gates, children=None):
+    return {'gates': gates, 'children': children or {}}
+
+
+def test_plan_matches_gating_hierarchy(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+    plan = GatingPlan(synthetic_populations, synthetic_sample['channels'])
+    result = plan.apply(events)
+
+    gate.apply_gating_hierarchy(events, synthetic_sample['channels'], synthetic_populations)
+
+    for path, population in find_populations(synthetic_populations):
+        gate_result = population['gates'][0]['result']
+
+        np.testing.assert_array_equal(result.get_mask(path), gate_result['mask'])
+        assert result.get_count(path) == gate_result['count']
+        assert result.get_parent_count(path) == gate_result['ungated_count']
+
+
+def test_plan_is_reusable(synthetic_data, synthetic_sample, synthetic_populations):
+    from flowpy import Sample
+
+    plan = GatingPlan(synthetic_populations, synthetic_sample['channels'])
+    first = plan.apply(synthetic_sample['events'])
+
+    # the plan keeps no per-sample state
+    other_events = np.array(Sample(synthetic_data['fcs_paths'][1]).raw_events, dtype=np.float64)
+    plan.apply(other_events)
+    again = plan.apply(synthetic_sample['events'])
+
+    for path in first.paths:
+        np.testing.assert_array_equal(again.get_mask(path), first.get_mask(path))
+
+    # and doesn't change when the source hierarchy is modified
+    for _, population in find_populations(synthetic_populations, 'Polygon'):
+        population['gates'][0]['vertices'] = population['gates'][0]['vertices'][:3]
+
+    for path in first.paths:
+        np.testing.assert_array_equal(
+            plan.apply(synthetic_sample['events']).get_mask(path),
+            first.get_mask(path)
+        )
+
+
+def test_boolean_nodes_follow_references(rng):
+    channels = make_channel_labels(['A', 'B'])
+    events = rng.uniform(0, 10, (1000, 2))
+    square = [(0, 0), (5, 0), (5, 5), (0, 5)]
+
+    # the boolean population is declared before the populations it references
+    populations = {
+        'Both': _population([{
+            'type': 'Boolean',
+            'specification': 'G0&G1',
+            'groups': ['/P1/P2', '/P3']
+        }]),
+        'P1': _population(
+            [_polygon_gate('A', 'B', [(0, 0), (8, 0), (8, 8), (0, 8)])],
+            {'P2': _population([_polygon_gate('A', 'B', square)])}
+        ),
+        'P3': _population([_polygon_gate('A', 'B', [(2, 2), (10, 2), (10, 10)])])
+    }
+    plan = GatingPlan(populations, channels)
+    order = [node.path for node in plan.nodes]
+
+    # depth-first order is kept wherever the dependencies allow it
+    assert order == ['/P1', '/P1/P2', '/P3', '/Both']
+    assert plan.get_node('/Both').dependencies == frozenset(['/P1/P2', '/P3'])
+    assert plan.get_children(None) == ('/Both', '/P1', '/P3')
+    assert plan.get_dependent_paths(['/P3']) == ('/P3', '/Both')
+
+    result = plan.apply(events)
+    np.testing.assert_array_equal(
+        result.get_mask('/Both'),
+        result.get_mask('/P1/P2') & result.get_mask('/P3')
+    )
+
+
+def test_boolean_circular_references():
+    channels = make_channel_labels(['A', 'B'])
+    populations = {
+        'X': _population([{'type': 'Boolean', 'specification': 'G0', 'groups': ['/Y']}]),
+        'Y': _population([{'type': 'Boolean', 'specification': 'G0', 'groups': ['/X']}])
+    }
+
+    with pytest.raises(ValueError, match='circular'):
+        GatingPlan(populations, channels)
+
+
+def test_plan_errors():
+    channels = make_channel_labels(['A', 'B'])
+    square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+    with pytest.raises(ValueError, match='Channel labels not found'):
+        GatingPlan({'P': _population([_polygon_gate('A', 'C', square)])}, channels)
+
+    mixed = _population([
+        _polygon_gate('A', 'B', square),
+        {'type': 'Boolean', 'specification': 'G0', 'groups': ['/P']}
+    ])
+    with pytest.raises(ValueError, match='single type'):
+        GatingPlan({'Q': mixed}, channels)
+
+
+def test_multiple_regions_and_parent_mask(rng):
+    channels = make_channel_labels(['A', 'B'])
+    events = rng.uniform(0, 10, (2000, 2))
+    parent_mask = rng.uniform(size=2000) < 0.5
+    left = [(0, 0), (3, 0), (3, 10), (0, 10)]
+    right = [(7, 0), (10, 0), (10, 10), (7, 10)]
+
+    plan = GatingPlan(
+        {'P': _population([_polygon_gate('A', 'B', left), _polygon_gate('A', 'B', right)])},
+        channels
+    )
+    result = plan.apply(events, parent_mask=parent_mask)
+
+    left_mask = gate.points_in_polygon(events[:, 0], events[:, 1], np.array(left, dtype=float))
+    right_mask = gate.points_in_polygon(events[:, 0], events[:, 1], np.array(right, dtype=float))
+
+    np.testing.assert_array_equal(
+        result.get_mask('/P'),
+        (left_mask | right_mask) & parent_mask
+    )
+    assert result.get_region_counts('/P') == (
+        np.count_nonzero(left_mask & parent_mask),
+        np.count_nonzero(right_mask & parent_mask)
+    )
+    assert result.get_parent_count('/P') == np.count_nonzero(parent_mask)
+
+
+def test_summary_statistics_with_large_offset(rng):
+    # values with a small spread around a large offset, where accumulating
+    # sums of squares loses all precision
+    channels = make_channel_labels(['A', 'B'])
+    events = 1e8 + rng.normal(0, 0.01, (10000, 2))
+    plan = GatingPlan(
+        {'P': _population([_polygon_gate('A', 'B', [(0, 0), (2e8, 0), (2e8, 2e8)])])},
+        channels
+    )
+    summary = GatingSummary(plan, statistics=True)
+
+    for start in range(0, events.shape[0], 999):
+        chunk = events[start:start + 999]
+        summary.add(plan.apply(chunk), chunk)
+
+    mask = plan.apply(events).get_mask('/P')
+    statistics = summary.statistics_to_dataframe()
+
+    assert summary.event_count == events.shape[0]
+    assert summary.get_count('/P') == np.count_nonzero(mask)
+    np.testing.assert_allclose(statistics['mean'], events[mask].mean(axis=0), rtol=1e-14)
+    np.testing.assert_allclose(statistics['std'], events[mask].std(axis=0), rtol=1e-6)
+
+    with pytest.raises(ValueError):
+        summary.add(plan.apply(events))
+
+
+@pytest.mark.parametrize('max_threads', [2, 4])
+def test_threaded_evaluation_is_identical(synthetic_sample, synthetic_populations, rng, max_threads):
+    events = synthetic_sample['events']
+    parent_mask = rng.uniform(size=events.shape[0]) < 0.7
+    plan = GatingPlan(synthetic_populations, synthetic_sample['channels'])
+    profiler = Profiler(memory=False)
+
+    for mask in (None, parent_mask):
+        expected = plan.apply(events, parent_mask=mask)
+        result = plan.apply(events, parent_mask=mask, max_threads=max_threads, profiler=profiler)
+
+        assert result.paths == expected.paths
+        for path in expected.paths:
+            np.testing.assert_array_equal(result.get_mask(path), expected.get_mask(path))
+            assert result.get_region_counts(path) == expected.get_region_counts(path)
+            assert result.get_parent_count(path) == expected.get_parent_count(path)
+
+    # a gate record for every population
+    gate_names = [r['name'] for r in profiler.records if r['stage'] == 'gate']
+    assert sorted(gate_names) == sorted(2 * expected.paths)
+
+
+def test_threaded_gating_hierarchy(synthetic_sample, synthetic_populations):
+    from copy import deepcopy
+
+    events = synthetic_sample['events']
+    threaded_populations = deepcopy(synthetic_populations)
+
+    gate.apply_gating_hierarchy(events, synthetic_sample['channels'], synthetic_populations)
+    gate.apply_gating_hierarchy(
+        events,
+        synthetic_sample['channels'],
+        threaded_populations,
+        max_threads=3
+    )
+
+    threaded = dict(find_populations(threaded_populations))
+
+    for path, population in find_populations(synthetic_populations):
+        result = population['gates'][0]['result']
+        threaded_result = threaded[path]['gates'][0]['result']
+
+        np.testing.assert_array_equal(threaded_result['mask'], result['mask'])
+        assert threaded_result['count'] == result['count']
+
+
+def test_threaded_errors_propagate(rng):
+    channels = make_channel_labels(['A', 'B'])
+    square = [(0, 0), (5, 0), (5, 5), (0, 5)]
+    plan = GatingPlan(
+        {
+            'P1': _population([_polygon_gate('A', 'B', square)]),
+            'P2': _population([_polygon_gate('A', 'B', square)])
+        },
+        channels
+    )
+
+    # events with too few columns for the gate channels
+    with pytest.raises(IndexError):
+        plan.apply(rng.uniform(size=(100, 1)), max_threads=2)
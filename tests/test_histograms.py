@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+from flowpy import Sample, Workspace
+from flowpy.models import gate
+from flowpy.models.gating_plan import GatingPlan
+from tests.util import find_populations
+
+
+def _expected_histogram(x, y, x_range, y_range, bins):
+    # values outside the ranges are counted in the edge bins
+    histogram, _, _ = np.histogram2d(
+        np.clip(x, x_range[0], x_range[1]),
+        np.clip(y, y_range[0], y_range[1]),
+        bins=bins,
+        range=(x_range, y_range)
+    )
+
+    return histogram
+
+
+def test_bin_indices_match_histogram2d(rng):
+    x = rng.uniform(-100, 1100, 10001)
+    y = rng.normal(500, 300, 10001)
+    x_range, y_range = (0.0, 1000.0), (-200.0, 800.0)
+
+    # blocks smaller than the points
+    bin_indices = gate.get_2d_bin_indices(x, y, x_range, y_range, 32, chunk_size=1000)
+    histogram = np.bincount(bin_indices, minlength=32 * 32).reshape(32, 32)
+
+    np.testing.assert_array_equal(histogram, _expected_histogram(x, y, x_range, y_range, 32))
+
+
+@pytest.mark.parametrize('max_threads', [1, 4])
+def test_apply_histograms(synthetic_sample, synthetic_populations, max_threads):
+    events = synthetic_sample['events']
+    channels = synthetic_sample['channels']
+    plan = GatingPlan(synthetic_populations, channels)
+    label_indices = dict((channels[c]['PnN'], int(c) - 1) for c in channels)
+
+    # a given range for FSC-A, the range of the events for other channels
+    fsc_range = (100.0, 50000.0)
+    result = plan.apply(
+        events,
+        max_threads=max_threads,
+        histogram_bins=64,
+        histogram_ranges={label_indices['FSC-A']: fsc_range}
+    )
+    polygon_paths = set(path for path, _ in find_populations(synthetic_populations, 'Polygon'))
+
+    assert len(polygon_paths) > 0
+
+    for path in result.paths:
+        histograms = result.get_histograms(path)
+
+        if path not in polygon_paths:
+            assert histograms is None or all(h is None for h in histograms)
+            continue
+
+        parent_mask = result.get_parent_mask(path)
+        if parent_mask is None:
+            parent_mask = np.ones(events.shape[0], dtype=np.bool_)
+
+        for histogram, gate_result in zip(histograms, result.get_gate_results(path)):
+            assert gate_result['histogram'] is histogram
+
+            x_index = label_indices[histogram['x_channel']]
+            y_index = label_indices[histogram['y_channel']]
+            ranges = []
+            for index in (x_index, y_index):
+                if index == label_indices['FSC-A']:
+                    ranges.append(fsc_range)
+                else:
+                    ranges.append((events[:, index].min(), events[:, index].max()))
+
+            x_range, y_range = ranges
+
+            np.testing.assert_allclose(histogram['x_edges'], np.linspace(x_range[0], x_range[1], 65))
+            np.testing.assert_allclose(histogram['y_edges'], np.linspace(y_range[0], y_range[1], 65))
+            assert histogram['parent'].dtype == histogram['gated'].dtype == np.int32
+            assert histogram['parent'].sum() == parent_mask.sum()
+            assert histogram['gated'].sum() == gate_result['count']
+
+            parent_events = events[parent_mask]
+            gated_events = events[gate_result['mask']]
+
+            np.testing.assert_array_equal(
+                histogram['parent'],
+                _expected_histogram(
+                    parent_events[:, x_index],
+                    parent_events[:, y_index],
+                    x_range,
+                    y_range,
+                    64
+                )
+            )
+            np.testing.assert_array_equal(
+                histogram['gated'],
+                _expected_histogram(
+                    gated_events[:, x_index],
+                    gated_events[:, y_index],
+                    x_range,
+                    y_range,
+                    64
+                )
+            )
+
+
+def test_histograms_not_computed_by_default(synthetic_sample, synthetic_populations):
+    result = GatingPlan(synthetic_populations, synthetic_sample['channels']).apply(
+        synthetic_sample['events']
+    )
+
+    for path in result.paths:
+        assert result.get_histograms(path) is None
+        assert all('histogram' not in r for r in result.get_gate_results(path))
+
+
+def test_analyze_sample_histograms(synthetic_data):
+    workspace = Workspace(synthetic_data['xml_path'])
+    fcs_path = synthetic_data['fcs_paths'][0]
+    channel_ranges = Sample(fcs_path).get_channel_ranges()
+
+    results = workspace.analyze_sample(fcs_path, None, 'group', 1, histogram_bins=16)
+    gating_result = results['gating_result']
+    channels = gating_result.plan.channel_labels
+    label_indices = dict((channels[c]['PnN'], int(c) - 1) for c in channels)
+    polygon_populations = find_populations(results['populations'], 'Polygon')
+
+    assert len(polygon_populations) > 0
+
+    for path, population in polygon_populations:
+        for gate_dict in population['gates']:
+            histogram = gate_dict['result']['histogram']
+            x_range = channel_ranges[label_indices[histogram['x_channel']]]
+
+            # ranges span 0 to the channel's PnR value
+            assert histogram['x_edges'][0] == 0.0
+            assert histogram['x_edges'][-1] == x_range[1]
+            assert histogram['parent'].shape == (16, 16)
+            assert histogram['gated'].sum() == gate_dict['result']['count']
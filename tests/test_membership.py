@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from flowpy.models.gating_plan import GatingPlan
+from flowpy.models.membership import MembershipMatrix
+
+
+@pytest.fixture
+def gating_result(synthetic_sample, synthetic_populations):
+    # an event count that isn't a multiple of 8
+    events = synthetic_sample['events'][:19997]
+    plan = GatingPlan(synthetic_populations, synthetic_sample['channels'])
+
+    return plan.apply(events)
+
+
+def test_membership_matches_masks(gating_result):
+    membership = gating_result.to_membership_matrix()
+    paths = gating_result.paths
+    expected = np.column_stack([gating_result.get_mask(path) for path in paths])
+
+    assert membership.paths == tuple(paths)
+    assert membership.shape == expected.shape == (19997, len(paths))
+    assert membership.nbytes == len(paths) * 2500
+
+    for path in paths:
+        np.testing.assert_array_equal(membership.get_mask(path), gating_result.get_mask(path))
+        assert membership.get_count(path) == gating_result.get_count(path)
+
+    np.testing.assert_array_equal(membership.to_array(), expected)
+    np.testing.assert_array_equal(
+        membership.to_array(paths[::-1]),
+        expected[:, ::-1]
+    )
+
+    for event_index in (0, 7, 8, 12345, 19996):
+        np.testing.assert_array_equal(
+            membership.get_event_membership(event_index),
+            expected[event_index]
+        )
+
+    with pytest.raises(IndexError):
+        membership.get_event_membership(19997)
+
+
+def test_membership_row_indices(gating_result, rng):
+    event_count = 50000
+    row_indices = np.sort(rng.choice(event_count, gating_result.event_count, replace=False))
+    paths = gating_result.paths[:3]
+
+    membership = gating_result.to_membership_matrix(paths, row_indices, event_count)
+
+    assert membership.shape == (event_count, 3)
+
+    for path in paths:
+        mask = membership.get_mask(path)
+
+        np.testing.assert_array_equal(mask[row_indices], gating_result.get_mask(path))
+        assert np.count_nonzero(mask) == gating_result.get_count(path)
+
+    with pytest.raises(ValueError):
+        gating_result.to_membership_matrix(paths, row_indices)
+
+
+def test_membership_shape_validation():
+    with pytest.raises(ValueError):
+        MembershipMatrix(np.zeros((2, 3), dtype=np.uint8), ['/a', '/b'], 25)
+
+    membership = MembershipMatrix(np.full((1, 4), 255, dtype=np.uint8), ['/a'], 25)
+
+    # padding bits aren't part of the mask
+    assert membership.get_mask('/a').shape == (25,)
+    assert membership.get_mask('/a').all()
+
+
+def test_analyze_sample_membership(synthetic_data):
+    from flowpy import Workspace
+
+    workspace = Workspace(synthetic_data['xml_path'])
+    results = workspace.analyze_sample(
+        synthetic_data['fcs_paths'][0],
+        None,
+        'group',
+        1,
+        membership=True
+    )
+    membership = results['membership']
+    report = results['report']
+
+    for path in membership.paths:
+        parent_path, label = path.rsplit('/', 1)
+        row = report[(report['parent_path'] == 'root' + parent_path) & (report['label'] == label)]
+
+        assert row['count'].sum() == membership.get_count(path)
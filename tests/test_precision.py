@@ -0,0 +1,169 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks import generate
+from flowpy import Sample, Workspace
+from flowpy.models import sample, transforms
+from flowpy.models.cache import SampleCache
+
+COMP_MATRIX = (
+    'FL1-A\tFL2-A\tFL3-A\n'
+    '1\t0.1\t0\n'
+    '0.05\t1\t0.2\n'
+    '0\t0.02\t1\n'
+)
+
+
+def test_get_events_dtype():
+    assert sample.get_events_dtype(None, np.dtype(np.float32)) is None
+    assert sample.get_events_dtype('auto', np.dtype(np.float32)) == np.float32
+    assert sample.get_events_dtype('auto', np.dtype(np.uint32)) == np.float64
+    assert sample.get_events_dtype('auto', np.dtype(np.float64)) == np.float64
+    assert sample.get_events_dtype('float32', np.dtype(np.float64)) == np.float32
+    assert sample.get_events_dtype('float64', np.dtype(np.float32)) == np.float64
+
+    with pytest.raises(ValueError):
+        sample.get_events_dtype('float16', np.dtype(np.float32))
+
+
+def _processed_events(s):
+    s.compensate_events(COMP_MATRIX)
+    s.transform_asinh(pre_scale=0.01)
+
+    return s.events_subsampled, s.events_compensated, s.events_transformed
+
+
+def test_float32_pipeline(synthetic_data):
+    fcs_path = synthetic_data['fcs_paths'][0]
+    reference = _processed_events(Sample(fcs_path, dtype='float64'))
+
+    for dtype in ('float32', 'auto'):
+        s = Sample(fcs_path, dtype=dtype)
+        subsampled, compensated, transformed = _processed_events(s)
+
+        assert s.raw_events.dtype == np.float32
+        assert subsampled.dtype == compensated.dtype == transformed.dtype == np.float32
+
+        # computed in float64 and rounded when stored
+        np.testing.assert_array_equal(subsampled, reference[0])
+        np.testing.assert_allclose(compensated, reference[1], rtol=1e-6, atol=1e-6)
+        np.testing.assert_allclose(transformed, reference[2], rtol=1e-5, atol=1e-6)
+
+    # by default, compensated events keep the float32 dtype, transformed
+    # events are float64
+    subsampled, compensated, transformed = _processed_events(Sample(fcs_path))
+
+    assert subsampled.dtype == compensated.dtype == np.float32
+    assert transformed.dtype == np.float64
+
+    chunks = list(Sample(fcs_path, dtype='float64').iter_event_chunks(7000))
+    assert all(chunk.dtype == np.float64 for chunk in chunks)
+
+
+def test_auto_dtype_of_integer_data(tmp_path, rng):
+    fcs_path = str(tmp_path / 'integer.fcs')
+    events = rng.uniform(0, 1000, (500, 3))
+    generate.write_fcs(fcs_path, [events], 500, ['FSC-A', 'FL1-A', 'Time'], 'I')
+
+    s = Sample(fcs_path, dtype='auto')
+    s.compensate_events(None)
+
+    assert s.events_dtype == np.float64
+    assert s.events_subsampled.dtype == s.events_compensated.dtype == np.float64
+
+
+def test_lookup_transform_dtype(rng):
+    events = rng.uniform(-100, 10000, (1000, 4))
+    transform = transforms.get_logicle_transform()
+
+    transformed_32 = transform.apply_channels(events, [1, 2], np.float32)
+    transformed_64 = transform.apply_channels(events, [1, 2], np.float64)
+
+    assert transformed_32.dtype == np.float32
+    np.testing.assert_array_equal(transformed_32, transformed_64.astype(np.float32))
+
+
+def test_set_dtype(synthetic_data):
+    s = Sample(synthetic_data['fcs_paths'][0], dtype='float32')
+    _, compensated, transformed = _processed_events(s)
+
+    # the same policy keeps the cached events
+    s.set_dtype('auto')
+
+    assert s.events_compensated is compensated
+
+    s.set_dtype('float64')
+
+    assert s.events_compensated.dtype == s.events_transformed.dtype == np.float64
+    np.testing.assert_allclose(s.events_compensated, compensated, rtol=1e-6, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        s.set_dtype('int32')
+
+    assert s.dtype == 'float64'
+
+
+def test_cached_compensation_by_dtype(synthetic_data, tmp_path):
+    cache = SampleCache(str(tmp_path / 'cache'))
+    fcs_path = synthetic_data['fcs_paths'][0]
+
+    for _ in range(2):
+        for dtype in ('float32', 'float64'):
+            s = Sample(fcs_path, cache=cache, dtype=dtype)
+            s.compensate_events(COMP_MATRIX)
+
+            assert s.events_compensated.dtype == dtype
+
+
+def test_analyze_sample_dtype(synthetic_data):
+    workspace = Workspace(synthetic_data['xml_path'])
+    fcs_path = synthetic_data['fcs_paths'][0]
+
+    report = workspace.analyze_sample(fcs_path, None, 'group', 1, dtype='float32')['report']
+    reference = workspace.analyze_sample(fcs_path, None, 'group', 1, dtype='float64')['report']
+
+    pd.testing.assert_frame_equal(report, reference)
+
+
+def test_validate_precision(synthetic_data, monkeypatch):
+    workspace = Workspace(synthetic_data['xml_path'])
+    fcs_paths = synthetic_data['fcs_paths']
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        comparison = workspace.validate_precision(fcs_paths, COMP_MATRIX, 'group', 1)
+
+    assert list(comparison.columns) == [
+        'filename', 'parent_path', 'label', 'type', 'count_float64', 'count', 'difference'
+    ]
+
+    for fcs_path in fcs_paths:
+        reference = workspace.analyze_sample(fcs_path, COMP_MATRIX, 'group', 1, dtype='float64')
+        rows = comparison[comparison['filename'] == reference['filename']]
+
+        assert list(rows['count_float64']) == list(reference['report']['count'])
+        assert (rows['difference'] == rows['count'] - rows['count_float64']).all()
+
+    # a count changed by the dtype policy is reported
+    analyze_sample = Workspace._analyze_sample
+
+    def analyze_float32_differently(self, s, *args):
+        results = analyze_sample(self, s, *args)
+
+        if s.events_dtype == np.float32:
+            results['report'].iloc[0, results['report'].columns.get_loc('count')] += 3
+
+        return results
+
+    monkeypatch.setattr(Workspace, '_analyze_sample', analyze_float32_differently)
+
+    with pytest.warns(UserWarning, match='largest difference: 3 events'):
+        comparison = workspace.validate_precision(fcs_paths[:1], None, 'group', 1)
+
+    assert list(comparison['difference']).count(3) == 1
+
+    empty = workspace.validate_precision([], None, 'group', 1)
+
+    assert len(empty) == 0
+    assert list(empty.columns) == list(comparison.columns)
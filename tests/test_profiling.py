@@ -0,0 +1,95 @@
+import tracemalloc
+import numpy as np
+import pytest
+from flowpy import Workspace
+from flowpy.models import profiling
+
+
+def test_nested_stages():
+    records = []
+    profiler = profiling.Profiler(callback=records.append)
+
+    with profiler.stage('outer', 'a', 10) as outer_stage:
+        with profiler.stage('inner', 'b', 10) as inner_stage:
+            data = np.ones(1000000)
+            inner_stage.events_out = 5
+            del data
+
+        # allocated after the inner stage
+        data = np.ones(500000)
+        del data
+        outer_stage.events_out = 5
+
+    assert not tracemalloc.is_tracing()
+    assert records == profiler.records
+
+    inner, outer = profiler.records
+
+    assert (inner['stage'], inner['name'], inner['depth']) == ('inner', 'b', 1)
+    assert (outer['stage'], outer['name'], outer['depth']) == ('outer', 'a', 0)
+    assert inner['events_in'] == 10 and inner['events_out'] == 5
+    assert inner['succeeded'] and outer['succeeded']
+
+    # peaks include the nested stages
+    assert inner['peak_memory_bytes'] >= 8000000
+    assert outer['peak_memory_bytes'] >= inner['peak_memory_bytes']
+    assert outer['seconds'] >= inner['seconds']
+
+
+def test_failed_stage_and_no_memory():
+    profiler = profiling.Profiler(memory=False)
+
+    with pytest.raises(KeyError):
+        with profiler.stage('fail'):
+            raise KeyError('x')
+
+    record = profiler.records[0]
+
+    assert not record['succeeded']
+    assert record['peak_memory_bytes'] is None
+
+    profiler.add_record('gate', '/P1', 0.5, 10, 3)
+    assert profiler.to_dict()[1]['depth'] == 0
+
+    df = profiler.to_dataframe()
+    assert df['stage'].tolist() == ['fail', 'gate']
+
+    profiler.clear()
+    assert profiler.records == []
+
+
+def test_null_profiler():
+    assert profiling.get_profiler(None) is profiling.NULL_PROFILER
+
+    with profiling.NULL_PROFILER.stage('stage', 'name', 10) as stage:
+        stage.events_out = 3
+
+    assert stage.events_out is None
+
+
+@pytest.mark.parametrize('max_threads', [1, 2])
+def test_analyze_sample_profile(synthetic_data, max_threads):
+    workspace = Workspace(synthetic_data['xml_path'])
+    profiler = profiling.Profiler()
+
+    workspace.analyze_sample(
+        synthetic_data['fcs_paths'][0],
+        None,
+        'group',
+        1,
+        profiler=profiler,
+        max_threads=max_threads
+    )
+    records = profiler.to_dict()
+    stages = [record['stage'] for record in records]
+
+    for stage in ('load', 'subsample', 'compensate', 'gating', 'report', 'analyze_sample'):
+        assert stage in stages
+
+    # a gate stage for each population, nested in the gating stage
+    gate_records = [record for record in records if record['stage'] == 'gate']
+    gating_record = records[stages.index('gating')]
+
+    assert sorted(r['name'] for r in gate_records) == sorted(synthetic_data['population_paths'])
+    assert all(r['depth'] == gating_record['depth'] + 1 for r in gate_records)
+    assert gating_record['events_in'] == records[stages.index('load')]['events_out']
@@ -0,0 +1,142 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from flowpy import Sample, Workspace
+from flowpy.models.result_store import ResultStore
+
+
+def _channel_labels(sample):
+    return [sample.channels[c]['PnN'] for c in sorted(sample.channels, key=int)]
+
+
+@pytest.fixture
+def analyzed(synthetic_data):
+    workspace = Workspace(synthetic_data['xml_path'])
+    analyzed = []
+
+    for fcs_path in synthetic_data['fcs_paths']:
+        results = workspace.analyze_sample(fcs_path, None, 'group', 1)
+        s = Sample(fcs_path)
+        s.compensate_events(None)
+        analyzed.append((results, s))
+
+    return workspace, analyzed
+
+
+def test_round_trip(analyzed, tmp_path):
+    _, analyzed = analyzed
+    store_dir = str(tmp_path / 'store')
+    store = ResultStore(store_dir)
+
+    for i, (results, s) in enumerate(analyzed):
+        assert store.add_sample(results, s.events_compensated, _channel_labels(s)) == i
+
+        # samples are listed as soon as they are added
+        assert len(ResultStore(store_dir).get_samples()) == i + 1
+
+    store = ResultStore(store_dir)
+    samples = store.get_samples()
+
+    assert [entry['sample_id'] for entry in samples] == [0, 1]
+
+    expected_reports = []
+
+    for entry, (results, s) in zip(samples, analyzed):
+        gating_result = results['gating_result']
+        labels = _channel_labels(s)
+
+        assert entry['filename'] == results['filename']
+        assert entry['event_count'] == gating_result.event_count
+        assert entry['channels'] == labels
+        assert entry['paths'] == list(gating_result.paths)
+
+        # the membership is a view of the memory mapped file
+        membership = store.get_membership(entry['sample_id'])
+        assert isinstance(membership.packed.base, np.memmap)
+
+        np.testing.assert_array_equal(store.get_events(entry['sample_id']), s.events_compensated)
+
+        for path in gating_result.paths:
+            mask = gating_result.get_mask(path)
+            np.testing.assert_array_equal(membership.get_mask(path), mask)
+            np.testing.assert_array_equal(
+                store.get_events(entry['sample_id'], ['FL2-A', 'FSC-A'], path),
+                s.events_compensated[mask][:, [labels.index('FL2-A'), labels.index('FSC-A')]]
+            )
+
+        # the row index of the report isn't stored
+        report = results['report'].reset_index(drop=True)
+        report.insert(0, 'filename', results['filename'])
+        expected_reports.append(report)
+
+    pd.testing.assert_frame_equal(
+        store.get_report(),
+        pd.concat(expected_reports, ignore_index=True),
+        check_dtype=False
+    )
+    pd.testing.assert_frame_equal(
+        store.get_report([1]),
+        expected_reports[1],
+        check_dtype=False
+    )
+
+    path = analyzed[0][0]['gating_result'].paths[-1]
+    population_events = list(store.iter_population_events(path, ['SSC-A']))
+
+    assert [(sample_id, filename) for sample_id, filename, _ in population_events] == [
+        (0, analyzed[0][0]['filename']),
+        (1, analyzed[1][0]['filename'])
+    ]
+    for (_, _, events), (results, s) in zip(population_events, analyzed):
+        mask = results['gating_result'].get_mask(path)
+        np.testing.assert_array_equal(events[:, 0], s.events_compensated[mask, 1])
+
+
+def test_errors(analyzed, tmp_path):
+    _, analyzed = analyzed
+    results, s = analyzed[0]
+    store = ResultStore(str(tmp_path / 'store'))
+
+    with pytest.raises(ValueError):
+        store.add_sample(results, s.events_compensated)
+    with pytest.raises(ValueError):
+        store.add_sample(results, s.events_compensated[:-1], _channel_labels(s))
+
+    sample_id = store.add_sample(results, membership=False)
+
+    assert store.get_samples()[0]['channels'] == []
+
+    with pytest.raises(ValueError):
+        store.get_membership(sample_id)
+    with pytest.raises(ValueError):
+        store.get_events(sample_id, ['FSC-A'])
+    with pytest.raises(KeyError):
+        store.get_events(sample_id + 1)
+
+
+def test_store_many(analyzed, synthetic_data, tmp_path):
+    workspace, analyzed = analyzed
+    store = ResultStore(str(tmp_path / 'store'))
+    missing_path = str(tmp_path / 'missing.fcs')
+
+    failures = workspace.store_many(
+        [synthetic_data['fcs_paths'][0], missing_path, synthetic_data['fcs_paths'][1]],
+        None,
+        'group',
+        1,
+        store,
+        include_events=True
+    )
+
+    assert list(failures) == [missing_path]
+    assert [entry['filename'] for entry in store.get_samples()] == [
+        os.path.basename(p) for p in synthetic_data['fcs_paths']
+    ]
+
+    for entry, (results, s) in zip(store.get_samples(), analyzed):
+        np.testing.assert_array_equal(store.get_events(entry['sample_id']), s.events_compensated)
+
+        membership = store.get_membership(entry['sample_id'])
+        for path in results['gating_result'].paths:
+            assert membership.get_count(path) == results['gating_result'].get_count(path)
@@ -0,0 +1,212 @@
+import numpy as np
+import pytest
+from benchmarks import generate
+from flowpy import Sample
+
+COMPENSATION_MATRIX = (
+    'FL1-A\tFL2-A\tFL3-A\n'
+    '1\t0.1\t0\n'
+    '0.05\t1\t0.2\n'
+    '0\t0\t1\n'
+)
+
+
+@pytest.fixture
+def sample(synthetic_data):
+    return Sample(synthetic_data['fcs_paths'][0])
+
+
+def test_pipeline_stages_are_lazy_and_cached(sample):
+    assert sample.events_compensated is None
+    assert sample.events_transformed is None
+
+    with pytest.raises(ValueError):
+        sample.transform_asinh()
+
+    sample.compensate_events(COMPENSATION_MATRIX)
+    sample.transform_asinh(pre_scale=0.01)
+
+    # nothing is computed until the events are accessed
+    assert sample._stage_events == {}
+
+    compensated = sample.events_compensated
+    transformed = sample.events_transformed
+
+    assert sample.events_compensated is compensated
+    assert sample.events_transformed is transformed
+
+    # setting the same parameters keeps the cached events
+    sample.generate_subsample(0, 1)
+    sample.compensate_events(COMPENSATION_MATRIX)
+    sample.transform_asinh(pre_scale=0.01)
+
+    assert sample.events_compensated is compensated
+    assert sample.events_transformed is transformed
+
+
+def test_transform_change_only_recomputes_transform(sample):
+    sample.compensate_events(COMPENSATION_MATRIX)
+    sample.transform_asinh(pre_scale=0.01)
+    compensated = sample.events_compensated
+    transformed = sample.events_transformed
+
+    sample.transform_asinh(pre_scale=0.1)
+
+    assert sample.events_compensated is compensated
+    assert sample.events_transformed is not transformed
+
+    # computed in float64 from the (float32) compensated events
+    fluoro_indices = [2, 3, 4]
+    np.testing.assert_allclose(
+        sample.events_transformed[:, fluoro_indices],
+        np.arcsinh(compensated[:, fluoro_indices].astype(np.float64) * 0.1),
+        rtol=1e-12
+    )
+
+
+def test_upstream_change_invalidates_downstream_stages(sample):
+    sample.compensate_events(None)
+    sample.transform_asinh(pre_scale=0.01)
+    identity_compensated = sample.events_compensated
+    identity_transformed = sample.events_transformed
+
+    # identity compensation (no spillover in the metadata)
+    np.testing.assert_array_equal(identity_compensated, sample.raw_events)
+
+    sample.compensate_events(COMPENSATION_MATRIX)
+
+    assert sample.events_compensated is not identity_compensated
+    assert sample.events_transformed is not identity_transformed
+    assert not np.array_equal(sample.events_compensated, identity_compensated)
+
+    compensated = sample.events_compensated
+    sample.generate_subsample(1000, 2)
+
+    assert sample.events_compensated.shape[0] == 1000
+    np.testing.assert_array_equal(
+        sample.events_compensated,
+        compensated[sample.subsample_indices]
+    )
+    assert sample.events_transformed.shape[0] == 1000
+
+
+@pytest.fixture(scope='module')
+def scatter_sample_path(tmp_path_factory):
+    """
+    FCS file with some negative scatter values and an uneven event rate over
+    time
+    """
+    rng = np.random.RandomState(3)
+    event_count = 20000
+    events = rng.normal(100, 60, (event_count, 4))
+    events[:, 3] = np.sort(rng.exponential(100, event_count))
+
+    fcs_path = str(tmp_path_factory.mktemp('scatter') / 'scatter.fcs')
+    generate.write_fcs(fcs_path, [events], event_count, ['FSC-A', 'SSC-A', 'FL1-A', 'Time'])
+
+    return fcs_path
+
+
+def _legacy_shuffle_indices(sample, subsample_count, random_seed, filter_neg_scatter):
+    indices = np.arange(sample.event_count)
+
+    if filter_neg_scatter:
+        indices = np.delete(indices, np.flatnonzero((sample.raw_events[:, :2] < 0).any(axis=1)))
+
+    if subsample_count <= 0 or subsample_count >= indices.shape[0]:
+        return indices
+
+    rng = np.random.RandomState()
+    rng.seed(random_seed)
+    rng.shuffle(indices)
+
+    return np.sort(indices[:subsample_count])
+
+
+@pytest.mark.parametrize('subsample_count', [0, 500, 19000, 25000])
+@pytest.mark.parametrize('filter_neg_scatter', [False, True])
+def test_subsample_shuffle_matches_legacy_indices(
+        scatter_sample_path,
+        subsample_count,
+        filter_neg_scatter
+):
+    sample = Sample(scatter_sample_path)
+    sample.generate_subsample(subsample_count, 7, filter_neg_scatter=filter_neg_scatter)
+
+    np.testing.assert_array_equal(
+        sample.subsample_indices,
+        _legacy_shuffle_indices(sample, subsample_count, 7, filter_neg_scatter)
+    )
+    np.testing.assert_array_equal(
+        sample.events_subsampled,
+        sample.raw_events[sample.subsample_indices]
+    )
+
+
+@pytest.mark.parametrize('method', ['choice', 'time_stratified'])
+def test_subsample_methods(scatter_sample_path, method):
+    sample = Sample(scatter_sample_path)
+    is_negative = (sample.raw_events[:, :2] < 0).any(axis=1)
+
+    sample.generate_subsample(3000, 11, filter_neg_scatter=True, method=method)
+    indices = sample.subsample_indices
+
+    assert indices.shape[0] == sample.subsample_count == 3000
+    assert (np.diff(indices) > 0).all()
+    assert not is_negative[indices].any()
+
+    # reproducible for a seed
+    other = Sample(scatter_sample_path)
+    other.generate_subsample(3000, 11, filter_neg_scatter=True, method=method)
+    np.testing.assert_array_equal(other.subsample_indices, indices)
+
+    # all valid events if more are requested
+    other.generate_subsample(30000, 11, filter_neg_scatter=True, method=method)
+    np.testing.assert_array_equal(other.subsample_indices, np.flatnonzero(~is_negative))
+
+
+def test_subsample_time_stratified_proportions(scatter_sample_path):
+    sample = Sample(scatter_sample_path)
+    sample.generate_subsample(2000, 5, method='time_stratified', time_bins=10)
+
+    time_values = sample.raw_events[:, 3]
+    bin_edges = np.linspace(time_values.min(), time_values.max(), 11)
+    bin_edges[-1] = np.inf
+    expected = np.histogram(time_values, bin_edges)[0] * (2000.0 / sample.event_count)
+    counts = np.histogram(time_values[sample.subsample_indices], bin_edges)[0]
+
+    # each bin is sampled in proportion to its event count
+    assert counts.sum() == 2000
+    assert (np.abs(counts - expected) < 1).all()
+
+
+def test_subsample_errors(synthetic_data, tmp_path):
+    sample = Sample(synthetic_data['fcs_paths'][0])
+
+    with pytest.raises(ValueError):
+        sample.generate_subsample(100, 1, method='reservoir')
+
+    fcs_path = str(tmp_path / 'no_time.fcs')
+    generate.write_fcs(fcs_path, [np.ones((10, 2))], 10, ['FSC-A', 'FL1-A'])
+
+    with pytest.raises(ValueError):
+        Sample(fcs_path).generate_subsample(5, 1, method='time_stratified')
+
+
+def test_track_indices(synthetic_data, tmp_path):
+    from flowpy.models.cache import SampleCache
+
+    fcs_path = synthetic_data['fcs_paths'][0]
+    sample = Sample(fcs_path)
+    cache = SampleCache(str(tmp_path / 'cache'))
+
+    # from the file, and copied from the memory mapped cache
+    for _ in range(2):
+        indexed = Sample(fcs_path, track_indices=True, cache=cache)
+
+        assert indexed.raw_events.dtype == sample.raw_events.dtype
+        assert not isinstance(indexed.raw_events, np.memmap)
+        np.testing.assert_array_equal(indexed.raw_events[:, 0], np.arange(sample.event_count))
+        np.testing.assert_array_equal(indexed.raw_events[:, 1:], sample.raw_events)
+        assert indexed.channels['1'] == {'PnN': 'Index'}
+        assert indexed.channels['2'] == sample.channels['1']
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from flowpy import Workspace
+from flowpy.models import gate
+from flowpy.models.gating_plan import GatingPlan
+from flowpy.models.profiling import Profiler
+from flowpy.models.session import GatingSession
+from tests.util import find_populations
+
+
+def _referenced_path(populations):
+    # a polygon population referenced by a boolean gate, with children
+    referenced = set()
+    for _, population in find_populations(populations, 'Boolean'):
+        referenced.update(population['gates'][0]['groups'])
+
+    for path, population in find_populations(populations, 'Polygon'):
+        if path in referenced and len(population['children']) > 0:
+            return path
+
+    return sorted(referenced)[0]
+
+
+def _edited_gate(populations, path):
+    gate_dict = dict(gate.find_population(populations, path)['gates'][0])
+    vertices = gate.get_polygon_vertices(gate_dict)
+
+    # shrink the polygon towards its centroid
+    vertices = vertices.mean(axis=0) + 0.7 * (vertices - vertices.mean(axis=0))
+    gate_dict['vertices'] = [{'x': repr(x), 'y': repr(y)} for x, y in vertices]
+
+    return gate_dict
+
+
+def test_set_gate_matches_full_gating(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+    channels = synthetic_sample['channels']
+    path = _referenced_path(synthetic_populations)
+    gate_dict = _edited_gate(synthetic_populations, path)
+
+    profiler = Profiler(memory=False)
+    session = GatingSession(GatingPlan(synthetic_populations, channels), events, profiler=profiler)
+    previous = session.result
+    profiler.clear()
+
+    updated_paths = session.set_gate(path, gate_dict)
+
+    # the edited population, its descendants and the referencing booleans
+    expected_paths = set(p for p in previous.paths if p == path or p.startswith(path + '/'))
+    for boolean_path, population in find_populations(synthetic_populations, 'Boolean'):
+        if expected_paths.intersection(population['gates'][0]['groups']):
+            expected_paths.add(boolean_path)
+
+    assert set(updated_paths) == expected_paths
+    assert sorted(r['name'] for r in profiler.records) == sorted(expected_paths)
+
+    gate.find_population(synthetic_populations, path)['gates'] = [gate_dict]
+    expected = GatingPlan(synthetic_populations, channels).apply(events)
+
+    assert session.get_gates(path) == [gate_dict]
+    assert session.to_dataframe().equals(expected.to_dataframe())
+
+    for p in expected.paths:
+        np.testing.assert_array_equal(session.get_mask(p), expected.get_mask(p))
+        assert session.get_count(p) == expected.get_count(p)
+
+        # untouched populations share the previous masks
+        if p not in expected_paths:
+            assert session.get_mask(p) is previous.get_mask(p)
+
+    assert not np.array_equal(session.get_mask(path), previous.get_mask(path))
+
+
+def test_failed_edit_keeps_session(synthetic_sample, synthetic_populations):
+    session = GatingSession(
+        GatingPlan(synthetic_populations, synthetic_sample['channels']),
+        synthetic_sample['events']
+    )
+    plan, result = session.plan, session.result
+    path = _referenced_path(synthetic_populations)
+    gate_dict = dict(session.get_gates(path)[0], x_axis='missing')
+
+    with pytest.raises(ValueError):
+        session.set_gate(path, gate_dict)
+    with pytest.raises(KeyError):
+        session.set_gates('/missing', [gate_dict])
+
+    assert session.plan is plan and session.result is result
+
+
+def test_reapply_validation(synthetic_sample, synthetic_populations, rng):
+    events = synthetic_sample['events']
+    plan = GatingPlan(synthetic_populations, synthetic_sample['channels'])
+    result = plan.apply(events)
+
+    with pytest.raises(ValueError):
+        plan.reapply(events[:-1], result, [result.paths[0]])
+
+    other_populations = dict(synthetic_populations)
+    other_populations.pop(sorted(other_populations)[0])
+    other_plan = GatingPlan(other_populations, synthetic_sample['channels'])
+
+    with pytest.raises(ValueError):
+        other_plan.reapply(events, result, [other_plan.nodes[0].path])
+
+    # reapplying keeps the parent mask of the result
+    parent_mask = rng.uniform(size=events.shape[0]) < 0.5
+    masked = plan.apply(events, parent_mask)
+    reapplied = plan.reapply(events, masked, [plan.nodes[0].path])
+
+    for path in masked.paths:
+        np.testing.assert_array_equal(reapplied.get_mask(path), masked.get_mask(path))
+
+
+def test_workspace_session(synthetic_data):
+    workspace = Workspace(synthetic_data['xml_path'])
+    fcs_path = synthetic_data['fcs_paths'][1]
+
+    session = workspace.create_session(fcs_path, None, 'group', 1, max_threads=2)
+    report = workspace.analyze_sample(fcs_path, None, 'group', 1)['report']
+
+    assert session.to_dataframe().equals(report)
@@ -0,0 +1,177 @@
+import numpy as np
+import pytest
+from flowpy.models import statistics
+from flowpy.models.gating_plan import GatingPlan
+
+
+def _expected_statistics(events, mask, channel_indices, quantiles):
+    values = events[mask][:, channel_indices]
+
+    if values.shape[0] == 0:
+        return None
+
+    positive_log_means = []
+    for column in values.T.astype(np.float64):
+        positive = column[column > 0]
+        positive_log_means.append(np.log(positive).mean() if positive.shape[0] > 0 else np.nan)
+
+    mean = values.mean(axis=0, dtype=np.float64)
+
+    return {
+        'mean': mean,
+        'median': np.median(values, axis=0),
+        'geometric_mean': np.exp(positive_log_means),
+        'cv': 100.0 * values.std(axis=0, dtype=np.float64) / np.abs(mean),
+        'quantiles': np.quantile(values, quantiles, axis=0)
+    }
+
+
+def _check_statistics(events, masks, channel_indices, quantiles, rtol):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = statistics.compute_population_statistics(events, masks, channel_indices, quantiles)
+
+    assert stats['quantiles'].shape == (len(masks), len(quantiles), len(channel_indices))
+
+    for i, mask in enumerate(masks):
+        assert stats['count'][i] == np.count_nonzero(mask)
+
+        expected = _expected_statistics(events, mask, channel_indices, quantiles)
+        if expected is None:
+            for name in ('mean', 'median', 'geometric_mean', 'cv', 'quantiles'):
+                assert np.isnan(stats[name][i]).all()
+            continue
+
+        for name, expected_values in expected.items():
+            np.testing.assert_allclose(stats[name][i], expected_values, rtol=rtol, err_msg=name)
+
+
+@pytest.fixture
+def events(rng):
+    events = rng.normal(1000, 400, (5000, 6))
+    # a channel without positive values
+    events[:, 4] = -np.abs(events[:, 4])
+
+    return events
+
+
+@pytest.fixture
+def masks(rng):
+    return [
+        rng.uniform(size=5000) < 0.3,
+        rng.uniform(size=5000) < 0.001,
+        np.zeros(5000, dtype=np.bool_),
+        np.ones(5000, dtype=np.bool_)
+    ]
+
+
+@pytest.mark.parametrize('layout', ['c', 'fortran', 'column_slice', 'float32'])
+def test_statistics_match_numpy(events, masks, layout):
+    rtol = 1e-10
+
+    if layout == 'fortran':
+        events = np.asfortranarray(events)
+    elif layout == 'column_slice':
+        events = np.hstack((events, events))[:, ::2]
+    elif layout == 'float32':
+        events = events.astype(np.float32)
+        rtol = 1e-5
+
+    _check_statistics(events, masks, [5, 0, 4, 2], (0.05, 0.25, 0.95), rtol)
+    _check_statistics(events, masks, list(range(6)), (), rtol)
+
+
+def test_statistics_blocks(events, masks, monkeypatch):
+    # many event blocks, and fewer values than a population's channels per
+    # quantile block
+    monkeypatch.setattr(statistics, 'STATISTICS_BLOCK_SIZE', 3000)
+
+    _check_statistics(events, masks, [1, 3, 5, 0, 2], (0.1, 0.9), 1e-10)
+
+
+def test_statistics_large_offset(rng, masks):
+    # a small spread around a large mean, the variance isn't cancelled out
+    events = rng.normal(1e6, 1.0, (5000, 3))
+
+    _check_statistics(events, masks, [0, 1, 2], (), 1e-8)
+
+
+def test_statistics_without_median(events, masks, monkeypatch):
+    expected = statistics.compute_population_statistics(events, masks)
+
+    def fail(*args):
+        raise AssertionError("population events were gathered")
+
+    monkeypatch.setattr(statistics, '_population_quantiles', fail)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = statistics.compute_population_statistics(events, masks, median=False)
+
+    assert 'median' not in stats
+    assert stats['quantiles'].shape == (len(masks), 0, 6)
+    for name in ('count', 'mean', 'geometric_mean', 'cv'):
+        np.testing.assert_array_equal(stats[name], expected[name])
+
+
+def test_result_statistics_dataframe(synthetic_sample, synthetic_populations):
+    events = synthetic_sample['events']
+    channels = synthetic_sample['channels']
+    result = GatingPlan(synthetic_populations, channels).apply(events)
+
+    df = result.statistics_to_dataframe(events, quantiles=(0.95,), channels=['FL1-A', 'FSC-A'])
+
+    assert list(df.columns) == [
+        'parent_path', 'label', 'channel', 'count', 'mean', 'median', 'geometric_mean', 'cv',
+        'quantile_0.95'
+    ]
+    assert len(df) == 2 * len(result.paths)
+
+    label_indices = dict((channels[c]['PnN'], int(c) - 1) for c in channels)
+
+    for _, row in df.iterrows():
+        path = row['parent_path'][len('root'):] + '/' + row['label']
+        values = events[result.get_mask(path), label_indices[row['channel']]]
+
+        assert row['count'] == values.shape[0]
+        if values.shape[0] > 0:
+            np.testing.assert_allclose(row['mean'], values.mean())
+            np.testing.assert_allclose(row['median'], np.median(values))
+            np.testing.assert_allclose(row['quantile_0.95'], np.quantile(values, 0.95))
+
+    df = result.statistics_to_dataframe(events, channels=['SSC-A'], median=False)
+
+    assert list(df.columns) == [
+        'parent_path', 'label', 'channel', 'count', 'mean', 'geometric_mean', 'cv'
+    ]
+
+    with pytest.raises(ValueError):
+        result.statistics_to_dataframe(events[:-1])
+    with pytest.raises(ValueError):
+        result.statistics_to_dataframe(events, channels=['missing'])
+
+
+def test_analyze_sample_statistics(synthetic_data):
+    from flowpy import Sample, Workspace
+
+    workspace = Workspace(synthetic_data['xml_path'])
+    fcs_path = synthetic_data['fcs_paths'][0]
+
+    results = workspace.analyze_sample(
+        fcs_path,
+        None,
+        'group',
+        1,
+        membership=True,
+        statistics='raw'
+    )
+    raw_events = Sample(fcs_path).raw_events
+    membership = results['membership']
+    df = results['statistics']
+
+    first_path = membership.paths[0]
+    rows = df[(df['parent_path'] == 'root') & (df['label'] == first_path[1:])]
+
+    np.testing.assert_allclose(
+        rows['mean'],
+        raw_events[membership.get_mask(first_path)].mean(axis=0, dtype=np.float64),
+        rtol=1e-10
+    )
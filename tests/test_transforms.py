@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+from flowpy import Sample
+from flowpy.models import transforms
+
+
+def _data_values(rng, t):
+    # random values, the table grid points & midpoints near 0 and the ends
+    grid = np.linspace(-t, t, transforms.LOOKUP_TABLE_SIZE)
+    step = grid[1] - grid[0]
+
+    return np.concatenate((
+        rng.uniform(-t, t, 200000),
+        rng.uniform(-100, 100, 10000),
+        grid[:1000] + step / 2,
+        grid[-1000:] - step / 2,
+        [-t, 0.0, t]
+    ))
+
+
+@pytest.mark.parametrize('t, w, m, a', [
+    (262144, 0.5, 4.5, 0),
+    (262144, 1.0, 4.5, 0.5),
+    (10000, 0.0, 4.0, 0)
+])
+def test_logicle_lookup_within_max_error(rng, t, w, m, a):
+    transform = transforms.LogicleTransform(t, w, m, a)
+    x = _data_values(rng, t)
+
+    error = np.abs(transform.apply(x) - transform.apply_exact(x))
+
+    assert error.max() <= transform.max_error * (1 + 1e-6)
+    np.testing.assert_allclose(transform.inverse(transform.apply_exact(x)), x, atol=1e-6 * t)
+
+    # top of scale is 1 and data value 0 is at w / (m + a) above the bottom
+    np.testing.assert_allclose(
+        transform.apply_exact([0.0, t]),
+        [(w + a) / (m + a), 1.0],
+        atol=1e-12
+    )
+
+
+def test_logicle_default_max_error():
+    transform = transforms.get_logicle_transform()
+
+    assert transform is transforms.get_logicle_transform(262144.0, 0.5)
+    assert transform.max_error < 1e-6
+
+    # a smaller table has a larger but still bounded error
+    small = transforms.LogicleTransform(table_size=1024)
+    x = np.linspace(-262144, 262144, 100003)
+
+    assert small.max_error > transform.max_error
+    assert np.abs(small.apply(x) - small.apply_exact(x)).max() <= small.max_error * (1 + 1e-6)
+
+
+def test_logicle_outside_table(rng):
+    transform = transforms.get_logicle_transform()
+    x = np.array([-1e6, -262145.0, 262145.0, 5e6])
+
+    np.testing.assert_array_equal(transform.apply(x), transform.apply_exact(x))
+    np.testing.assert_allclose(transform.inverse(transform.apply(x)), x, rtol=1e-9)
+
+
+def test_logicle_matches_flowutils(rng):
+    flowutils = pytest.importorskip('flowutils')
+    events = rng.uniform(-262144, 262144, (10000, 3))
+    transform = transforms.get_logicle_transform()
+
+    expected = flowutils.transforms.logicle(events, [0, 2], t=262144, w=0.5)
+
+    np.testing.assert_allclose(transform.apply_exact(events[:, 0]), expected[:, 0], atol=1e-12)
+    np.testing.assert_allclose(
+        transform.apply_channels(events, [0, 2]),
+        expected,
+        atol=transform.max_error
+    )
+
+
+@pytest.mark.parametrize('parameters', [
+    {'t': 0}, {'m': 0}, {'w': -1}, {'w': 3}, {'a': -1}, {'a': 4}
+])
+def test_logicle_parameter_validation(parameters):
+    with pytest.raises(ValueError):
+        transforms.LogicleTransform(**parameters)
+
+
+def test_asinh(rng):
+    transform = transforms.get_asinh_transform(0.01)
+    events = rng.uniform(-1000, 1000, (1000, 3))
+
+    assert transform is transforms.get_asinh_transform(0.01)
+    assert transform.max_error == 0
+
+    transformed = transform.apply_channels(events, [1], np.float32)
+
+    assert transformed.dtype == np.float32
+    np.testing.assert_array_equal(transformed[:, [0, 2]], events[:, [0, 2]].astype(np.float32))
+    np.testing.assert_allclose(transformed[:, 1], np.arcsinh(events[:, 1] * 0.01), rtol=1e-6)
+    np.testing.assert_allclose(transform.inverse(transform.apply(events[:, 1])), events[:, 1])
+
+    with pytest.raises(ValueError):
+        transforms.AsinhTransform(0)
+
+
+def test_transform_vertices():
+    logicle = transforms.get_logicle_transform()
+    asinh = transforms.get_asinh_transform()
+    vertices = np.array([[100.0, -50.0], [20000.0, 300.0], [0.0, 1000.0]])
+
+    transformed = transforms.transform_vertices(vertices, logicle, asinh)
+
+    np.testing.assert_array_equal(transformed[:, 0], logicle.apply_exact(vertices[:, 0]))
+    np.testing.assert_array_equal(transformed[:, 1], asinh.apply_exact(vertices[:, 1]))
+    np.testing.assert_allclose(
+        transforms.transform_vertices(transformed, logicle, asinh, inverse=True),
+        vertices,
+        atol=1e-8
+    )
+    np.testing.assert_array_equal(
+        transforms.transform_vertices(vertices, y_transform=asinh)[:, 0],
+        vertices[:, 0]
+    )
+
+
+def test_sample_logicle_lookup(synthetic_data):
+    pytest.importorskip('flowutils')
+    sample = Sample(synthetic_data['fcs_paths'][0])
+    sample.compensate_events(None)
+
+    sample.transform_logicle()
+    exact = sample.events_transformed
+    sample.transform_logicle(lookup=True)
+    lookup = sample.events_transformed
+
+    assert lookup is not exact
+    np.testing.assert_allclose(lookup, exact, atol=transforms.get_logicle_transform().max_error)
@@ -0,0 +1,445 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from flowpy import Sample, Workspace
+
+
+@pytest.fixture
+def workspace(synthetic_data):
+    return Workspace(synthetic_data['xml_path'])
+
+
+def _report_values(report):
+    return report[['parent_path', 'label', 'parent_count', 'count']].values.tolist()
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_analyze_many_matches_analyze_sample(workspace, synthetic_data, max_workers):
+    fcs_paths = synthetic_data['fcs_paths']
+    missing_path = os.path.join(os.path.dirname(fcs_paths[0]), 'missing.fcs')
+
+    results = workspace.analyze_many(
+        [fcs_paths[1], missing_path, fcs_paths[0]],
+        None,
+        'group',
+        1,
+        max_workers=max_workers
+    )
+
+    # a failing sample is recorded without aborting the batch
+    assert [f[:2] for f in results['failures']] == [(1, missing_path)]
+
+    # reports are combined in the given order
+    report = results['report']
+    assert report['filename'].unique().tolist() == [
+        os.path.basename(fcs_paths[1]),
+        os.path.basename(fcs_paths[0])
+    ]
+
+    for fcs_path in fcs_paths:
+        expected = workspace.analyze_sample(fcs_path, None, 'group', 1)['report']
+        sample_report = report[report['filename'] == os.path.basename(fcs_path)]
+
+        assert _report_values(sample_report) == _report_values(expected)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_analyze_many_iterator_and_repeated_paths(workspace, synthetic_data, max_workers):
+    fcs_paths = synthetic_data['fcs_paths']
+    paths = [fcs_paths[0], fcs_paths[1], fcs_paths[0]]
+
+    results = workspace.analyze_many(
+        (p for p in paths),
+        None,
+        'group',
+        1,
+        max_workers=max_workers
+    )
+    single = workspace.analyze_sample(fcs_paths[0], None, 'group', 1)['report']
+
+    assert results['failures'] == []
+    assert len(results['report']) == 3 * len(single)
+    assert results['report']['filename'].tolist() == [
+        os.path.basename(p) for p in paths for _ in range(len(single))
+    ]
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_analyze_many_repeated_failures(workspace, synthetic_data, max_workers):
+    fcs_path = synthetic_data['fcs_paths'][0]
+    missing_path = os.path.join(os.path.dirname(fcs_path), 'missing.fcs')
+
+    results = workspace.analyze_many(
+        [missing_path, fcs_path, missing_path],
+        None,
+        'group',
+        1,
+        max_workers=max_workers
+    )
+
+    # every failure of a repeated path is kept
+    assert [f[:2] for f in results['failures']] == [(0, missing_path), (2, missing_path)]
+    assert all(len(f[2]) > 0 for f in results['failures'])
+    assert results['report']['filename'].unique().tolist() == [os.path.basename(fcs_path)]
+
+
+def test_iter_analyze_many(workspace, synthetic_data):
+    fcs_paths = synthetic_data['fcs_paths']
+
+    results = list(workspace.iter_analyze_many(fcs_paths, None, 'group', 1, max_workers=2))
+
+    assert sorted(r[0] for r in results) == sorted(fcs_paths)
+    for fcs_path, report, error in results:
+        assert error is None
+        assert _report_values(report) == _report_values(
+            workspace.analyze_sample(fcs_path, None, 'group', 1)['report']
+        )
+
+
+def test_analyze_group(workspace, synthetic_data):
+    fcs_dir = os.path.dirname(synthetic_data['fcs_paths'][0])
+
+    results = workspace.analyze_group(1, fcs_dir, None, max_workers=1)
+    expected = workspace.analyze_many(synthetic_data['fcs_paths'], None, 'group', 1, max_workers=1)
+
+    assert results['failures'] == []
+    pd.testing.assert_frame_equal(results['report'], expected['report'])
+
+    # group samples that aren't loaded are reported
+    sample_id = workspace.groups['1']['samples'][0]
+    del workspace.samples[sample_id]
+
+    with pytest.warns(UserWarning, match=sample_id):
+        results = workspace.analyze_group(1, fcs_dir, None, max_workers=1)
+
+    assert len(results['report']) == len(expected['report']) // 2
+
+
+@pytest.mark.parametrize('chunk_size', [7000, 1000000])
+def test_analyze_sample_streaming(workspace, synthetic_data, chunk_size):
+    fcs_path = synthetic_data['fcs_paths'][0]
+
+    results = workspace.analyze_sample_streaming(
+        fcs_path,
+        None,
+        'group',
+        1,
+        chunk_size=chunk_size,
+        statistics=True
+    )
+    expected = workspace.analyze_sample(fcs_path, None, 'group', 1, membership=True)
+
+    pd.testing.assert_frame_equal(results['report'], expected['report'])
+
+    # statistics of the compensated events of each population
+    s = Sample(fcs_path)
+    s.compensate_events(None)
+    events = np.asarray(s.events_compensated, dtype=np.float64)
+    membership = expected['membership']
+    statistics = results['statistics']
+
+    for path in membership.paths:
+        parent_path, label = path.rsplit('/', 1)
+        rows = statistics[
+            (statistics['parent_path'] == 'root' + parent_path) & (statistics['label'] == label)
+        ]
+        population_events = events[membership.get_mask(path)]
+
+        assert (rows['count'] == population_events.shape[0]).all()
+        if population_events.shape[0] == 0:
+            assert rows['mean'].isnull().all()
+            continue
+
+        np.testing.assert_allclose(rows['mean'], population_events.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(rows['std'], population_events.std(axis=0), rtol=1e-10)
+        np.testing.assert_array_equal(rows['min'], population_events.min(axis=0))
+        np.testing.assert_array_equal(rows['max'], population_events.max(axis=0))
+
+
+def _population_xml(name, x_label='FL1-A', y_label='FL2-A'):
+    return (
+        '<Population nodeName="%s"><PolygonGate><Polygon xAxisName="%s" yAxisName="%s">'
+        '<Vertex x="0" y="0" /><Vertex x="1" y="0" /><Vertex x="1" y="1" />'
+        '</Polygon></PolygonGate></Population>'
+    ) % (name, x_label, y_label)
+
+
+def _group_xml(group_id, sample_ids, populations_xml):
+    refs = ''.join('<SampleRef sampleID="%s" />' % s_id for s_id in sample_ids)
+
+    return (
+        '<GroupNode groupID="%s" nodeName="Group %s"><Group><SampleRefs>%s</SampleRefs>'
+        '</Group>%s</GroupNode>'
+    ) % (group_id, group_id, refs, populations_xml)
+
+
+@pytest.fixture(scope='module')
+def indexed_workspace_path(tmp_path_factory):
+    samples = [('1', 'a.fcs', 'A'), ('2', 'b.fcs', ''), ('3', 'a.fcs', 'A2'), ('4', '', '')]
+    sample_xml = ''.join(
+        '<Sample eventCount="100" sampleID="%s"><SampleNode nodeName="%s">%s</SampleNode>'
+        '</Sample>' % (s_id, filename, _population_xml(label) if label else '')
+        for s_id, filename, label in samples
+    )
+    groups_xml = ''.join([
+        _group_xml('1', ['1', '2'], _population_xml('G1')),
+        _group_xml('2', ['2', '3'], _population_xml('G2')),
+        _group_xml('3', ['1'], ''),
+        _group_xml('4', ['1', '3'], _population_xml('G4'))
+    ])
+
+    xml_path = str(tmp_path_factory.mktemp('workspace') / 'indexed.xml')
+    with open(xml_path, 'w') as out_file:
+        out_file.write(
+            '<?xml version="1.0" encoding="UTF-8"?><Workspace><Groups>%s</Groups>'
+            '<SampleList>%s</SampleList></Workspace>' % (groups_xml, sample_xml)
+        )
+
+    return xml_path
+
+
+def test_workspace_indexes(indexed_workspace_path):
+    workspace = Workspace(indexed_workspace_path)
+
+    # samples without a filename and groups without gates aren't stored
+    assert sorted(workspace.samples) == ['1', '2', '3']
+    assert sorted(workspace.groups) == ['1', '2', '4']
+    assert list(workspace.samples['1']['populations']) == ['A']
+    assert workspace.groups['2']['samples'] == ['2', '3']
+
+    # the first sample with a matching filename
+    assert workspace.find_matching_gate_hierarchies('/data/a.fcs') == {
+        'sample_id': '1',
+        'groups': ['1', '4']
+    }
+    assert workspace.find_matching_gate_hierarchies('b.fcs') == {
+        'sample_id': '2',
+        'groups': ['1', '2']
+    }
+
+    with pytest.warns(UserWarning):
+        assert workspace.find_matching_gate_hierarchies('c.fcs') is None
+
+
+def test_workspace_load_selected_hierarchies(indexed_workspace_path):
+    workspace = Workspace(indexed_workspace_path, sample_ids=[3], group_ids=['2'])
+
+    assert list(workspace.samples) == ['3']
+    assert list(workspace.groups) == ['2']
+
+    # filenames are indexed for all samples, groups only for the loaded groups
+    assert workspace.find_matching_gate_hierarchies('a.fcs') == {
+        'sample_id': '1',
+        'groups': []
+    }
+    assert workspace.find_matching_gate_hierarchies('b.fcs') == {
+        'sample_id': '2',
+        'groups': ['2']
+    }
+
+
+def test_workspace_matches_tree_parsing(synthetic_data, example_workspace_path):
+    from xml.etree import ElementTree
+    from flowpy.models.workspace import find_nested_populations
+
+    for xml_path in (synthetic_data['xml_path'], example_workspace_path):
+        workspace = Workspace(xml_path)
+        root = ElementTree.parse(xml_path).getroot()
+
+        for group_element in root.iter('GroupNode'):
+            group_id = group_element.attrib['groupID']
+            populations = find_nested_populations(group_element)
+
+            if len(populations) > 0:
+                assert workspace.groups[group_id]['populations'] == populations
+            else:
+                assert group_id not in workspace.groups
+
+        for sample_element in root.iter('Sample'):
+            sample_id = sample_element.attrib['sampleID']
+
+            assert workspace.samples[sample_id]['populations'] == \
+                find_nested_populations(sample_element.find('SampleNode'))
+
+
+GATING_ML_NAMESPACES = (
+    'xmlns:gating="http://www.isac-net.org/std/Gating-ML/v2.0/gating" '
+    'xmlns:data-type="http://www.isac-net.org/std/Gating-ML/v2.0/datatypes"'
+)
+
+
+def _dimension_xml(label, attributes=''):
+    return (
+        '<gating:dimension %s><data-type:fcs-dimension data-type:name="%s" />'
+        '</gating:dimension>' % (attributes, label)
+    )
+
+
+# FlowJo 10 style populations, with Gating-ML gates wrapped in Gate elements
+FLOWJO_10_POPULATIONS = {
+    'Range': (
+        '<gating:RectangleGate>%s</gating:RectangleGate>' %
+        _dimension_xml('FL1-A', 'gating:min="100000" gating:max="150000"')
+    ),
+    'Rectangle': (
+        '<gating:RectangleGate>%s%s</gating:RectangleGate>' % (
+            _dimension_xml('FL1-A', 'gating:min="50000"'),
+            _dimension_xml('FL2-A', 'gating:max="120000"')
+        )
+    ),
+    'Ellipse': (
+        '<gating:EllipsoidGate>%s%s'
+        '<gating:mean><gating:coordinate data-type:value="120000" />'
+        '<gating:coordinate data-type:value="100000" /></gating:mean>'
+        '<gating:covarianceMatrix>'
+        '<gating:row><gating:entry data-type:value="4e8" />'
+        '<gating:entry data-type:value="1e8" /></gating:row>'
+        '<gating:row><gating:entry data-type:value="1e8" />'
+        '<gating:entry data-type:value="3e8" /></gating:row>'
+        '</gating:covarianceMatrix>'
+        '<gating:distanceSquare data-type:value="2" /></gating:EllipsoidGate>'
+    ) % (_dimension_xml('FL1-A'), _dimension_xml('FL2-A')),
+    'Quad': (
+        '<gating:QuadrantGate>'
+        '<gating:divider gating:id="d1">%s<gating:value>120000</gating:value></gating:divider>'
+        '<gating:divider gating:id="d2">%s<gating:value>90000</gating:value></gating:divider>'
+        '<gating:Quadrant gating:id="q1">'
+        '<gating:position gating:divider_ref="d1" gating:location="200000" />'
+        '<gating:position gating:divider_ref="d2" gating:location="0" /></gating:Quadrant>'
+        '</gating:QuadrantGate>'
+    ) % (
+        '<data-type:fcs-dimension data-type:name="FL1-A" />',
+        '<data-type:fcs-dimension data-type:name="FL2-A" />'
+    ),
+    'Polygon': (
+        '<gating:PolygonGate>%s%s%s</gating:PolygonGate>' % (
+            _dimension_xml('FL1-A'),
+            _dimension_xml('FL2-A'),
+            ''.join(
+                '<gating:vertex><gating:coordinate data-type:value="%r" />'
+                '<gating:coordinate data-type:value="%r" /></gating:vertex>' % v
+                for v in [(50000.0, 50000.0), (200000.0, 60000.0), (120000.0, 200000.0)]
+            )
+        )
+    )
+}
+
+
+def _expected_flowjo_10_mask(label, x, y):
+    if label == 'Range':
+        return (x >= 100000) & (x < 150000)
+    elif label == 'Rectangle':
+        return (x >= 50000) & (y < 120000)
+    elif label == 'Ellipse':
+        diff = np.column_stack((x - 120000, y - 100000))
+        inverse = np.linalg.inv([[4e8, 1e8], [1e8, 3e8]])
+        return (diff.dot(inverse) * diff).sum(axis=1) <= 2
+    elif label == 'Quad':
+        return (x >= 120000) & (y < 90000)
+
+    from flowpy.models import gate
+
+    vertices = np.array([[50000, 50000], [200000, 60000], [120000, 200000]], dtype=float)
+    return gate.points_in_polygon(x, y, vertices)
+
+
+def _write_flowjo_10_workspace(xml_path, populations_xml):
+    with open(xml_path, 'w') as out_file:
+        out_file.write(
+            '<?xml version="1.0" encoding="UTF-8"?><Workspace %s><Groups>'
+            '<GroupNode groupID="1" nodeName="All"><Group><SampleRefs>'
+            '<SampleRef sampleID="1" /></SampleRefs></Group>%s</GroupNode></Groups>'
+            '<SampleList></SampleList></Workspace>' % (GATING_ML_NAMESPACES, populations_xml)
+        )
+
+
+def test_flowjo_10_gates(synthetic_data, tmp_path):
+    xml_path = str(tmp_path / 'flowjo_10.xml')
+    _write_flowjo_10_workspace(xml_path, ''.join(
+        '<Population nodeName="%s"><Gate gating:id="%s">%s</Gate></Population>' %
+        (label, label, gate_xml) for label, gate_xml in FLOWJO_10_POPULATIONS.items()
+    ))
+    workspace = Workspace(xml_path)
+    populations = workspace.groups['1']['populations']
+
+    assert dict((label, p['gates'][0]['type']) for label, p in populations.items()) == {
+        'Range': 'Rectangle',
+        'Rectangle': 'Rectangle',
+        'Ellipse': 'Ellipsoid',
+        'Quad': 'Quad',
+        'Polygon': 'Polygon'
+    }
+
+    fcs_path = synthetic_data['fcs_paths'][0]
+    results = workspace.analyze_sample(fcs_path, None, 'group', 1, membership=True)
+
+    s = Sample(fcs_path)
+    s.compensate_events(None)
+    events = np.asarray(s.events_compensated, dtype=np.float64)
+    channels = s.get_channel_numbers_by_channel_labels()
+    x = events[:, channels['FL1-A'] - 1]
+    y = events[:, channels['FL2-A'] - 1]
+
+    for label in FLOWJO_10_POPULATIONS:
+        expected = _expected_flowjo_10_mask(label, x, y)
+
+        assert expected.any()
+        np.testing.assert_array_equal(results['membership'].get_mask('/' + label), expected)
+
+
+def test_unsupported_gate_element(synthetic_data, tmp_path):
+    xml_path = str(tmp_path / 'unsupported.xml')
+    _write_flowjo_10_workspace(
+        xml_path,
+        '<Population nodeName="Curly"><Gate><gating:CurlyQuadGate /></Gate></Population>'
+    )
+
+    # the workspace loads, but gating the population fails
+    workspace = Workspace(xml_path)
+
+    assert workspace.groups['1']['populations']['Curly']['gates'] == [
+        {'type': None, 'element': 'CurlyQuadGate'}
+    ]
+
+    with pytest.raises(ValueError, match='unsupported gate element: CurlyQuadGate'):
+        workspace.analyze_sample(synthetic_data['fcs_paths'][0], None, 'group', 1)
+
+
+def test_iter_analyze_prefetched(workspace, synthetic_data):
+    fcs_paths = synthetic_data['fcs_paths']
+    missing_path = os.path.join(os.path.dirname(fcs_paths[0]), 'missing.fcs')
+    paths = [fcs_paths[1], missing_path, fcs_paths[0], fcs_paths[1]]
+
+    results = list(workspace.iter_analyze_prefetched((p for p in paths), None, 'group', 1))
+
+    # results are in the order of the files, failures don't stop the batch
+    assert [r[0] for r in results] == paths
+    assert results[1][1] is None and 'missing.fcs' in results[1][2]
+
+    for fcs_path, report, error in results[:1] + results[2:]:
+        assert error is None
+        pd.testing.assert_frame_equal(
+            report,
+            workspace.analyze_sample(fcs_path, None, 'group', 1)['report']
+        )
+
+    with pytest.raises(ValueError):
+        list(workspace.iter_analyze_prefetched(paths, None, 'group', 1, prefetch=0))
+
+
+@pytest.mark.parametrize('prefetch', [1, 3])
+def test_prefetch_is_bounded(workspace, synthetic_data, prefetch):
+    requested = []
+
+    def fcs_paths():
+        for i in range(6):
+            requested.append(i)
+            yield synthetic_data['fcs_paths'][i % 2]
+
+    for i, (_, future) in enumerate(workspace._iter_prefetched_samples(fcs_paths(), prefetch)):
+        # the yielded file and at most prefetch files read ahead of it
+        assert len(requested) <= i + 1 + prefetch
+        assert future.result().event_count > 0
+
+    assert len(requested) == 6
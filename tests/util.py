@@ -0,0 +1,32 @@
+"""
+Helpers shared by the test modules
+"""
+
+
+def make_channel_labels(labels):
+    """
+    Returns a channel labels dictionary (keyed by channel number) for a list
+    of PnN labels, in the format of Sample.channels
+    """
+    return dict((str(i + 1), {'PnN': label}) for i, label in enumerate(labels))
+
+
+def find_populations(populations, gate_type=None):
+    """
+    Returns a list of (path, population) tuples of a gating hierarchy, parents
+    before children, optionally only populations with the given gate type
+    """
+    found = []
+
+    def walk(level, parent_path):
+        for label, population in level.items():
+            path = '%s/%s' % (parent_path, label)
+
+            if gate_type is None or population['gates'][0]['type'] == gate_type:
+                found.append((path, population))
+
+            walk(population['children'], path)
+
+    walk(populations, '')
+
+    return found